@@ -0,0 +1,572 @@
+#!/usr/bin/env python
+
+"""The backend as a native ASGI (Starlette) app, served with uvicorn workers:
+
+    gunicorn --bind 0.0.0.0:5000 -w 4 -k uvicorn.workers.UvicornWorker asgiBackend:app
+
+It answers the same routes as the Flask app in `backend.py` and shares its
+store, caches and route functions. The event loop only parses requests and
+sends responses: anything that touches the disk, a lock or Keycloak runs
+in a bounded pool of threads (`ASGI_IO_THREADS`, with writes limited
+separately to `ASGI_WRITE_THREADS` so a queue of writers cannot starve
+the reads), and the JSON store's catalog lock is waited for with
+non-blocking attempts rather than a blocking `flock`.
+"""
+
+import io
+import os
+import json
+import time
+from contextlib import asynccontextmanager, nullcontext
+import anyio
+from starlette import status
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Match, Route
+from werkzeug.exceptions import BadRequest, HTTPException
+from werkzeug.http import parse_accept_header, parse_etags
+import backend
+from backend import (AuthenticationError, EVENTS_HEARTBEAT_SECONDS, EVENTS_STREAM_SECONDS, LOCK_SCAN_TIMEOUT_SECONDS,
+                     PAGE_ARGS, content_etag, delete_writeable_model, encoded_body, events, json_array_chunks,
+                     locked_response, models_etag, responses, sse_frame, store, validate_admin, validate_token,
+                     validation_check)
+from modelStore import LockTimeout
+from modelCache import CacheEntry
+from httpCompression import compress_stream, decompressing_stream, negotiate
+import serverMetrics
+import lockStats
+import requestProfiler
+import trafficCapture
+
+# threads for requests' disk, lock and Keycloak work, per worker
+io_limiter = anyio.CapacityLimiter(int(os.environ.get('ASGI_IO_THREADS', 32)))
+# of those, how many may be writing (and waiting for the catalog or a model's lock) at once
+write_limiter = anyio.CapacityLimiter(int(os.environ.get('ASGI_WRITE_THREADS', 8)))
+MAX_REQUEST_BYTES = int(os.environ.get('MAX_REQUEST_BYTES', 64 * 1024 * 1024))
+
+def json_bytes(data) -> bytes:
+    """json_bytes(data) -> the same bytes as Flask's `jsonify(data)`"""
+    return (backend.app.json.dumps(data, separators=(',', ':')) + '\n').encode('utf-8')
+
+def accept_encodings(request: Request):
+    return parse_accept_header(request.headers.get('accept-encoding'))
+
+def send(request: Request, entry: CacheEntry, status_code=status.HTTP_200_OK) -> Response:
+    """send(request, entry) -> the response body in `entry`, compressed as the client accepts"""
+    headers = dict(entry.value['headers'])
+    headers['Vary'] = 'Accept-Encoding'
+    encoding = negotiate(accept_encodings(request))
+    body = encoded_body(entry, encoding)
+    if body is None:
+        return Response(entry.value['identity'], status_code, headers=headers)
+    headers['Content-Encoding'] = encoding
+    if entry.stamp:
+        headers['ETag'] = f'"{entry.stamp}-{encoding}"'
+    return Response(body, status_code, headers=headers)
+
+def respond(request: Request, result) -> Response:
+    """respond(request, (body, status[, headers])) -> Response
+
+       Takes the results of the route functions shared with the Flask app
+       and encodes them the same way: dicts as JSON, strings as HTML. A 200
+       with an ETag header is cached like the Flask app's.
+    """
+    if isinstance(result, Response):
+        return result
+    body, status_code, *rest = result
+    headers = {key: str(value) for key, value in (rest[0] if rest else {}).items()}
+    if isinstance(body, (dict, list)):
+        data = json_bytes(body)
+        headers['Content-Type'] = 'application/json'
+    else:
+        data = body.encode('utf-8')
+        headers['Content-Type'] = 'text/html; charset=utf-8'
+    if status_code != status.HTTP_200_OK:
+        return Response(data, status_code, headers=headers)
+    etag = headers.get('ETag', '').strip('"') or None
+    entry = CacheEntry(etag, len(data), value={'identity': data, 'headers': list(headers.items())})
+    if etag:
+        responses.insert(etag, entry)
+    return send(request, entry)
+
+def cached(request: Request, etag: str) -> Response | None:
+    """cached(request, etag) -> a 304 if the client already has `etag`, else the
+       response cached for `etag`, else None
+    """
+    encoding = negotiate(accept_encodings(request))
+    if_none_match = parse_etags(request.headers.get('if-none-match'))
+    for known in (etag, f'{etag}-{encoding}'):
+        if if_none_match.contains(known):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': f'"{known}"'})
+    entry = responses.lookup(etag, etag)
+    return send(request, entry) if entry is not None else None
+
+def json_array(request: Request, items, etag: str) -> Response:
+    """json_array(request, items, etag) -> the JSON array of `items`, streamed
+       like the Flask app's, with every chunk produced in the I/O pool
+    """
+    if not backend.STREAM_RESPONSES:
+        return respond(request, (list(items), status.HTTP_200_OK, {'ETag': f'"{etag}"'}))
+    chunks = json_array_chunks(items, etag)
+    headers = {'ETag': f'"{etag}"', 'Vary': 'Accept-Encoding'}
+    if encoding := negotiate(accept_encodings(request)):
+        chunks = compress_stream(chunks, encoding)
+        headers.update({'ETag': f'"{etag}-{encoding}"', 'Content-Encoding': encoding})
+
+    async def body():
+        while (chunk := await anyio.to_thread.run_sync(next, chunks, None, limiter=io_limiter)) is not None:
+            yield chunk
+    return StreamingResponse(body(), media_type='application/json', headers=headers)
+
+def authenticate(request: Request, test_user=False) -> str:
+    """authenticate(request) -> username; raises AuthenticationError"""
+    test_username = request.headers.get('TestUsername', 'user1') if test_user else 'user1'
+    return validate_token(request.headers.get('Authorization'), test_username=test_username)
+
+def owner(request: Request, username: str) -> str:
+    return f"{username}/{request.headers.get('SessionTabId')}"
+
+async def in_pool(fn, *args, limiter=None) -> Response:
+    """in_pool(fn, request, *args) -> the response `fn` returns, run in the I/O pool
+
+       Authentication failures and HTTP errors raised by `fn` become their
+       responses.
+    """
+    def run():
+        # the threads of a profiled request are sampled while they serve it
+        if (profile := requestProfiler.current.get()) is not None:
+            profile.add_thread()
+        try:
+            return fn(*args)
+        except AuthenticationError as e:
+            return respond(args[0], (str(e), status.HTTP_401_UNAUTHORIZED))
+        except HTTPException as e:
+            return respond(args[0], (e.description, e.code))
+        except LockTimeout as e:
+            return respond(args[0], locked_response(e))
+        finally:
+            if profile is not None:
+                profile.remove_thread()
+    return await anyio.to_thread.run_sync(run, limiter=limiter or io_limiter)
+
+async def write(fn, *args, catalog=False) -> Response:
+    """write(fn, request, *args) -> `in_pool` for writes: a thread of both pools,
+       with the catalog lock held around `fn` if `catalog`
+    """
+    async with write_limiter:
+        try:
+            async with catalog_locked(args[0].path_params.get('id', '')) if catalog else nullcontext():
+                return await in_pool(fn, *args)
+        except LockTimeout as e: # waiting for the catalog lock; `in_pool` answers those in `fn`
+            return respond(args[0], locked_response(e))
+
+def catalog_locked(subject='', timeout=None):
+    """The JSON store's catalog lock, waited for without blocking the loop (the
+       SQLite store has none)
+    """
+    catalog = getattr(store, 'catalog_index', None)
+    return catalog.locked_async(subject, timeout) if catalog is not None else nullcontext()
+
+async def read_body(request: Request) -> bytes:
+    """read_body(request) -> the request body, decompressed like `DecompressRequests` does"""
+    body = await request.body()
+    encoding = request.headers.get('content-encoding', 'identity').strip().lower()
+    if encoding in ('', 'identity'):
+        return body
+    return await anyio.to_thread.run_sync(lambda: decompressing_stream(io.BytesIO(body), encoding, MAX_REQUEST_BYTES).read(),
+                                          limiter=io_limiter)
+
+def json_body(body: bytes):
+    try:
+        return json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        raise BadRequest('The request body is not valid JSON')
+
+# routes; each runs its sync part (named after the route) in the I/O pool
+
+def list_models(request: Request) -> Response:
+    authenticate(request)
+    if any(arg in request.query_params for arg in PAGE_ARGS):
+        try:
+            query = backend.page_query(request.query_params)
+        except ValueError as e:
+            return respond(request, (str(e), status.HTTP_400_BAD_REQUEST))
+        owners = store.locks.owners()
+        etag = content_etag('index', store.catalog_etag(), owners, sorted(request.query_params.items()))
+        if response := cached(request, etag):
+            return response
+        page = backend.model_page_of(owners, **query)
+        return respond(request, (page, status.HTTP_200_OK, {} if 'stale' in page else {'ETag': f'"{etag}"'}))
+    stale = backend.migrated(store.outdated())
+    owners = store.locks.owners()
+    etag = content_etag('index', store.catalog_etag(), owners, stale)
+    if not stale:
+        return cached(request, etag) or json_array(request, backend.listed_models(store.catalog(), owners), etag)
+    response = json_array(request, backend.listed_models(store.catalog(), owners), etag)
+    response.headers['Stale-Models'] = ','.join(stale)
+    return response
+
+def get_model(request: Request) -> Response:
+    username = authenticate(request, test_user=True)
+    result = backend.opened_model(request.path_params['id'], owner(request, username), lambda etag: cached(request, etag))
+    return respond(request, result)
+
+def export_model(request: Request) -> Response:
+    authenticate(request)
+    id = request.path_params['id']
+    try:
+        etag = content_etag('export', store.etag(id))
+    except FileNotFoundError:
+        return respond(request, ("No file of that name exists", status.HTTP_404_NOT_FOUND))
+    if response := cached(request, etag):
+        return response
+    try:
+        full_data = store.load_cached(id)
+    except json.JSONDecodeError:
+        return respond(request, ("Can't open model; JSON file is corrupted!", status.HTTP_500_INTERNAL_SERVER_ERROR))
+    data = json.dumps(full_data, indent=2).encode('utf-8')
+    headers = [('Content-Disposition', f'inline; filename={id}.json'), ('Content-Type', 'application/json'),
+               ('Cache-Control', 'no-cache'), ('ETag', f'"{etag}"')]
+    entry = CacheEntry(etag, len(data), value={'identity': data, 'headers': headers})
+    responses.insert(etag, entry)
+    return send(request, entry)
+
+def import_model(request: Request, filename: str, content: bytes) -> Response:
+    authenticate(request)
+    return respond(request, backend.imported_model(filename, content))
+
+def post_model(request: Request, body: bytes) -> Response:
+    username = authenticate(request, test_user=True)
+    id = request.path_params['id']
+    if not validation_check(id):
+        return respond(request, ('Model could not be created due to an invalid name', status.HTTP_400_BAD_REQUEST))
+    if request.headers.get('Content-Type') != 'application/json':
+        return respond(request, ('Content-Type not supported!', status.HTTP_415_UNSUPPORTED_MEDIA_TYPE))
+    return respond(request, backend.created_model(id, json_body(body), owner(request, username)))
+
+def put_model(request: Request, body: bytes) -> Response:
+    username = authenticate(request, test_user=True)
+    id = request.path_params['id']
+    if not validation_check(id):
+        return respond(request, ('Model could not be created due to an invalid name', status.HTTP_400_BAD_REQUEST))
+    if request.headers.get('Content-Type') != 'application/json':
+        return respond(request, ('Content-Type not supported!', status.HTTP_415_UNSUPPORTED_MEDIA_TYPE))
+    return respond(request, backend.replaced_model(id, lambda: json_body(body), owner(request, username)))
+
+def patch_model(request: Request, body: bytes) -> Response:
+    username = authenticate(request, test_user=True)
+    id = request.path_params['id']
+    if not validation_check(id):
+        return respond(request, ('Unallowed Model Name', status.HTTP_400_BAD_REQUEST))
+    if request.headers.get('Content-Type') not in ('application/json-patch+json', 'application/json'):
+        return respond(request, ('Content-Type not supported!', status.HTTP_415_UNSUPPORTED_MEDIA_TYPE))
+    revision = request.headers.get('Model-Revision', '')
+    if not revision.isdigit():
+        return respond(request, ('Model-Revision header required', status.HTTP_428_PRECONDITION_REQUIRED))
+    return respond(request, backend.patched_model(id, int(revision), lambda: json_body(body), owner(request, username)))
+
+def delete_model(request: Request) -> Response:
+    authenticate(request)
+    id = request.path_params['id']
+    if not validation_check(id):
+        return respond(request, ('Unallowed Model Name', status.HTTP_400_BAD_REQUEST))
+    return respond(request, delete_writeable_model(id))
+
+def return_all_by_user(request: Request) -> Response:
+    username = authenticate(request, test_user=True)
+    sessionId, _ = request.headers.get('SessionTabId', '').split('/')
+    return respond(request, backend.returned_session(username, sessionId))
+
+def return_model(request: Request, body: bytes) -> Response:
+    authenticate(request)
+    if request.headers.get('Content-Type') != 'application/json':
+        return respond(request, ('Content-Type not supported!', status.HTTP_415_UNSUPPORTED_MEDIA_TYPE))
+    return respond(request, backend.returned_model(request.path_params['id'], lambda: json_body(body)))
+
+def get_IFs(request: Request) -> Response:
+    authenticate(request)
+    etag = content_etag('idealFunctionalities', store.catalog_etag())
+    return cached(request, etag) or json_array(request, backend.ideal_functionalities(), etag)
+
+def get_comps(request: Request) -> Response:
+    authenticate(request)
+    etag = content_etag('compInterfaces', store.catalog_etag())
+    return cached(request, etag) or json_array(request, backend.comp_interfaces(), etag)
+
+def get_messages_of_IF(request: Request) -> Response:
+    authenticate(request)
+    id = request.path_params['id']
+    model_ids = store.models_referencing('idealFunctionality', id)
+    etag = models_etag('idealFunctionalityMessages', id, model_ids=model_ids)
+    return cached(request, etag) or json_array(request, backend.ideal_functionality_messages(id, model_ids), etag)
+
+def get_comp_messages(request: Request) -> Response:
+    authenticate(request)
+    id = request.path_params['id']
+    model_ids = store.models_referencing('compInter', id)
+    etag = models_etag('compInterMessages', id, model_ids=model_ids)
+    return cached(request, etag) or json_array(request, backend.comp_interface_messages(id, model_ids), etag)
+
+def lock_contention(request: Request) -> Response:
+    validate_admin(request.headers.get('Authorization'))
+    top = request.query_params.get('top', '')
+    return respond(request, (lockStats.stats.report(int(top) if top.isdigit() else None), status.HTTP_200_OK))
+
+class EventFeed:
+    """Wakes this worker's event streams from one thread waiting on `events`,
+       so an open stream costs a coroutine rather than a thread.
+    """
+
+    def __init__(self):
+        self.seq = 0
+        self.changed = anyio.Event()
+
+    async def run(self) -> None:
+        self.seq = events.last()
+        while True:
+            batch = await anyio.to_thread.run_sync(events.wait, self.seq, EVENTS_HEARTBEAT_SECONDS, abandon_on_cancel=True)
+            if batch:
+                self.seq = batch[-1]['id']
+                self.changed.set()
+                self.changed = anyio.Event()
+
+    async def wait(self, seq: int, timeout: float) -> None:
+        """Returns once there are events after `seq`, or after `timeout` seconds."""
+        with anyio.move_on_after(timeout):
+            while self.seq <= seq:
+                await self.changed.wait()
+
+feed = EventFeed()
+
+def open_events(request: Request) -> Response | tuple[int, set | None]:
+    """The sync part of GET /model/events: -> (event to resume after, models) or an error response"""
+    token = request.headers.get('Authorization') or request.query_params.get('access_token')
+    if token and not token.startswith('Bearer'):
+        token = f'Bearer {token}'
+    validate_token(token)
+    models = set(filter(None, request.query_params.get('models', '').split(','))) or None
+    resume = request.headers.get('Last-Event-ID') or request.query_params.get('lastEventId')
+    try:
+        seq = int(resume) if resume else events.last()
+    except ValueError:
+        return respond(request, ('Last-Event-ID must be an event id', status.HTTP_400_BAD_REQUEST))
+    return min(seq, events.last()), models
+
+async def model_events(request: Request) -> Response:
+    """GET /model/events, as in the Flask app"""
+    opened = await in_pool(open_events, request)
+    if isinstance(opened, Response):
+        return opened
+    seq, models = opened
+
+    async def stream(seq):
+        yield f'retry: {EVENTS_HEARTBEAT_SECONDS * 1000}\n\n'.encode('utf-8')
+        sent = anyio.current_time()
+        deadline = sent + EVENTS_STREAM_SECONDS
+        while (remaining := deadline - anyio.current_time()) > 0:
+            await feed.wait(seq, min(EVENTS_HEARTBEAT_SECONDS, remaining))
+            batch = events.buffered(seq)
+            if batch is None:
+                batch = await anyio.to_thread.run_sync(events.since, seq, limiter=io_limiter)
+            if batch:
+                seq = batch[-1]['id']
+            frames = [sse_frame(event) for event in batch if models is None or event['model'] in models]
+            if frames:
+                yield b''.join(frames)
+            elif anyio.current_time() - sent >= EVENTS_HEARTBEAT_SECONDS:
+                yield b': keepalive\n\n'
+            else:
+                continue
+            sent = anyio.current_time()
+
+    return StreamingResponse(stream(seq), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+async def index_route(request: Request) -> Response:
+    paged = any(arg in request.query_params for arg in PAGE_ARGS)
+    if not paged and await anyio.to_thread.run_sync(store.outdated, limiter=io_limiter):
+        # migrating takes the catalog lock; if it is busy, the list says which models are stale
+        try:
+            async with write_limiter, catalog_locked(timeout=LOCK_SCAN_TIMEOUT_SECONDS):
+                return await in_pool(list_models, request)
+        except LockTimeout:
+            pass
+    return await in_pool(list_models, request)
+
+async def import_route(request: Request) -> Response:
+    filename = request.path_params['filename']
+    async with request.form(max_part_size=MAX_REQUEST_BYTES) as form:
+        upload = form.get(filename)
+        if upload is None or isinstance(upload, str):
+            return Response('Bad Request', status.HTTP_400_BAD_REQUEST)
+        content = await upload.read()
+    return await write(import_model, request, filename, content)
+
+async def model_route(request: Request) -> Response:
+    match request.method:
+        case 'GET':
+            return await in_pool(get_model, request)
+        case 'POST':
+            return await write(post_model, request, await read_body(request))
+        case 'PUT':
+            return await write(put_model, request, await read_body(request))
+        case 'PATCH':
+            # the patch is applied under the catalog lock
+            return await write(patch_model, request, await read_body(request), catalog=True)
+        case 'DELETE':
+            return await write(delete_model, request, catalog=True)
+
+async def return_route(request: Request) -> Response:
+    return await write(return_model, request, await read_body(request))
+
+def pooled(fn):
+    async def endpoint(request: Request) -> Response:
+        return await in_pool(fn, request)
+    return endpoint
+
+@asynccontextmanager
+async def lifespan(app):
+    async with anyio.create_task_group() as tasks:
+        tasks.start_soon(feed.run)
+        yield
+        tasks.cancel_scope.cancel()
+
+async def metrics(request: Request) -> Response:
+    body, content_type = serverMetrics.exposition()
+    return Response(body, headers={'Content-Type': content_type})
+
+class RequestMetrics:
+    """Records each request in `serverMetrics` under the same route labels as the Flask app."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        route = next((route.path for route in routes if route.matches(scope)[0] == Match.FULL), 'unmatched')
+        stats = serverMetrics.begin(route.replace('{', '<').replace('}', '>'), scope['method'])
+        code = status.HTTP_500_INTERNAL_SERVER_ERROR
+
+        async def sent(message):
+            nonlocal code
+            if message['type'] == 'http.response.start':
+                code = message['status']
+            await send(message)
+        try:
+            await self.app(scope, receive, sent)
+        finally:
+            serverMetrics.finish(stats, code)
+
+class RequestProfiling:
+    """Profiles requests with `requestProfiler`, when PROFILE_DIR is set.
+
+       Only the pool threads serving a request are sampled, not the event
+       loop, whose stack at any moment may belong to any request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        header = headers.get(requestProfiler.PROFILE_HEADER)
+        if header:
+            # the admin check behind the header verifies a token, so it runs in the pool
+            profiled = await anyio.to_thread.run_sync(requestProfiler.wanted, header,
+                                                      lambda: backend.is_admin(headers.get('authorization')),
+                                                      limiter=io_limiter)
+        else:
+            profiled = requestProfiler.wanted(header, None)
+        if not profiled:
+            return await self.app(scope, receive, send)
+        route, params = next(((route.path, child['path_params']) for route in routes
+                              for match, child in [route.matches(scope)] if match == Match.FULL), ('unmatched', {}))
+        profile = requestProfiler.begin(scope['method'], route.replace('{', '<').replace('}', '>'), params.get('id', ''),
+                                        int(headers.get('content-length', 0)), sample_caller=False)
+        code, size = status.HTTP_500_INTERNAL_SERVER_ERROR, 0
+
+        async def sent(message):
+            nonlocal code, size
+            if message['type'] == 'http.response.start':
+                code = message['status']
+                message['headers'] = [*message.get('headers', []),
+                                      (requestProfiler.PROFILE_FILE_HEADER.lower().encode(), profile.filename.encode())]
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+        try:
+            await self.app(scope, receive, sent)
+        finally:
+            await anyio.to_thread.run_sync(profile.finish, code, size, limiter=io_limiter)
+
+class TrafficCapture:
+    """Records each request in `trafficCapture`, when TRAFFIC_CAPTURE_FILE is set."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        stats = serverMetrics.current.get()
+        body, code, size = [], status.HTTP_500_INTERNAL_SERVER_ERROR, 0
+
+        async def received():
+            message = await receive()
+            if message['type'] == 'http.request':
+                body.append(message.get('body', b''))
+            return message
+
+        async def sent(message):
+            nonlocal code, size
+            if message['type'] == 'http.response.start':
+                code = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+        try:
+            await self.app(scope, received, sent)
+        finally:
+            path = scope['path'] + (f'?{scope["query_string"].decode("utf-8")}' if scope.get('query_string') else '')
+            headers = Headers(scope=scope)
+            await anyio.to_thread.run_sync(
+                trafficCapture.capture.record, scope['method'], stats.route, path,
+                {name: headers[name] for name in trafficCapture.HEADERS if name in headers}, b''.join(body),
+                code, size, time.perf_counter() - stats.start, limiter=io_limiter)
+
+async def http_error(request: Request, e: HTTPException) -> Response:
+    return Response(e.description, e.code)
+
+routes = [
+    Route('/model', index_route, methods=['GET']),
+    Route('/model/events', model_events, methods=['GET']),
+    Route('/model/return', pooled(return_all_by_user), methods=['GET']),
+    Route('/model/return/{id}', return_route, methods=['PUT']),
+    Route('/model/export/{id}', pooled(export_model), methods=['GET']),
+    Route('/model/import/{filename}', import_route, methods=['POST']),
+    Route('/model/idealFunctionalities', pooled(get_IFs), methods=['GET']),
+    Route('/model/idealFunctionalities/{id}/messages', pooled(get_messages_of_IF), methods=['GET']),
+    Route('/model/compInterfaces', pooled(get_comps), methods=['GET']),
+    Route('/model/compInterfaces/{id}/messages', pooled(get_comp_messages), methods=['GET']),
+    Route('/model/{id}', model_route, methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE']),
+    Route('/admin/locks', pooled(lock_contention), methods=['GET']),
+    Route('/metrics', metrics, methods=['GET']),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(RequestMetrics),
+                *([Middleware(TrafficCapture)] if trafficCapture.capture is not None else []),
+                *([Middleware(RequestProfiling)] if requestProfiler.PROFILE_DIR else []),
+                Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+                                           expose_headers=['Model-Revision', 'ETag', 'Stale-Models'])],
+    exception_handlers={HTTPException: http_error},
+    lifespan=lifespan,
+)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import os
+import threading
+from contextlib import suppress
+
+# MODEL_FSYNC: 'on' fsyncs every write before it returns, 'group' shares the
+# fsyncs of concurrent writes in a worker, 'off' only renames (not crash-safe).
+FSYNC_MODES = ('on', 'group', 'off')
+
+def fsync_mode() -> str:
+    mode = os.environ.get('MODEL_FSYNC', 'on')
+    if mode not in FSYNC_MODES:
+        raise ValueError(f'Unknown MODEL_FSYNC "{mode}"')
+    return mode
+
+def fsync_directory(directory: str) -> None:
+    """Make the renames in `directory` durable."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class GroupCommit:
+    """GroupCommit() -> fsyncs shared between concurrent writers
+
+       A writer queues its written temp file and waits. The first waiting
+       writer becomes the leader: it fsyncs every queued file, renames each
+       over its target and fsyncs each directory once for the whole batch,
+       while writers arriving meanwhile queue up for the next batch. Each
+       writer gets back the error (if any) of its own file.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = []
+        self.results = {}
+        self.next_ticket = 0
+        self.flushing = False
+        self.writes = 0
+        self.batches = 0
+
+    def commit(self, fd: int, tmp_path: str, filename: str) -> None:
+        with self.cond:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.pending.append((ticket, fd, tmp_path, filename))
+            while ticket not in self.results:
+                if self.flushing:
+                    self.cond.wait()
+                    continue
+                batch, self.pending = self.pending, []
+                self.flushing = True
+                self.cond.release()
+                try:
+                    results = self._flush(batch)
+                finally:
+                    self.cond.acquire()
+                    self.flushing = False
+                self.results.update(results)
+                self.writes += len(batch)
+                self.batches += 1
+                self.cond.notify_all()
+            error = self.results.pop(ticket)
+        if error is not None:
+            raise error
+
+    def _flush(self, batch) -> dict:
+        results = {}
+        directories = {}
+        for ticket, fd, tmp_path, filename in batch:
+            try:
+                os.fsync(fd)
+                os.replace(tmp_path, filename)
+            except OSError as e:
+                results[ticket] = e
+                continue
+            results[ticket] = None
+            directories.setdefault(os.path.dirname(filename) or '.', []).append(ticket)
+        for directory, tickets in directories.items():
+            try:
+                fsync_directory(directory)
+            except OSError as e:
+                for ticket in tickets:
+                    results[ticket] = e
+        return results
+
+group_commit = GroupCommit()
+
+def atomic_write(filename: str, data: bytes, fsync: str | None = None) -> tuple[int, int, int]:
+    """atomic_write(filename, data, fsync=MODEL_FSYNC) -> stamp of the new file
+
+       Replaces `filename` with `data` by writing a temp file next to it and
+       renaming it over the target, so readers see either the old or the
+       new contents and never a truncated file, without taking any lock.
+       With fsync 'on' or 'group' the file and the rename are also on disk
+       when this returns. The returned (mtime_ns, size, inode) stamp equals
+       `modelCache.file_stamp(filename)` for as long as this write is current.
+    """
+    if fsync is None:
+        fsync = fsync_mode()
+    tmp_path = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+            fp.flush()
+            st = os.fstat(fp.fileno())
+            match fsync:
+                case 'on':
+                    os.fsync(fp.fileno())
+                    os.replace(tmp_path, filename)
+                    fsync_directory(os.path.dirname(filename) or '.')
+                case 'group':
+                    group_commit.commit(fp.fileno(), tmp_path, filename)
+                case 'off':
+                    os.replace(tmp_path, filename)
+                case _:
+                    raise ValueError(f'Unknown fsync mode "{fsync}"')
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    return st.st_mtime_ns, st.st_size, st.st_ino
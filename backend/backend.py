@@ -1,25 +1,57 @@
 #!/usr/bin/env python
 
 import os
-import fcntl
-import logging
-from contextlib import contextmanager
 import json
 import re
-from flask import Flask, jsonify, request, send_file
+import base64
+import threading
+from contextlib import closing
+from flask import Flask, Response, jsonify, request, send_file
+from werkzeug.exceptions import Forbidden
 from starlette import status
 from flask_cors import CORS
-import jwt
 from jwt.exceptions import InvalidTokenError
-import requests
 import time
 import datetime
-from pathlib import Path
 from io import BytesIO
-from reconciliationScript import convert_files
+from modelStore import get_store, content_etag, LockTimeout, RevisionConflict
+from jsonPatch import JsonPatchError
+from modelCatalog import SORT_KEYS, interface_index, sort_key
+from modelCache import CacheEntry, ModelCache
+from httpCompression import DecompressRequests, MIN_COMPRESS_BYTES, compress, compress_stream, negotiate
+from jsonStream import iter_json_array
+from tokenAuth import KeyStore, TokenCache, verify_token
+from modelEvents import EventLog
+import serverMetrics
+import lockStats
+import requestProfiler
+import trafficCapture
+from serverMetrics import TOKEN_SECONDS, corrupted_hit
+from reconciliationScript import CURRENT_VERSION
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["Model-Revision", "ETag", "Stale-Models"])
+app.wsgi_app = DecompressRequests(app.wsgi_app, int(os.environ.get('MAX_REQUEST_BYTES', 64 * 1024 * 1024)))
+store = get_store()
+# serialized (and compressed) responses by ETag
+responses = ModelCache(int(os.environ.get('RESPONSE_CACHE_BYTES', 32 * 1024 * 1024)), 'response')
+# STREAM_RESPONSES=off builds the model and message lists in memory before sending them
+STREAM_RESPONSES = os.environ.get('STREAM_RESPONSES', 'on') != 'off'
+# lock and change notifications, shared by all workers through the lock registry's database
+events = EventLog(store.locks.database)
+# an idle event stream sends a comment this often, so proxies keep it open
+EVENTS_HEARTBEAT_SECONDS = 15
+# streams end after this long; EventSource reconnects and resumes from its last event
+EVENTS_STREAM_SECONDS = int(os.environ.get('EVENTS_STREAM_SECONDS', 3600))
+# each open stream holds one of the worker's threads until it ends; past this
+# many, /model/events answers 503 so the other routes keep threads to run on
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 32))
+EVENTS_RETRY_AFTER_SECONDS = 30
+stream_slots = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+# how long the model list waits for a busy lock to migrate a model before listing it as it is
+LOCK_SCAN_TIMEOUT_SECONDS = float(os.environ.get('LOCK_SCAN_TIMEOUT_SECONDS', 0))
+# Retry-After of a 423 response to a write that timed out waiting for a lock
+LOCK_RETRY_AFTER_SECONDS = int(os.environ.get('LOCK_RETRY_AFTER_SECONDS', 1))
 
 def validation_check(id):
     regexcheck = re.compile("^(?!UC_)(?!.*__)(?!.*[^A-Za-z_0-9])(?!.*_$)[A-Z][A-Za-z_0-9]*")
@@ -29,67 +61,191 @@ def validation_check(id):
     else:
         return True
 
-def wait_exists(filename, wait_time=0.25, wait_max=1):
-    """wait_exists(filename, wait_time=0.25, wait_max=1) -> bool
+def cached_response(etag: str):
+    """cached_response(etag) -> a 304 if the client already has `etag`, else the
+       response cached for `etag`, else None
+    """
+    encoding = negotiate(request.accept_encodings)
+    for known in (etag, f'{etag}-{encoding}'):
+        if request.if_none_match.contains(known):
+            return '', status.HTTP_304_NOT_MODIFIED, {'ETag': f'"{known}"'}
+    entry = responses.lookup(etag, etag)
+    if entry is None:
+        return None
+    return Response(entry.value['identity'], headers=entry.value['headers'])
+
+def with_etag(response, etag: str):
+    response.set_etag(etag)
+    return response
 
-       This functions waits for the specified max time (sleeping for the
-       specified wait time each iteration until either the time expires or
-       the file exists. If the file exists, this returns true.
+def json_array_chunks(items, etag: str):
+    """json_array_chunks(items, etag) -> chunks of the JSON array of `items`, put in
+       the response cache under `etag` once complete unless it outgrows the cache
     """
-    wait_counter = 0
-    while not os.path.exists(filename):
-        time.sleep(wait_time)
-        wait_counter += wait_time
-        if wait_counter > wait_max:
-            break
-
-    return os.path.exists(filename)
-
-@contextmanager
-def locked_open(filename, mode, lock_type):
-    """locked_open(filename, mode='r') -> <open file object>
-    
-       Context manager that on entry opens the path `filename`, using `mode`
-       (default: `r`), and applies an advisory write lock on the file which
-       is released when leaving the context. Yields the open file object for
-       use within the context.
+    kept, size = [], 0
+    for chunk in iter_json_array(items, lambda item: app.json.dumps(item, separators=(',', ':'))):
+        if kept is not None:
+            kept.append(chunk)
+            size += len(chunk)
+            if size > responses.max_bytes:
+                kept = None
+        yield chunk
+    if kept is not None:
+        headers = [('Content-Type', 'application/json'), ('ETag', f'"{etag}"')]
+        responses.insert(etag, CacheEntry(etag, size, value={'identity': b''.join(kept), 'headers': headers}))
+
+def json_array_response(items, etag: str):
+    """json_array_response(items, etag) -> 200 response with the JSON array of `items`
+
+       The array is streamed: elements are encoded (and compressed, as
+       negotiated) while `items` produces them, so the first bytes go out
+       before the last model is read and memory stays bounded by one chunk.
+       The identity body is kept on the way and lands in the response cache
+       once complete, unless it outgrows the cache.
     """
-    with open(filename, mode) as fd:
-        try:
-            fcntl.flock(fd, lock_type)
-            logging.debug(f'acquired lock on {filename}')
-            yield fd
-        finally:
-            logging.debug(f'releasing lock on {filename}')
-            fcntl.flock(fd, fcntl.LOCK_UN)
-
-def lock_model(fileName, username):
-    try:
-        with locked_open(fileName, 'r', fcntl.LOCK_EX) as fp:
-            data = json.load(fp)
-    except json.JSONDecodeError:
-        logging.debug(f'File {fileName} is corrupted!')
-        raise
+    if not STREAM_RESPONSES:
+        return with_etag(jsonify(list(items)), etag)
+    chunks = json_array_chunks(items, etag)
+    response = Response(chunks, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return with_etag(response, etag)
+    response.response = compress_stream(chunks, encoding)
+    response.headers['Content-Encoding'] = encoding
+    return with_etag(response, f'{etag}-{encoding}')
 
-    data['readOnly'] = username
+def locked_response(e: LockTimeout):
+    """locked_response(e) -> the 423 answering a write that timed out waiting for a lock"""
+    return f'Model storage is busy ({e}); try again', status.HTTP_423_LOCKED, {'Retry-After': LOCK_RETRY_AFTER_SECONDS}
 
-    with locked_open(fileName, 'w', fcntl.LOCK_EX) as fp:
-        json.dump(data, fp, indent=2)
+@app.errorhandler(LockTimeout)
+def lock_timeout(e):
+    return locked_response(e)
 
-def unlock_model(fileName):
-    try:
-        with locked_open(fileName, 'r', fcntl.LOCK_EX) as fp:
-            data = json.load(fp)
-    except json.JSONDecodeError:
-        logging.debug(f'File {fileName} is corrupted!')
-        raise
+@app.before_request
+def begin_metrics():
+    serverMetrics.begin(request.url_rule.rule if request.url_rule else 'unmatched', request.method)
+
+if trafficCapture.capture is not None:
+    @app.after_request
+    def capture_traffic(response):
+        # registered before the other after_request functions, so it sees the response as sent
+        stats, code = serverMetrics.current.get(), response.status_code
+        path = request.path + (f'?{request.query_string.decode("utf-8")}' if request.query_string else '')
+        method, headers, body = request.method, dict(request.headers), request.get_data(cache=True)
+        size = [response.content_length or 0]
+        if response.is_streamed:
+            chunks = response.response
+            def counted():
+                try:
+                    for chunk in chunks:
+                        size[0] += len(chunk)
+                        yield chunk
+                finally:
+                    if hasattr(chunks, 'close'):
+                        chunks.close()
+            size[0] = 0
+            response.response = counted()
+        response.call_on_close(lambda: trafficCapture.capture.record(
+            method, stats.route, path, headers, body, code, size[0], time.perf_counter() - stats.start))
+        return response
+
+if requestProfiler.PROFILE_DIR:
+    @app.before_request
+    def begin_profile():
+        requestProfiler.current.set(None)
+        if requestProfiler.wanted(request.headers.get(requestProfiler.PROFILE_HEADER),
+                                  lambda: is_admin(request.headers.get('Authorization'))):
+            requestProfiler.begin(request.method, request.url_rule.rule if request.url_rule else 'unmatched',
+                                  (request.view_args or {}).get('id', ''), request.content_length or 0)
+
+    @app.after_request
+    def finish_profile(response):
+        # registered before the other after_request functions, so it runs after them
+        profile = requestProfiler.current.get()
+        if profile is not None:
+            response.headers[requestProfiler.PROFILE_FILE_HEADER] = profile.filename
+            code, size = response.status_code, response.content_length
+            response.call_on_close(lambda: profile.finish(code, size))
+        return response
+
+@app.after_request
+def finish_metrics(response):
+    # recorded once the body, streamed or not, has been sent
+    stats, code = serverMetrics.current.get(), response.status_code
+    if stats is not None:
+        response.call_on_close(lambda: serverMetrics.finish(stats, code))
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Caches responses that have an ETag and compresses them as negotiated.
+
+       The compressed bytes are kept with the cached response, so a hot
+       model is compressed once per encoding rather than once per request.
+    """
+    if response.status_code != status.HTTP_200_OK or 'Content-Encoding' in response.headers:
+        return response
+    if response.is_streamed and not response.direct_passthrough:
+        return response
+    if not (response.mimetype == 'application/json' or response.mimetype.startswith('text/')):
+        return response
+    etag, _ = response.get_etag()
+    entry = responses.lookup(etag, etag) if etag else None
+    if entry is None:
+        response.direct_passthrough = False # send_file: buffer the body to compress it
+        body = response.get_data()
+        headers = [(key, value) for key, value in response.headers if key not in ('Content-Length', 'Vary')]
+        entry = CacheEntry(etag, len(body), value={'identity': body, 'headers': headers})
+        if etag:
+            responses.insert(etag, entry)
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings)
+    body = encoded_body(entry, encoding)
+    if body is None:
+        return response
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(f'{etag}-{encoding}')
+    return response
+
+def encoded_body(entry: CacheEntry, encoding: str | None) -> bytes | None:
+    """encoded_body(entry, encoding) -> the cached response body in `encoding`, or
+       None to send it uncompressed
+
+       The compressed bytes are added to the entry (and its size in the cache),
+       so each encoding is compressed once per cached response.
+    """
+    if encoding is None or len(entry.value['identity']) < MIN_COMPRESS_BYTES:
+        return None
+    if encoding not in entry.value:
+        entry.value[encoding] = compress(entry.value['identity'], encoding)
+        if entry.stamp:
+            responses.insert(entry.stamp, CacheEntry(entry.stamp, entry.nbytes + len(entry.value[encoding]), value=entry.value))
+    return entry.value[encoding]
+
+def lock_model(id, username):
+    previous = store.locks.owner(id)
+    store.locks.lock(id, username)
+    if previous != username:
+        events.publish('lock-acquired', id, owner=username)
 
-    data['readOnly'] = ""
+def unlock_model(id):
+    owner = store.locks.owner(id)
+    store.locks.release(id)
+    if owner:
+        events.publish('lock-released', id, owner=owner)
 
-    with locked_open(fileName, 'w', fcntl.LOCK_EX) as fp:
-        json.dump(data, fp, indent=2)
+def is_corrupted(id) -> bool:
+    entry = store.entry(id)
+    if entry is not None and entry.get('corrupted', False):
+        corrupted_hit()
+        return True
+    return False
 
-def delete_writeable_model(fileName) -> tuple[str,int]:
+def delete_writeable_model(id) -> tuple[str,int]:
     def get_response(status_code: int):
         match status_code:
             case status.HTTP_204_NO_CONTENT as code:
@@ -102,46 +258,41 @@ def delete_writeable_model(fileName) -> tuple[str,int]:
                 return "Can't open model; JSON file is corrupted!", code
             case _ as code:
                 return "Received unhandled Status Code!", code
-    if not os.path.exists(fileName):
+    if not store.exists(id):
         return get_response(status.HTTP_404_NOT_FOUND)
-    try:
-        with locked_open(fileName, 'r', fcntl.LOCK_EX) as fp:
-            data = json.load(fp)
-    except json.JSONDecodeError:
-        logging.debug(f'File {fileName} is corrupted!')
+    if is_corrupted(id):
         return get_response(status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    if not data['readOnly']:
-        if os.path.exists(fileName):
-            os.remove(fileName)
-            return get_response(status.HTTP_204_NO_CONTENT)
-        return get_response(status.HTTP_404_NOT_FOUND)
+    if not store.locks.owner(id):
+        try:
+            store.remove(id)
+        except FileNotFoundError:
+            return get_response(status.HTTP_404_NOT_FOUND)
+        events.publish('model-deleted', id)
+        return get_response(status.HTTP_204_NO_CONTENT)
     return get_response(status.HTTP_403_FORBIDDEN)
 
-class PubKey:
-    val: str = ""
+# the Keycloak realm's signing keys, fetched when the worker starts
+keys = KeyStore(os.environ["KC_PUBLIC_KEY_URI"], int(os.environ.get("KC_KEYS_REFRESH_SECONDS", 300))) \
+    if os.environ.get("KC_PUBLIC_KEY_URI") else None
+tokens = TokenCache(int(os.environ.get("TOKEN_CACHE_SIZE", 1024)))
+# realm role of the users allowed on the /admin endpoints
+BACKEND_ADMIN_ROLE = os.environ.get("BACKEND_ADMIN_ROLE", "backend-admin")
+if keys is not None:
+    keys.listeners.append(tokens.retain)
+    keys.start()
 
 class AuthenticationError(BaseException):
     pass
 
-def retrieve_public_key():
-    if not os.environ.get("KC_PUBLIC_KEY_URI"):
-        return ""
-    key_location_uri = os.environ["KC_PUBLIC_KEY_URI"]
-    r = requests.get(key_location_uri)
-    if r.status_code == status.HTTP_200_OK:
-        pbkey_raw = r.json()["public_key"]
-        pbkey = f"-----BEGIN PUBLIC KEY-----\n{pbkey_raw}\n-----END PUBLIC KEY-----"
-        return pbkey
-    else:
-        return ""
-
 def decode_token(auth_token: str) -> dict:
-    if not PubKey.val:
-        PubKey.val = retrieve_public_key()
-    if PubKey.val:
-        public_key = PubKey.val
-    else:
+    start = time.perf_counter()
+    token_data = checked_token(auth_token)
+    TOKEN_SECONDS.labels(token_data["token_status"]).observe(time.perf_counter() - start)
+    return token_data
+
+def checked_token(auth_token: str) -> dict:
+    if keys is None or not keys.ready():
         token_data = {"info": {},
                       "username": "",
                       "token_status": "public_key_missing"}
@@ -153,7 +304,7 @@ def decode_token(auth_token: str) -> dict:
         return token_data
     auth_token = auth_token.removeprefix('Bearer ').lstrip()
     try:
-        token_info = jwt.decode(auth_token, key=public_key, algorithms=["RS256"])
+        token_info = verify_token(auth_token, keys, tokens)
         username = token_info['preferred_username']
         token_status = "valid"
     except InvalidTokenError:
@@ -175,6 +326,25 @@ def validate_token(auth_token, test_username: str="user1") -> str:
     else:
         raise AuthenticationError(f'Error: token status = {data["token_status"]}!')
 
+def validate_admin(auth_token) -> str:
+    """validate_admin(token) -> username of a user with the `BACKEND_ADMIN_ROLE`
+       realm role; raises AuthenticationError, or Forbidden for other users
+    """
+    username = validate_token(auth_token)
+    if os.environ.get("BACKEND_AUTH_ENABLED", "true") == "false":
+        return username
+    roles = decode_token(auth_token)["info"].get("realm_access", {}).get("roles", [])
+    if BACKEND_ADMIN_ROLE not in roles:
+        raise Forbidden(f'Requires the {BACKEND_ADMIN_ROLE} role')
+    return username
+
+def is_admin(auth_token) -> bool:
+    try:
+        validate_admin(auth_token)
+        return True
+    except (AuthenticationError, Forbidden):
+        return False
+
 @app.route('/model', methods=['GET'])
 def index():
     token = request.headers.get('Authorization')
@@ -182,29 +352,123 @@ def index():
         validate_token(token)
     except AuthenticationError as e:
         return str(e), status.HTTP_401_UNAUTHORIZED
-    res = []
-    for file in os.listdir('./models'):
-        if file.endswith('.json'):
-            fileName = os.path.join('models', file)
-            path_to_file = [Path(fileName)]
-            try:
-                convert_files(path_to_file)
-                with locked_open(fileName, 'r', fcntl.LOCK_SH) as fp:
-                    full_data = json.load(fp)
-            except json.JSONDecodeError:
-                res.append({'name': file.removesuffix('.json'), 'readOnly': 'CORRUPTED'})
+    if any(arg in request.args for arg in PAGE_ARGS):
+        return model_page()
+    # the catalog knows each model's version; only outdated models are read
+    stale = migrated(store.outdated())
+    # expired locks are already left out of owners()
+    owners = store.locks.owners()
+    etag = content_etag('index', store.catalog_etag(), owners, stale)
+    if not stale and (cached := cached_response(etag)):
+        return cached
+    response = json_array_response(listed_models(store.catalog(), owners), etag)
+    if stale:
+        response.headers['Stale-Models'] = ','.join(stale)
+    return response
+
+def migrated(ids) -> list[str]:
+    """migrated(ids) -> those of the models left unmigrated: a list does not wait
+       for the writes of others (more than LOCK_SCAN_TIMEOUT_SECONDS), it lists
+       these models as the catalog has them and a later request migrates them
+    """
+    ids = list(ids)
+    for i, id in enumerate(ids):
+        try:
+            store.migrate(id, timeout=LOCK_SCAN_TIMEOUT_SECONDS)
+        except (json.JSONDecodeError, FileNotFoundError):
+            pass
+        except LockTimeout:
+            # the JSON store's writes all take the catalog lock: the rest would wait too
+            return ids[i:]
+    return []
+
+def listed_model(meta: dict, owners: dict) -> dict:
+    if meta.get('corrupted'):
+        corrupted_hit()
+        return {'name': meta['name'], 'readOnly': 'CORRUPTED'}
+    return {'name': meta['name'], 'readOnly': owners.get(meta['id'], ""), 'lastModified': meta['lastModified']}
+
+def listed_models(entries, owners: dict):
+    """listed_models(catalog entries, owners) -> the elements of the model list"""
+    for meta in entries:
+        yield listed_model(meta, owners)
+
+# query parameters that ask GET /model for a page instead of the whole list
+PAGE_ARGS = ('limit', 'cursor', 'prefix', 'locked', 'sort')
+PAGE_LIMIT_MAX = 1000
+
+def encode_cursor(sort: str, key: tuple) -> str:
+    data = json.dumps({'sort': sort, 'after': list(key)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    """decode_cursor(cursor, sort) -> sort key to continue after; ValueError if it
+       is not a cursor this server gave out for the same sort
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        value, id = data['after']
+    except (ValueError, TypeError, KeyError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    expected = str if sort.lstrip('-') == 'name' else (int, float)
+    if data.get('sort') != sort or not isinstance(id, str) or not isinstance(value, expected) or isinstance(value, bool):
+        raise ValueError('Invalid cursor')
+    return value, id
+
+def model_page():
+    """GET /model?limit=&cursor=&prefix=&locked=&sort= -> {'models': [...], 'nextCursor': ...}
+
+       Pages through the catalog in name or lastModified order (`sort=-lastModified`
+       for newest first). Each page continues from the sort key in its cursor, so
+       it costs the same however deep it is; `nextCursor` is null on the last page.
+       `locked=true|false` keeps only models someone has (not) opened for writing.
+    """
+    try:
+        query = page_query(request.args)
+    except ValueError as e:
+        return str(e), status.HTTP_400_BAD_REQUEST
+    owners = store.locks.owners()
+    etag = content_etag('index', store.catalog_etag(), owners, sorted(request.args.items()))
+    if cached := cached_response(etag):
+        return cached
+    page = model_page_of(owners, **query)
+    # a page with stale models is not cached
+    return page if 'stale' in page else with_etag(jsonify(page), etag)
+
+def page_query(args) -> dict:
+    """page_query(query args) -> keyword arguments of `model_page_of`; ValueError
+       if one of them is invalid
+    """
+    sort = args.get('sort', 'name')
+    locked = args.get('locked')
+    limit = int(args.get('limit', 100))
+    if not 0 < limit <= PAGE_LIMIT_MAX:
+        raise ValueError(f'limit must be between 1 and {PAGE_LIMIT_MAX}')
+    if sort.lstrip('-') not in SORT_KEYS:
+        raise ValueError(f'sort must be one of {", ".join(SORT_KEYS)}, optionally prefixed with "-"')
+    if locked not in (None, 'true', 'false'):
+        raise ValueError('locked must be true or false')
+    after = decode_cursor(args['cursor'], sort) if 'cursor' in args else None
+    return {'sort': sort, 'locked': locked, 'prefix': args.get('prefix', ''), 'limit': limit, 'after': after}
+
+def model_page_of(owners: dict, sort: str, locked: str | None, prefix: str, limit: int, after: tuple | None) -> dict:
+    """model_page_of(owners, **page_query(args)) -> {'models': [...], 'nextCursor': ...}, plus
+       'stale': [ids] if some of them could not be migrated (see `migrated`)
+    """
+    page, next_cursor = [], None
+    with closing(store.listing(sort.lstrip('-'), sort.startswith('-'), prefix, after)) as entries:
+        for meta in entries:
+            if locked is not None and (meta.get('corrupted') or (meta['id'] in owners) != (locked == 'true')):
                 continue
-            data = full_data['model']
-            data['modelVersion'] = full_data.get('modelVersion', "")
-            if ((full_data['lastModified'] < (time.time() - 4500)) and (full_data['readOnly'] != "")):
-                full_data['readOnly'] = ""
-                full_data['lastModified'] = time.time()
-                with locked_open(fileName, 'w', fcntl.LOCK_EX) as fp:
-                    json.dump(full_data, fp, indent=2)
-                res.append({'name': data['name'], 'readOnly': "", 'lastModified': full_data['lastModified']})
-            else:
-                res.append({'name': data['name'], 'readOnly': full_data['readOnly'], 'lastModified': full_data['lastModified']})
-    return jsonify(res)
+            if len(page) == limit:
+                next_cursor = encode_cursor(sort, sort_key(page[-1], sort.lstrip('-')))
+                break
+            page.append(meta)
+    stale = migrated(meta['id'] for meta in page if not meta.get('corrupted') and meta['modelVersion'] != CURRENT_VERSION)
+    result = {'models': [listed_model(meta, owners) for meta in page], 'nextCursor': next_cursor}
+    if stale:
+        result['stale'] = stale
+    return result
 
 
 @app.route('/model/<id>', methods=['GET'])
@@ -216,28 +480,40 @@ def get_model(id):
         username = validate_token(token, test_username=testUser)
     except AuthenticationError as e:
         return str(e), status.HTTP_401_UNAUTHORIZED
-    fileName = os.path.join('models', id) + '.json'
-    if not os.path.exists(fileName):
+    return opened_model(id, f'{username}/{tabId}', cached_response)
+
+def opened_model(id: str, owner: str, cached):
+    """opened_model(id, owner, cached) -> response of GET /model/<id>
+
+       Locks the model for `owner` unless someone else has it open.
+       `cached(etag)` answers from the response cache (or with a 304), or
+       returns None to have the model loaded.
+    """
+    if not store.exists(id):
         return 'No file of that name exists', status.HTTP_404_NOT_FOUND
+    if is_corrupted(id):
+        return "Can't open model; JSON file is corrupted!", status.HTTP_500_INTERNAL_SERVER_ERROR
+    try:
+        model_etag = store.etag(id)
+    except FileNotFoundError:
+        return 'No file of that name exists', status.HTTP_404_NOT_FOUND
+    holder, acquired = store.locks.try_lock(id, owner)
+    if acquired:
+        events.publish('lock-acquired', id, owner=holder)
+    readOnly = "" if holder == owner else holder
+    etag = content_etag('model', model_etag, readOnly)
+    if response := cached(etag):
+        return response
     try:
-        with locked_open(fileName, 'r', fcntl.LOCK_EX) as fp:
-            full_data = json.load(fp)
+        full_data = store.load_cached(id)
     except json.JSONDecodeError:
         return "Can't open model; JSON file is corrupted!", status.HTTP_500_INTERNAL_SERVER_ERROR
-    data = full_data['model']
+    data = dict(full_data['model'])
     data["modelVersion"] = (
         full_data.get("modelVersion", "")
     )
-    if full_data['readOnly'] == f'{username}/{tabId}':
-        data['readOnly'] = ""
-    elif full_data['readOnly']:
-        data['readOnly'] = full_data['readOnly']
-    else:
-        try:
-            lock_model(fileName, f'{username}/{tabId}')
-        except json.JSONDecodeError:
-            return "Can't open model; JSON file is corrupted!", status.HTTP_500_INTERNAL_SERVER_ERROR
-    return data, status.HTTP_200_OK
+    data['readOnly'] = readOnly
+    return data, status.HTTP_200_OK, {'Model-Revision': full_data.get('revision', 0), 'ETag': f'"{etag}"'}
 
 @app.route("/model/export/<id>", methods=["GET"])
 def export_model(id: str):
@@ -246,13 +522,16 @@ def export_model(id: str):
         validate_token(token)
     except AuthenticationError as e:
         return str(e), status.HTTP_401_UNAUTHORIZED
-    fileName = os.path.join("models", id) + ".json"
-
-    if not os.path.exists(fileName):
+    if not store.exists(id):
+        return "No file of that name exists", status.HTTP_404_NOT_FOUND
+    try:
+        etag = content_etag('export', store.etag(id))
+    except FileNotFoundError:
         return "No file of that name exists", status.HTTP_404_NOT_FOUND
+    if cached := cached_response(etag):
+        return cached
     try:
-        with locked_open(fileName, "r", fcntl.LOCK_EX) as fp:
-            full_data = json.load(fp)
+        full_data = store.load_cached(id)
     except json.JSONDecodeError:
         return (
             "Can't open model; JSON file is corrupted!",
@@ -260,7 +539,7 @@ def export_model(id: str):
         )
     json_contents = json.dumps(full_data, indent=2).encode("utf-8")
 
-    return send_file(BytesIO(json_contents), download_name=f"{id}.json")
+    return with_etag(send_file(BytesIO(json_contents), download_name=f"{id}.json", etag=False), etag)
 
 
 @app.route("/model/import/<filename>", methods=["POST"])
@@ -270,9 +549,12 @@ def import_model(filename: str):
         validate_token(token)
     except AuthenticationError as e:
         return str(e), status.HTTP_401_UNAUTHORIZED
-    model_file = request.files[filename]
+    return imported_model(filename, request.files[filename].read())
+
+def imported_model(filename: str, content: bytes):
+    """imported_model(filename, content of the uploaded file) -> response of POST /model/import/<filename>"""
     try:
-        full_data = json.loads(model_file.read().decode("utf-8"))
+        full_data = json.loads(content.decode("utf-8"))
     except json.JSONDecodeError:
         return (
             "Can't import model; JSON file is corrupted!",
@@ -284,7 +566,7 @@ def import_model(filename: str):
     original_filepath = os.path.join("models", filename)
     original_model_name = model_name
     # if file exists, append a timestamp to the filename (or replace an existing one)
-    if os.path.exists(filepath):
+    if store.exists(model_name):
         now = datetime.datetime.now(datetime.timezone.utc)
         timestamp = now.strftime("%Y_%m_%d_%Hh%Mm%S")
         # example timestamp = "2024_11_06_09h47m30"
@@ -316,21 +598,21 @@ def import_model(filename: str):
     full_data["readOnly"] = ""
     full_data["model"]["readOnly"] = False
 
-    with locked_open(filepath, "w", fcntl.LOCK_EX) as fp:
-        json.dump(full_data, fp, indent=2)
+    store.save(model_name, full_data)
+    events.publish('model-updated', model_name, revision=full_data.get('revision', 0))
+    unlock_model(model_name)
 
     all_data = {
         "model": data,
         "meta": metadata,
     }
-    return jsonify(all_data), status.HTTP_201_CREATED
+    return all_data, status.HTTP_201_CREATED
 
 @app.route('/model/<id>', methods=['POST'])
 def post_model(id):
     token = request.headers.get('Authorization')
     tabId = request.headers.get('SessionTabId')
-    model_ver = os.environ["MODEL_VERSION"]
-    testUser = request.headers.get('TestUsername', "user1")
+    testUser= request.headers.get('TestUsername', "user1")
     try:
         username = validate_token(token, test_username=testUser)
     except AuthenticationError as e:
@@ -339,29 +621,30 @@ def post_model(id):
         return 'Model could not be created due to an invalid name', status.HTTP_400_BAD_REQUEST
     content_type = request.headers.get('Content-Type')
     if content_type == 'application/json':
-        filename = os.path.join('models', id) + '.json'
-        
-        # if file exists, return 412 error status code
-        if os.path.exists(filename):
-            return 'Model of that name already exists', status.HTTP_412_PRECONDITION_FAILED
-            
-
-        # save the body of the POST as the JSON data in the file
-        # use id + '.json' as the name of the file, put it in the models
-        # directory
-        with locked_open(filename, 'w', fcntl.LOCK_EX) as fp:
-            file_data = {}
-            data = request.json
-            data['modelVersion'] = model_ver
-            file_data['model'] = data
-            file_data['modelVersion'] = model_ver
-            file_data['readOnly'] = f'{username}/{tabId}'
-            file_data['lastModified'] = time.time()
-            json.dump(file_data, fp, indent=2)
-        return data, status.HTTP_201_CREATED
+        return created_model(id, request.json, f'{username}/{tabId}')
     else:
         return 'Content-Type not supported!', status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
 
+def created_model(id: str, data: dict, owner: str):
+    """created_model(id, body of the request, owner) -> response of POST /model/<id>"""
+    model_ver = os.environ["MODEL_VERSION"]
+    # if model exists, return 412 error status code
+    if store.exists(id):
+        return 'Model of that name already exists', status.HTTP_412_PRECONDITION_FAILED
+
+    # save the body of the POST as the JSON data of the model
+    # use id as the name of the model
+    file_data = {}
+    data['modelVersion'] = model_ver
+    file_data['model'] = data
+    file_data['modelVersion'] = model_ver
+    file_data['readOnly'] = ""
+    file_data['lastModified'] = time.time()
+    store.save(id, file_data)
+    events.publish('model-updated', id, revision=0)
+    lock_model(id, owner)
+    return data, status.HTTP_201_CREATED, {'Model-Revision': 0}
+
 @app.route('/model/<id>', methods=['PUT'])
 def put_model(id):
     token = request.headers.get('Authorization')
@@ -375,42 +658,96 @@ def put_model(id):
         return 'Model could not be created due to an invalid name', status.HTTP_400_BAD_REQUEST
     content_type = request.headers.get('Content-Type')
     if content_type == 'application/json':
-        filename = os.path.join('models', id) + '.json'
-        
-        # if file exists, retrieve modelVersion from the JSON
-        if wait_exists(filename):
-            try:
-                with locked_open(filename, 'r', fcntl.LOCK_EX) as fp:
-                    old_data = json.load(fp)
-            except json.JSONDecodeError:
-                return "Can't open model; JSON file is corrupted!", status.HTTP_500_INTERNAL_SERVER_ERROR
-        else:
-            return 'No model of the supplied identifier exists on the server', status.HTTP_404_NOT_FOUND
-            
-        data = request.json
-        # save the body of the POST as the JSON data in the file
-        # use id + '.json' as the name of the file, put it in the models
-        # directory
-        newName = data['name']
-        if id != newName and newName != "":
-            # if file exists, and its name is changed remove it
-            oldFileName = filename            
-            filename = os.path.join('models', newName) + '.json'
-            if os.path.exists(filename):
-                return 'Model of that name already exists', status.HTTP_412_PRECONDITION_FAILED
-            os.remove(oldFileName)
-
-        with locked_open(filename, 'w', fcntl.LOCK_EX) as fp:
-            file_data = {}
-            data['modelVersion'] = old_data.get('modelVersion', "")
-            file_data['model'] = data
-            file_data['readOnly'] = f'{username}/{tabId}'
-            file_data['lastModified'] = time.time()
-            file_data['modelVersion'] = data['modelVersion']
-            json.dump(file_data, fp, indent=2)
-        return data, status.HTTP_201_CREATED
+        return replaced_model(id, lambda: request.json, f'{username}/{tabId}')
+    else:
+        return 'Content-Type not supported!', status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+def replaced_model(id: str, body, owner: str):
+    """replaced_model(id, body, owner) -> response of PUT /model/<id>
+
+       `body` returns the request's JSON; it is only read once the model is
+       known to exist.
+    """
+    # if model exists, retrieve modelVersion from the JSON
+    if store.wait_exists(id):
+        try:
+            old_data = store.load_cached(id)
+        except json.JSONDecodeError:
+            return "Can't open model; JSON file is corrupted!", status.HTTP_500_INTERNAL_SERVER_ERROR
     else:
+        return 'No model of the supplied identifier exists on the server', status.HTTP_404_NOT_FOUND
+
+    data = body()
+    # save the body of the PUT as the JSON data of the model
+    # use the model name as its id
+    newName = data['name']
+    if id != newName and newName != "":
+        # if model exists, and its name is changed remove it
+        oldId = id
+        id = newName
+        if store.exists(id):
+            return 'Model of that name already exists', status.HTTP_412_PRECONDITION_FAILED
+        store.remove(oldId)
+        events.publish('model-deleted', oldId, renamed=id)
+
+    file_data = {}
+    data['modelVersion'] = old_data.get('modelVersion', "")
+    file_data['model'] = data
+    file_data['readOnly'] = ""
+    file_data['lastModified'] = time.time()
+    file_data['modelVersion'] = data['modelVersion']
+    file_data['revision'] = old_data.get('revision', 0) + 1
+    store.save(id, file_data)
+    events.publish('model-updated', id, revision=file_data['revision'])
+    lock_model(id, owner)
+    return data, status.HTTP_201_CREATED, {'Model-Revision': file_data['revision']}
+
+@app.route('/model/<id>', methods=['PATCH'])
+def patch_model(id):
+    """Applies a JSON Patch (RFC 6902) to the model.
+
+       The `Model-Revision` header must carry the revision the patch was
+       made against (as returned by GET, POST, PUT and PATCH); a model that
+       has been saved since answers 409 with its current revision.
+    """
+    token = request.headers.get('Authorization')
+    tabId = request.headers.get('SessionTabId')
+    testUser = request.headers.get('TestUsername', "user1")
+    try:
+        username = validate_token(token, test_username=testUser)
+    except AuthenticationError as e:
+        return str(e), status.HTTP_401_UNAUTHORIZED
+    if not validation_check(id):
+        return 'Unallowed Model Name', status.HTTP_400_BAD_REQUEST
+    content_type = request.headers.get('Content-Type')
+    if content_type not in ('application/json-patch+json', 'application/json'):
         return 'Content-Type not supported!', status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    revision = request.headers.get('Model-Revision', '')
+    if not revision.isdigit():
+        return 'Model-Revision header required', status.HTTP_428_PRECONDITION_REQUIRED
+    return patched_model(id, int(revision), lambda: request.get_json(force=True), f'{username}/{tabId}')
+
+def patched_model(id: str, revision: int, body, owner: str):
+    """patched_model(id, revision, body, owner) -> response of PATCH /model/<id>
+
+       `body` returns the JSON Patch; it is only read once the model is known
+       to exist.
+    """
+    if not store.exists(id):
+        return 'No model of the supplied identifier exists on the server', status.HTTP_404_NOT_FOUND
+    try:
+        full_data = store.patch(id, revision, body())
+    except json.JSONDecodeError:
+        return "Can't open model; JSON file is corrupted!", status.HTTP_500_INTERNAL_SERVER_ERROR
+    except FileNotFoundError:
+        return 'No model of the supplied identifier exists on the server', status.HTTP_404_NOT_FOUND
+    except RevisionConflict as e:
+        return str(e), status.HTTP_409_CONFLICT, {'Model-Revision': e.revision}
+    except JsonPatchError as e:
+        return str(e), status.HTTP_400_BAD_REQUEST
+    events.publish('model-updated', id, revision=full_data['revision'])
+    lock_model(id, owner)
+    return {'revision': full_data['revision']}, status.HTTP_200_OK, {'Model-Revision': full_data['revision']}
 
 @app.route('/model/<id>', methods=['DELETE'])
 def delete_model(id):
@@ -423,9 +760,8 @@ def delete_model(id):
     if not validation_check(id):
         return 'Unallowed Model Name', status.HTTP_400_BAD_REQUEST
 
-    filename = os.path.join('models', id) + '.json'
-    # if file exists, remove it
-    return delete_writeable_model(filename)
+    # if model exists, remove it
+    return delete_writeable_model(id)
     
 @app.route('/model/return', methods=['GET'])
 def return_all_by_user():
@@ -436,30 +772,18 @@ def return_all_by_user():
         username = validate_token(token, test_username=testUser)
     except AuthenticationError as e:
         return str(e), status.HTTP_401_UNAUTHORIZED
-    res = []
-    for file in os.listdir('./models'):
-        if file.endswith('.json'):
-            fileName = os.path.join('models', file)
-            try:
-                with locked_open(fileName, 'r', fcntl.LOCK_SH) as fp:
-                    full_data = json.load(fp)
-            except json.JSONDecodeError:
-                # model's JSON file is corrupted
-                continue
-            # if request contained writable model, unlock it
-            if full_data['readOnly'].startswith(f'{username}/{sessionId}/'):
-                try:
-                    unlock_model(fileName)
-                except json.JSONDecodeError:
-                    # model's JSON file is corrupted
-                    continue
-                res.append(fileName)
-    return jsonify(
-        {
-            "message": f"{len(res)} model(s) returned!",
-            "count": len(res),
-        }
-    ), status.HTTP_200_OK
+    return returned_session(username, sessionId)
+
+def returned_session(username: str, sessionId: str):
+    """returned_session(username, sessionId) -> response of GET /model/return"""
+    # unlock every writable model the session's tabs have open
+    res = store.locks.release_session(username, sessionId)
+    for id in res:
+        events.publish('lock-released', id, owner=f'{username}/{sessionId}')
+    return {
+        "message": f"{len(res)} model(s) returned!",
+        "count": len(res),
+    }, status.HTTP_200_OK
 
 @app.route('/model/return/<id>', methods=['PUT'])
 def return_model(id):
@@ -470,22 +794,23 @@ def return_model(id):
         return str(e), status.HTTP_401_UNAUTHORIZED
     content_type = request.headers.get('Content-Type')
     if content_type == 'application/json':
-        filename = os.path.join('models', id) + '.json'
-        
-        # if file exists
-        if os.path.exists(filename):
-            data = request.json
-            # if request contained writable model, unlock it
-            if not data['readOnly']:
-                try:
-                    unlock_model(filename)
-                except json.JSONDecodeError:
-                    return "Can't return model; JSON file is corrupted!", status.HTTP_500_INTERNAL_SERVER_ERROR
-                return 'Model Returned', status.HTTP_200_OK
-            else:
-                return 'Not authorized to unlock this model', status.HTTP_403_FORBIDDEN
+        return returned_model(id, lambda: request.json)
+
+def returned_model(id: str, body):
+    """returned_model(id, body) -> response of PUT /model/return/<id>"""
+    # if model exists
+    if store.exists(id):
+        data = body()
+        # if request contained writable model, unlock it
+        if not data['readOnly']:
+            if is_corrupted(id):
+                return "Can't return model; JSON file is corrupted!", status.HTTP_500_INTERNAL_SERVER_ERROR
+            unlock_model(id)
+            return 'Model Returned', status.HTTP_200_OK
         else:
-            return 'No model of the supplied identifier exists on the server', status.HTTP_404_NOT_FOUND
+            return 'Not authorized to unlock this model', status.HTTP_403_FORBIDDEN
+    else:
+        return 'No model of the supplied identifier exists on the server', status.HTTP_404_NOT_FOUND
 
 
 @app.route('/model/idealFunctionalities', methods=['GET'])
@@ -496,25 +821,47 @@ def get_IFs():
         validate_token(token)
     except AuthenticationError as e:
         return str(e), status.HTTP_401_UNAUTHORIZED
-    ifs = []
-    files = [os.path.join('models', file) for file in os.listdir('./models') if file.endswith('.json')]
-    for file in files:
-        try:
-            with locked_open(file, 'r', fcntl.LOCK_SH) as fp:
-                full_data = json.load(fp)
-        except json.JSONDecodeError:
+    etag = content_etag('idealFunctionalities', store.catalog_etag())
+    if cached := cached_response(etag):
+        return cached
+    return json_array_response(ideal_functionalities(), etag)
+
+def ideal_functionalities():
+    for entry in store.catalog():
+        if entry.get('corrupted') or entry['idealFunctionality'] is None:
             # Model JSON file is corrupted!
-            # data = {'id': 'UNKNOWN', 'model_name': file.removesuffix('.json'),
-            #         'idealFunctionality_id': 'UNKONWN', 'idealFunctionality_name': 'UNKNOWN'}
             continue
-        data = full_data['model']
+        yield entry['idealFunctionality']
 
-        ifs.append({'model_id': data['id'], 'model_name': data['name'],
-            'idealFunctionality_id': data['idealFunctionality']['id'], 
-            'idealFunctionality_name': data['idealFunctionality']['name'],
-            'adversarialInterface': data['idealFunctionality']['basicAdversarialInterface']})
+def interface_messages(model_id: str, basicIntersIds: list[str], compInter: dict) -> list[dict]:
+    """interface_messages(model_id, basicIntersIds, compInter) -> [message]
+
+       The messages of the given basic interfaces, in model order, annotated
+       with the composite and basic interface they belong to.
+    """
+    index = store.derived(model_id, 'interfaces', interface_index)
+    found = {}
+    for basicInterId in basicIntersIds:
+        for messageId in index['basicInterMessages'].get(basicInterId, []):
+            for position, message in index['messages'].get(messageId, []):
+                found[position] = message
+    messages = []
+    for position in sorted(found):
+        message = dict(found[position]) # The cached model is shared; annotate a copy
+        message['compInter'] = compInter # Pass information about comp interface for code generation
+        message['basicInter'] = index['messageOwner'][message['id']] # Pass information about basic instance for code generation
+        messages.append(message)
+    return messages
 
-    return jsonify(ifs)
+def models_etag(*key, model_ids: list[str]) -> str:
+    """models_etag(*key, model_ids=...) -> ETag of a response built from these models"""
+    etags = []
+    for model_id in model_ids:
+        try:
+            etags.append((model_id, store.etag(model_id)))
+        except FileNotFoundError:
+            continue
+    return content_etag(*key, etags)
 
 @app.route('/model/idealFunctionalities/<id>/messages', methods=['GET'])
 def get_messages_of_IF(id):
@@ -524,44 +871,34 @@ def get_messages_of_IF(id):
         validate_token(token)
     except AuthenticationError as e:
         return str(e), status.HTTP_401_UNAUTHORIZED
-    messages = []
-    basicIntersIds = []       
-    messagesIds = []
-    final_compInter = {}
-    files = [os.path.join('models', file) for file in os.listdir('./models') if file.endswith('.json')]
-    for file in files:
+    model_ids = store.models_referencing('idealFunctionality', id)
+    etag = models_etag('idealFunctionalityMessages', id, model_ids=model_ids)
+    if cached := cached_response(etag):
+        return cached
+    return json_array_response(ideal_functionality_messages(id, model_ids), etag)
+
+def ideal_functionality_messages(id: str, model_ids: list[str]):
+    for model_id in model_ids:
         try:
-            with locked_open(file, 'r', fcntl.LOCK_SH) as fp:
-                full_data = json.load(fp)
-        except json.JSONDecodeError:
+            full_data = store.load_cached(model_id)
+            index = store.derived(model_id, 'interfaces', interface_index)
+        except (json.JSONDecodeError, FileNotFoundError):
             # Model JSON file is corrupted!
             continue
-        data = full_data['model'] 
-
-        if (data['idealFunctionality']['id'] == id):
-            for compInter in data['interfaces']['compInters']:
-                if (data['idealFunctionality']['compositeDirectInterface'] == compInter['id']):
-                    final_compInter = compInter
-                    for basicInter in compInter['basicInterfaces']:
-                        basicIntersIds.append(basicInter['idOfBasic'])
-
-            for basicInter in data['interfaces']['basicInters']:
-                if (data['idealFunctionality']['basicAdversarialInterface'] == basicInter['id']):
-                    basicIntersIds.append(basicInter['id'])
-
-            for basicInter in data['interfaces']['basicInters']:
-                if (basicInter['id'] in basicIntersIds):
-                    messagesIds.extend(basicInter['messages'])
-
-            for message in data['interfaces']['messages']:
-                if message['id'] in messagesIds:
-                    message['compInter'] = final_compInter # Pass information about comp interface for code generation
-                    for basicInter in data['interfaces']['basicInters']:
-                        if message['id'] in basicInter['messages']:
-                            message['basicInter'] = basicInter # Pass information about basic instance for code generation
-                    messages.append(message)
-    
-    return jsonify(messages)
+        idealFunctionality = full_data['model']['idealFunctionality']
+        if idealFunctionality['id'] != id:
+            continue
+
+        basicIntersIds = []
+        final_compInter = {}
+        for compInter in index['compInters'].get(idealFunctionality['compositeDirectInterface'], []):
+            final_compInter = compInter
+            for basicInter in compInter['basicInterfaces']:
+                basicIntersIds.append(basicInter['idOfBasic'])
+        if idealFunctionality['basicAdversarialInterface'] in index['basicInterMessages']:
+            basicIntersIds.append(idealFunctionality['basicAdversarialInterface'])
+
+        yield from interface_messages(model_id, basicIntersIds, final_compInter)
 
 
 @app.route('/model/compInterfaces', methods=['GET'])
@@ -572,25 +909,18 @@ def get_comps():
         validate_token(token)
     except AuthenticationError as e:
         return str(e), status.HTTP_401_UNAUTHORIZED
-    comps = []
-    files = [os.path.join('models', file) for file in os.listdir('./models') if file.endswith('.json')]
-    for file in files:
-        try:
-            with locked_open(file, 'r', fcntl.LOCK_SH) as fp:
-                full_data = json.load(fp)
-        except json.JSONDecodeError:
+    etag = content_etag('compInterfaces', store.catalog_etag())
+    if cached := cached_response(etag):
+        return cached
+    return json_array_response(comp_interfaces(), etag)
+
+def comp_interfaces():
+    for entry in store.catalog():
+        if entry.get('corrupted'):
             # Model JSON file is corrupted!
             continue
-        data = full_data['model']
-
-        for compInt in data['interfaces']['compInters']:
-            if compInt['type'] == 'direct':
-
-                comps.append({'model_id': data['id'], 'model_name': data['name'],
-                'compInterface_id': compInt['id'],'compInterface_name': compInt['name']})
+        yield from entry['compInterfaces']
 
-    return jsonify(comps)
-    
 @app.route('/model/compInterfaces/<id>/messages', methods=['GET'])
 def get_comp_messages(id):
 
@@ -599,36 +929,96 @@ def get_comp_messages(id):
         validate_token(token)
     except AuthenticationError as e:
         return str(e), status.HTTP_401_UNAUTHORIZED
-    messages = []
-    basicIntersIds = []
-    messagesIds = []
-    final_compInter = {}
-    files = [os.path.join('models', file) for file in os.listdir('./models') if file.endswith('.json')]
-    for file in files:
+    model_ids = store.models_referencing('compInter', id)
+    etag = models_etag('compInterMessages', id, model_ids=model_ids)
+    if cached := cached_response(etag):
+        return cached
+    return json_array_response(comp_interface_messages(id, model_ids), etag)
+
+def comp_interface_messages(id: str, model_ids: list[str]):
+    for model_id in model_ids:
         try:
-            with locked_open(file, 'r', fcntl.LOCK_SH) as fp:
-                full_data = json.load(fp)
-        except json.JSONDecodeError:
+            index = store.derived(model_id, 'interfaces', interface_index)
+        except (json.JSONDecodeError, FileNotFoundError):
             # Model JSON file is corrupted!
             continue
-        data = full_data['model']
-
-        for compInter in data['interfaces']['compInters']:
-            if (compInter['id'] == id):
-                final_compInter = compInter
-                for basicInter in compInter['basicInterfaces']:
-                    basicIntersIds.append(basicInter['idOfBasic'])
-
-        for basicInter in data['interfaces']['basicInters']:
-            if (basicInter['id'] in basicIntersIds):
-                messagesIds.extend(basicInter['messages'])
-
-        for message in data['interfaces']['messages']:
-                if message['id'] in messagesIds:
-                    message['compInter'] = final_compInter # Pass information about comp interface for code generation
-                    for basicInter in data['interfaces']['basicInters']:
-                        if message['id'] in basicInter['messages']:
-                            message['basicInter'] = basicInter # Pass information about basic instance for code generation
-                    messages.append(message)
-    
-    return jsonify(messages)
+
+        basicIntersIds = []
+        final_compInter = {}
+        for compInter in index['compInters'].get(id, []):
+            final_compInter = compInter
+            for basicInter in compInter['basicInterfaces']:
+                basicIntersIds.append(basicInter['idOfBasic'])
+
+        yield from interface_messages(model_id, basicIntersIds, final_compInter)
+
+def sse_frame(event: dict) -> bytes:
+    data = {key: value for key, value in event.items() if key not in ('id', 'event')}
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode('utf-8')
+
+@app.route('/admin/locks', methods=['GET'])
+def lock_contention():
+    """The most contended file locks of all workers, `?top=` of them"""
+    try:
+        validate_admin(request.headers.get('Authorization'))
+    except AuthenticationError as e:
+        return str(e), status.HTTP_401_UNAUTHORIZED
+    return lockStats.stats.report(request.args.get('top', type=int))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of all the server's workers"""
+    body, content_type = serverMetrics.exposition()
+    return Response(body, content_type=content_type)
+
+@app.route('/model/events', methods=['GET'])
+def model_events():
+    """Server-Sent Events of model locks and changes
+
+       EventSource cannot set headers, so the token may also come as the
+       `access_token` query parameter. `models` limits the stream to a
+       comma-separated list of ids. A reconnecting client resumes after
+       its Last-Event-ID; a new one gets the events from now on.
+    """
+    token = request.headers.get('Authorization') or request.args.get('access_token')
+    if token and not token.startswith('Bearer'):
+        token = f'Bearer {token}'
+    try:
+        validate_token(token)
+    except AuthenticationError as e:
+        return str(e), status.HTTP_401_UNAUTHORIZED
+    models = set(filter(None, request.args.get('models', '').split(','))) or None
+    resume = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    try:
+        seq = int(resume) if resume else events.last()
+    except ValueError:
+        return 'Last-Event-ID must be an event id', status.HTTP_400_BAD_REQUEST
+    # an id from before the event table was reset would wait for events that never come
+    seq = min(seq, events.last())
+    slots = stream_slots
+    if not slots.acquire(blocking=False):
+        return 'Too many open event streams', status.HTTP_503_SERVICE_UNAVAILABLE, \
+            {'Retry-After': str(EVENTS_RETRY_AFTER_SECONDS)}
+
+    def stream(seq):
+        yield f'retry: {EVENTS_HEARTBEAT_SECONDS * 1000}\n\n'.encode('utf-8')
+        sent = time.monotonic()
+        deadline = sent + EVENTS_STREAM_SECONDS
+        while (remaining := deadline - time.monotonic()) > 0:
+            batch = events.wait(seq, min(EVENTS_HEARTBEAT_SECONDS, remaining))
+            if batch:
+                seq = batch[-1]['id']
+            frames = [sse_frame(event) for event in batch if models is None or event['model'] in models]
+            if frames:
+                yield b''.join(frames)
+            elif time.monotonic() - sent >= EVENTS_HEARTBEAT_SECONDS:
+                yield b': keepalive\n\n'
+            else:
+                continue
+            sent = time.monotonic()
+
+    response = Response(stream(seq), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # the slot is given back however the stream ends, even if it never started
+    response.call_on_close(slots.release)
+    return response
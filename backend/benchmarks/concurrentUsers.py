@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""Concurrent-user capacity of the Flask (gunicorn gthread) and ASGI (uvicorn) backends.
+
+Run from the backend directory:
+
+    python benchmarks/concurrentUsers.py --users 16 64 256 --event-streams 200
+
+Both servers are started on the same copy of a corpus of test models with
+the same number of workers, and driven in turn by simulated users. Each
+user has its own model and keeps cycling through what the frontend does:
+list the models, open (lock) its model, patch it, read the ideal
+functionalities, and return the model. `--event-streams` idle
+`/model/events` streams are held open during the run, like browser tabs
+left open. A server's capacity is the most users it serves with the 95th
+percentile request latency under `--slo-ms`.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import signal
+import tempfile
+import argparse
+import threading
+import subprocess
+import http.client
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from streamingResponses import build_corpus
+
+SERVERS = {
+    'flask': ['gunicorn', '-k', 'gthread', '--threads', '{threads}', 'backend:app'],
+    'asgi': ['gunicorn', '-k', 'uvicorn.workers.UvicornWorker', 'asgiBackend:app'],
+}
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start(server: str, directory: Path, workers: int, threads: int) -> tuple[subprocess.Popen, int]:
+    port = free_port()
+    command = [part.format(threads=threads) for part in SERVERS[server]]
+    command[1:1] = ['--bind', f'127.0.0.1:{port}', '-w', str(workers), '--log-level', 'warning']
+    env = dict(os.environ, PYTHONPATH=str(BACKEND), BACKEND_AUTH_ENABLED='false', MODEL_VERSION='1.3')
+    process = subprocess.Popen(command, cwd=directory, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/model/idealFunctionalities')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{server} did not start')
+
+def hold_event_stream(port: int, stop: threading.Event) -> None:
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', '/model/events')
+        resp = conn.getresponse()
+        while not stop.is_set():
+            resp.fp.readline()
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
+def user(port: int, number: int, tab: str, until: float, latencies: list, errors: list) -> None:
+    model = f'Bench{number}'
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    headers = {'SessionTabId': tab, 'TestUsername': f'user{number}'}
+
+    def call(method, url, body=None, **extra):
+        start = time.perf_counter()
+        conn.request(method, url, body=body, headers={**headers, **extra})
+        resp = conn.getresponse()
+        data = resp.read()
+        latencies.append(time.perf_counter() - start)
+        if resp.status >= 300:
+            errors.append(f'{method} {url}: {resp.status}')
+        return resp, data
+
+    while time.monotonic() < until:
+        try:
+            call('GET', '/model')
+            resp, _ = call('GET', f'/model/{model}')
+            patch = json.dumps([{'op': 'add', 'path': '/description', 'value': str(time.time())}])
+            call('PATCH', f'/model/{model}', patch, **{'Content-Type': 'application/json-patch+json',
+                                                       'Model-Revision': resp.getheader('Model-Revision', '0')})
+            call('GET', '/model/idealFunctionalities')
+            call('PUT', f'/model/return/{model}', json.dumps({'readOnly': ''}), **{'Content-Type': 'application/json'})
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.close()
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else float('nan')
+
+def run(port: int, users: int, seconds: float, event_streams: int) -> dict:
+    stop = threading.Event()
+    streams = [threading.Thread(target=hold_event_stream, args=(port, stop), daemon=True) for _ in range(event_streams)]
+    for stream in streams:
+        stream.start()
+    time.sleep(1)
+    latencies, errors = [], []
+    until = time.monotonic() + seconds
+    threads = [threading.Thread(target=user, args=(port, i, f'tab{i}/x', until, latencies, errors)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop.set()
+    return {'requests_per_s': round(len(latencies) / seconds, 1), 'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1), 'errors': len(errors)}
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare how many concurrent users the Flask and ASGI backends serve.')
+    parser.add_argument('--users', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--models', type=int, default=300, help='models in the corpus (at least the most users)')
+    parser.add_argument('--seconds', type=float, default=10, help='length of each run')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=64, help='threads of each Flask worker')
+    parser.add_argument('--event-streams', type=int, default=0, help='idle /model/events streams held open')
+    parser.add_argument('--slo-ms', type=float, default=500, help='p95 latency a user count must stay under')
+    parser.add_argument('--servers', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+    args = parser.parse_args()
+    directory = Path(tempfile.mkdtemp(prefix='concurrentUsers-'))
+    try:
+        build_corpus(directory, max(args.models, max(args.users)))
+        for server in args.servers:
+            process, port = start(server, directory, args.workers, args.threads)
+            capacity = 0
+            try:
+                for users in args.users:
+                    result = run(port, users, args.seconds, args.event_streams)
+                    print(json.dumps({'server': server, 'users': users, 'event_streams': args.event_streams, **result}), flush=True)
+                    if result['p95_ms'] < args.slo_ms and not result['errors']:
+                        capacity = users
+            finally:
+                process.send_signal(signal.SIGTERM)
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            print(json.dumps({'server': server, 'capacity_users': capacity, 'slo_p95_ms': args.slo_ms}), flush=True)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""End-to-end load test of the frontend's editing sessions, for a capacity figure per server configuration.
+
+Run from the backend directory:
+
+    python benchmarks/loadTest.py --configs flask:4x64 flask:8x16 asgi:4 --users 8 32 128 --seconds 30
+
+Each configuration (`flask:<workers>x<threads>` or `asgi:<workers>`) is
+started on the same copy of a corpus of test models and driven in turn by
+every `--users` count of simulated users, each with `--tabs` browser
+tabs. A tab replays what the frontend does in an editing session: it
+lists the models, opens one (which locks it), saves the whole model every
+`--save-interval` seconds (the editor's debounced save) `--saves` times
+while the code generator polls the ideal functionalities every
+`--poll-interval` seconds, then returns the model. Tabs pick their
+models from the first `--models` of the corpus, so users run into each
+other's locks; a tab that finds its model locked by someone else
+(`readOnly` set) only polls for the session and moves on, like a
+read-only editor. With `--transitions`, the corpus is synthetic models of
+that size from `corpusGenerator` instead of copies of the test models.
+
+Every run prints the throughput, the p50/p95/p99 latency and the errors
+of each route, the lock conflicts (models opened read-only, 423 Locked
+answers) and the corrupted reads (models listed as CORRUPTED or that
+could not be opened). A configuration's capacity is the most users it
+served with every route's p95 under `--slo-ms` and no errors.
+"""
+
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import tempfile
+import argparse
+import threading
+import subprocess
+import http.client
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from concurrentUsers import BACKEND, SERVERS, percentile, start
+from streamingResponses import build_corpus
+
+class Results:
+    """Latencies and outcomes of one run, shared by its tabs."""
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.latencies = {} # route -> seconds of each request
+        self.errors = {} # route -> requests that failed
+        self.lock_conflicts = 0
+        self.corrupted_reads = 0
+
+    def request(self, route: str, seconds: float | None) -> None:
+        """Records a request of `route` that took `seconds`, or failed (None)."""
+        with self.mutex:
+            if seconds is None:
+                self.errors[route] = self.errors.get(route, 0) + 1
+            else:
+                self.latencies.setdefault(route, []).append(seconds)
+
+    def conflict(self) -> None:
+        with self.mutex:
+            self.lock_conflicts += 1
+
+    def corrupted(self, count=1) -> None:
+        with self.mutex:
+            self.corrupted_reads += count
+
+    def summary(self, seconds: float) -> dict:
+        routes = {}
+        for route in sorted(set(self.latencies) | set(self.errors)):
+            values = self.latencies.get(route, [])
+            routes[route] = {'requests': len(values), 'errors': self.errors.get(route, 0),
+                             **{f'p{q}_ms': round(percentile(values, q / 100) * 1000, 1) for q in (50, 95, 99)}}
+        return {'requests_per_s': round(sum(len(values) for values in self.latencies.values()) / seconds, 1),
+                'errors': sum(self.errors.values()), 'lock_conflicts': self.lock_conflicts,
+                'corrupted_reads': self.corrupted_reads, 'routes': routes}
+
+class Tab:
+    """Tab(port, user, tab, args, results) -> one browser tab of a simulated user"""
+
+    def __init__(self, port: int, user: int, tab: int, args, results: Results):
+        self.port = port
+        self.args = args
+        self.results = results
+        self.rng = random.Random(args.seed * 1_000_003 + user * 1009 + tab)
+        self.headers = {'SessionTabId': f'session{user}/tab{tab}', 'TestUsername': f'user{user}'}
+        self.conn = None
+        self.next_poll = 0.0
+
+    def call(self, method: str, url: str, route: str, body=None) -> tuple[int, bytes]:
+        """call(method, url, route, body) -> (status, body); (0, b'') if the connection failed"""
+        headers = dict(self.headers)
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            self.conn.request(method, url, body=body, headers=headers)
+            resp = self.conn.getresponse()
+            data = resp.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            self.results.request(route, None)
+            return 0, b''
+        seconds = time.perf_counter() - start
+        if resp.status == 423:
+            self.results.conflict()
+            self.results.request(route, seconds)
+        elif resp.status == 500 and b'corrupted' in data:
+            self.results.corrupted()
+            self.results.request(route, seconds)
+        else:
+            self.results.request(route, seconds if resp.status < 400 else None)
+        return resp.status, data
+
+    def poll_until(self, until: float, deadline: float) -> None:
+        """Polls the ideal functionalities like the code generator until `until`."""
+        until = min(until, deadline)
+        while self.next_poll < until:
+            time.sleep(max(self.next_poll - time.monotonic(), 0))
+            self.call('GET', '/model/idealFunctionalities', 'GET /model/idealFunctionalities')
+            self.next_poll = time.monotonic() + self.rng.uniform(0.5, 1.5) * self.args.poll_interval
+        time.sleep(max(until - time.monotonic(), 0))
+
+    def session(self, deadline: float) -> None:
+        status, data = self.call('GET', '/model', 'GET /model')
+        if status == 200:
+            self.results.corrupted(sum(entry['readOnly'] == 'CORRUPTED' for entry in json.loads(data)))
+        model = f'Bench{self.rng.randrange(self.args.models)}'
+        status, data = self.call('GET', f'/model/{model}', 'GET /model/<id>')
+        if status != 200:
+            return
+        data = json.loads(data)
+        length = self.args.saves * self.args.save_interval
+        if data['readOnly']:
+            self.results.conflict()
+            self.poll_until(time.monotonic() + length, deadline)
+            return
+        del data['readOnly']
+        for _ in range(self.args.saves):
+            self.poll_until(time.monotonic() + self.rng.uniform(0.5, 1.5) * self.args.save_interval, deadline)
+            if time.monotonic() >= deadline:
+                break
+            self.call('PUT', f'/model/{model}', 'PUT /model/<id>', data)
+        self.call('PUT', f'/model/return/{model}', 'PUT /model/return/<id>', {'readOnly': ''})
+
+    def run(self, deadline: float) -> None:
+        # tabs start spread over a save interval, not in lockstep
+        time.sleep(self.rng.uniform(0, self.args.save_interval))
+        self.next_poll = time.monotonic() + self.rng.uniform(0, self.args.poll_interval)
+        while time.monotonic() < deadline:
+            self.session(deadline)
+        if self.conn is not None:
+            self.conn.close()
+
+def run(port: int, users: int, args) -> dict:
+    results = Results()
+    deadline = time.monotonic() + args.seconds
+    tabs = [Tab(port, user, tab, args, results) for user in range(users) for tab in range(args.tabs)]
+    threads = [threading.Thread(target=tab.run, args=(deadline,)) for tab in tabs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results.summary(args.seconds)
+
+def parse_config(text: str) -> tuple[str, int, int]:
+    """parse_config('flask:4x64') -> (server, workers, threads)"""
+    server, _, size = text.partition(':')
+    workers, _, threads = (size or '1').partition('x')
+    if server not in SERVERS:
+        raise argparse.ArgumentTypeError(f'unknown server {server!r}, not one of {", ".join(SERVERS)}')
+    return server, int(workers), int(threads or 1)
+
+def capacity(result: dict, slo_ms: float) -> bool:
+    """capacity(result, slo) -> whether a run stayed within the service level"""
+    return not result['errors'] and all(route['p95_ms'] < slo_ms for route in result['routes'].values())
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test the backend with simulated editing sessions.')
+    parser.add_argument('--configs', type=parse_config, nargs='+', default=[parse_config('flask:4x64'), parse_config('asgi:4')],
+                        help='server configurations, flask:<workers>x<threads> or asgi:<workers>')
+    parser.add_argument('--users', type=int, nargs='+', default=[8, 32, 128])
+    parser.add_argument('--tabs', type=int, default=1, help='browser tabs of each user')
+    parser.add_argument('--models', type=int, default=100, help='models the tabs open (fewer means more lock conflicts)')
+    parser.add_argument('--corpus', type=int, default=300, help='models in the corpus (at least --models)')
+    parser.add_argument('--transitions', type=int, default=0,
+                        help='build a synthetic corpus of models with this many transitions instead of copying the test models')
+    parser.add_argument('--seconds', type=float, default=30, help='length of each run')
+    parser.add_argument('--saves', type=int, default=5, help='saves in an editing session')
+    parser.add_argument('--save-interval', type=float, default=2, help='mean seconds between saves')
+    parser.add_argument('--poll-interval', type=float, default=5, help='mean seconds between ideal functionality polls')
+    parser.add_argument('--slo-ms', type=float, default=500, help='p95 latency every route must stay under')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    args.corpus = max(args.corpus, args.models)
+    directory = Path(tempfile.mkdtemp(prefix='loadTest-'))
+    try:
+        if args.transitions:
+            sys.path.insert(0, str(BACKEND))
+            from corpusGenerator import populate
+            populate(directory / 'models', args.corpus, args.seed, prefix='Bench', subfunctionalities=2,
+                     parameterInterfaces=1, messages=max(args.transitions // 10, 20), states=max(args.transitions // 4, 8),
+                     transitions=args.transitions)
+        else:
+            build_corpus(directory, args.corpus)
+        for server, workers, threads in args.configs:
+            config = f'{server}:{workers}' + (f'x{threads}' if server == 'flask' else '')
+            process, port = start(server, directory, workers, threads)
+            served = 0
+            try:
+                for users in args.users:
+                    result = run(port, users, args)
+                    print(json.dumps({'config': config, 'users': users, 'tabs': args.tabs, **result}), flush=True)
+                    if capacity(result, args.slo_ms):
+                        served = users
+            finally:
+                process.send_signal(signal.SIGTERM)
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            print(json.dumps({'config': config, 'capacity_users': served, 'slo_p95_ms': args.slo_ms}), flush=True)
+    finally:
+        shutil.rmtree(directory)
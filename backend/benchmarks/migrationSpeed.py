@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""Model migration time, step registry against the previous implementation.
+
+Run from the backend directory:
+
+    python benchmarks/migrationSpeed.py --transitions 100 1000 5000
+
+Each synthetic model is FullModel1 with its state machines replaced by
+`--machines` machines sharing the given number of transitions, a third
+of them parallel (same source and target state) and the rest between
+distinct states, saved as a pre-versioning model so every step runs.
+Both implementations convert identical copies; their outputs are checked
+to be the same.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND))
+from reconciliationScript import convert_model
+from tests import legacyReconciliation
+
+MODEL = BACKEND / 'tests' / 'models' / 'FullModel1.json'
+
+def synthetic_model(transitions: int, machines: int, seed=0) -> dict:
+    rng = random.Random(seed)
+    full_data = json.loads(MODEL.read_text())
+    del full_data['modelVersion'], full_data['model']['modelVersion']
+    states = [{'color': '#e3c85b', 'id': f'state-{i}', 'left': 300 + i, 'name': f'State{i}', 'parameters': [], 'top': 200 + i}
+              for i in range(max(transitions // 4, 2))]
+    stateMachines = [{'id': f'machine-{i}', 'initState': states[0]['id'], 'states': [], 'transitions': []} for i in range(machines)]
+    items = []
+    for i in range(transitions):
+        machine = stateMachines[i % machines]
+        if i % 3 == 0:
+            fromState, toState = states[0]['id'], states[1]['id']
+        else:
+            fromState, toState = rng.choice(states)['id'], rng.choice(states)['id']
+        items.append({'fromState': fromState, 'guard': '', 'id': f'transition-{i}', 'inMessage': '', 'outMessage': '',
+                      'outMessageArguments': [], 'targetPort': '', 'toState': toState, 'toStateArguments': []})
+        machine['transitions'].append(f'transition-{i}')
+    full_data['model']['stateMachines'] = {'stateMachines': stateMachines, 'states': states, 'transitions': items}
+    for paramInter in full_data['model']['realFunctionality']['parameterInterfaces']:
+        for key in ('left', 'top', 'color'):
+            paramInter.pop(key, None)
+    return full_data
+
+def timed(convert, full_data: dict, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        copy = json.loads(json.dumps(full_data))
+        start = time.perf_counter()
+        convert(copy)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the model migration with the previous implementation.')
+    parser.add_argument('--transitions', type=int, nargs='+', default=[100, 1000, 3000])
+    parser.add_argument('--machines', type=int, default=4, help='state machines sharing the transitions')
+    parser.add_argument('--repeat', type=int, default=3, help='best of this many runs')
+    args = parser.parse_args()
+    for transitions in args.transitions:
+        full_data = synthetic_model(transitions, args.machines)
+        new, old = json.loads(json.dumps(full_data)), json.loads(json.dumps(full_data))
+        convert_model(new)
+        legacyReconciliation.convert_model(old)
+        assert json.dumps(new) == json.dumps(old), 'outputs differ'
+        legacy = timed(legacyReconciliation.convert_model, full_data, args.repeat)
+        steps = timed(convert_model, full_data, args.repeat)
+        print(json.dumps({'transitions': transitions, 'machines': args.machines, 'legacy_ms': round(legacy * 1000, 2),
+                          'steps_ms': round(steps * 1000, 2), 'speedup': round(legacy / steps, 1)}))
@@ -0,0 +1,262 @@
+"""Microbenchmarks of every backend route and of the helpers behind them (pytest-benchmark).
+
+Run from the backend directory:
+
+    pip install pytest-benchmark
+    python -m pytest benchmarks/routeBenchmarks.py --benchmark-autosave
+
+Routes are timed through the Flask test client against synthetic corpora
+from `corpusGenerator`, each timed on every corpus of `BENCHMARK_CORPORA`
+(default `small,medium,large`, see CORPORA). Read routes are timed as the
+frontend repeats them, answered from the response cache; the `cold` ones
+drop the caches before every round. Write routes run a fixed number of
+rounds on models of their own, so the corpus stays the same for the
+other benchmarks.
+
+`--benchmark-autosave` stores the results as JSON under `.benchmarks/`.
+To flag regressions against the last stored run (or `--benchmark-compare=0001`
+for a given one), failing when a median is more than 15% slower:
+
+    python -m pytest benchmarks/routeBenchmarks.py --benchmark-compare --benchmark-compare-fail=median:15%
+"""
+
+import os
+import sys
+import io
+import json
+import fcntl
+import itertools
+import pytest
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND))
+os.environ.setdefault('MODEL_VERSION', '1.3')
+os.environ.setdefault('BACKEND_AUTH_ENABLED', 'false')
+from corpusGenerator import populate
+
+# name -> (models, transitions of each model)
+CORPORA = {
+    'small': (20, 20),
+    'medium': (200, 200),
+    'large': (1000, 300),
+}
+SELECTED = os.environ.get('BENCHMARK_CORPORA', ','.join(CORPORA)).split(',')
+# rounds of the benchmarks that write
+WRITE_ROUNDS = 50
+HEADERS = {'SessionTabId': 'bench/tab1', 'TestUsername': 'bench'}
+
+@pytest.fixture(scope='session')
+def backend(tmp_path_factory):
+    """The backend module, imported in an empty directory; its store is replaced per corpus."""
+    directory = tmp_path_factory.mktemp('import')
+    (directory / 'models').mkdir()
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import backend
+    finally:
+        os.chdir(cwd)
+    return backend
+
+@pytest.fixture(scope='module', params=SELECTED)
+def corpus(request, backend, tmp_path_factory):
+    """corpus -> {'name', 'directory', 'ids', ...} with the backend serving it"""
+    from modelStore import JsonModelStore
+    from modelCache import ModelCache
+    from modelEvents import EventLog
+    count, transitions = CORPORA[request.param]
+    directory = tmp_path_factory.mktemp(request.param) / 'models'
+    ids = populate(directory, count, prefix='Bench', subfunctionalities=2, parameterInterfaces=1,
+                   messages=max(transitions // 10, 20), states=max(transitions // 4, 8), transitions=transitions)
+    store = JsonModelStore(str(directory))
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(backend, 'store', store)
+        patch.setattr(backend, 'responses', ModelCache(backend.responses.max_bytes, 'response'))
+        patch.setattr(backend, 'events', EventLog(store.locks.database))
+        store.catalog()
+        ideal = store.load(ids[0])['model']
+        real = store.load(ids[1])['model']
+        yield {'name': request.param, 'directory': directory, 'ids': ids, 'store': store, 'model': ids[1],
+               'if_id': ideal['idealFunctionality']['id'], 'comp_id': ideal['idealFunctionality']['compositeDirectInterface'],
+               'real': real}
+
+@pytest.fixture(scope='module')
+def client(backend, corpus):
+    return backend.app.test_client()
+
+def fetch(client, method: str, url: str, **kwargs) -> bytes:
+    with client.open(url, method=method, headers={**HEADERS, **kwargs.pop('headers', {})}, **kwargs) as resp:
+        assert resp.status_code < 400, (method, url, resp.status_code)
+        return resp.data
+
+def drop_caches(backend) -> None:
+    from modelCache import ModelCache
+    backend.responses = ModelCache(backend.responses.max_bytes, 'response')
+    backend.store.cache = ModelCache(backend.store.cache.max_bytes)
+
+# read routes
+READS = {
+    'index': '/model',
+    'page': '/model?limit=50',
+    'model': '/model/{model}',
+    'export': '/model/export/{model}',
+    'idealFunctionalities': '/model/idealFunctionalities',
+    'idealFunctionalityMessages': '/model/idealFunctionalities/{if_id}/messages',
+    'compInterfaces': '/model/compInterfaces',
+    'compInterMessages': '/model/compInterfaces/{comp_id}/messages',
+    'returnSession': '/model/return',
+    'adminLocks': '/admin/locks',
+    'metrics': '/metrics',
+}
+
+@pytest.mark.benchmark(group='read')
+@pytest.mark.parametrize('route', READS)
+def test_read(benchmark, client, corpus, route):
+    url = READS[route].format(**corpus)
+    benchmark(fetch, client, 'GET', url)
+
+@pytest.mark.benchmark(group='read-cold')
+@pytest.mark.parametrize('route', ['index', 'model', 'idealFunctionalities', 'idealFunctionalityMessages', 'compInterMessages'])
+def test_read_cold(benchmark, backend, client, corpus, route):
+    url = READS[route].format(**corpus)
+    benchmark.pedantic(fetch, (client, 'GET', url), setup=lambda: drop_caches(backend), rounds=WRITE_ROUNDS)
+
+@pytest.mark.benchmark(group='read')
+def test_events(benchmark, client, corpus):
+    """Time to the first chunk of an event stream."""
+    def first_chunk():
+        resp = client.get('/model/events', headers=HEADERS, buffered=False)
+        next(iter(resp.response))
+        resp.close()
+    benchmark(first_chunk)
+
+# write routes, on models of their own
+@pytest.fixture
+def scratch(backend, corpus):
+    """scratch(name, copy) -> id of a model (a copy of the corpus' model) removed after the benchmark"""
+    created = []
+    def make(name: str, copy=True) -> str:
+        created.append(name)
+        if copy:
+            full_data = corpus['store'].load(corpus['model'])
+            full_data['model']['name'] = name
+            corpus['store'].save(name, full_data)
+        return name
+    yield make
+    for name in created:
+        backend.store.locks.release(name)
+        if corpus['store'].exists(name):
+            corpus['store'].remove(name)
+
+@pytest.mark.benchmark(group='write')
+def test_put(benchmark, client, corpus, scratch):
+    id = scratch('BenchPut')
+    model = dict(corpus['real'], name=id)
+    benchmark.pedantic(fetch, (client, 'PUT', f'/model/{id}'), {'json': model}, rounds=WRITE_ROUNDS)
+
+@pytest.mark.benchmark(group='write')
+def test_patch(benchmark, client, corpus, scratch):
+    id = scratch('BenchPatch')
+    revision = itertools.count(corpus['store'].load(id).get('revision', 0))
+    def patch():
+        body = [{'op': 'replace', 'path': '/idealFunctionality/left', 'value': 250}]
+        return fetch(client, 'PATCH', f'/model/{id}', json=body,
+                     headers={'Content-Type': 'application/json-patch+json', 'Model-Revision': str(next(revision))})
+    benchmark.pedantic(patch, rounds=WRITE_ROUNDS)
+
+@pytest.mark.benchmark(group='write')
+def test_post(benchmark, client, corpus, scratch):
+    ids = (scratch(f'BenchPost{i}', copy=False) for i in itertools.count())
+    def setup():
+        id = next(ids)
+        return (client, 'POST', f'/model/{id}'), {'json': {'name': id}}
+    benchmark.pedantic(fetch, setup=setup, rounds=WRITE_ROUNDS)
+
+@pytest.mark.benchmark(group='write')
+def test_delete(benchmark, client, corpus, scratch):
+    ids = (scratch(f'BenchDelete{i}') for i in itertools.count())
+    benchmark.pedantic(fetch, setup=lambda: ((client, 'DELETE', f'/model/{next(ids)}'), {}), rounds=WRITE_ROUNDS)
+
+@pytest.mark.benchmark(group='write')
+def test_import(benchmark, client, corpus, scratch):
+    from werkzeug.datastructures import FileStorage
+    scratch('BenchImport', copy=False)
+    full_data = corpus['store'].load(corpus['model'])
+    full_data['model']['name'] = 'BenchImport'
+    content = json.dumps(full_data).encode('utf-8')
+    def setup():
+        if corpus['store'].exists('BenchImport'):
+            corpus['store'].remove('BenchImport')
+        upload = FileStorage(stream=io.BytesIO(content), filename='BenchImport.json', content_type='application/json')
+        return (client, 'POST', '/model/import/BenchImport.json'), {'data': {'BenchImport.json': upload}}
+    benchmark.pedantic(fetch, setup=setup, rounds=WRITE_ROUNDS)
+
+@pytest.mark.benchmark(group='write')
+def test_open_and_return(benchmark, client, corpus):
+    def session():
+        fetch(client, 'GET', f'/model/{corpus["model"]}')
+        fetch(client, 'PUT', f'/model/return/{corpus["model"]}', json={'readOnly': ''})
+    benchmark(session)
+
+# helpers
+@pytest.mark.benchmark(group='helpers')
+def test_locked_open(benchmark, corpus):
+    from modelStore import locked_open
+    path = corpus['directory'] / f'{corpus["model"]}.json'
+    def read():
+        with locked_open(str(path), 'r', fcntl.LOCK_SH) as fp:
+            return fp.read()
+    benchmark(read)
+
+@pytest.mark.benchmark(group='helpers')
+def test_lock_model(benchmark, backend, corpus):
+    def lock_unlock():
+        backend.lock_model(corpus['model'], 'bench/helpers')
+        backend.unlock_model(corpus['model'])
+    benchmark(lock_unlock)
+
+@pytest.mark.benchmark(group='helpers')
+def test_convert_files(benchmark, corpus, tmp_path):
+    """convert_files on ten 1.2 models of the corpus' size."""
+    from reconciliationScript import convert_files
+    older = tmp_path / 'older'
+    populate(older, 10, prefix='Old', versions=('1.2',), ideal_every=10, subfunctionalities=2, parameterInterfaces=1,
+             transitions=CORPORA[corpus['name']][1])
+    originals = {path: path.read_bytes() for path in older.glob('*.json')}
+    def setup():
+        for path, content in originals.items():
+            path.write_bytes(content)
+        return (list(originals), 'off'), {}
+    benchmark.pedantic(convert_files, setup=setup, rounds=10)
+
+@pytest.fixture
+def signing(backend, monkeypatch):
+    """sign(username) -> a token that verifies against a locally generated RSA key"""
+    import jwt
+    import time
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from tokenAuth import KeyStore, TokenCache
+    private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    keys = KeyStore('http://keycloak.invalid/realms/bench')
+    monkeypatch.setattr(keys, 'fetch', lambda: {'k1': private.public_key()})
+    keys.pid = os.getpid() # no refresh thread
+    monkeypatch.setattr(backend, 'keys', keys)
+    monkeypatch.setattr(backend, 'tokens', TokenCache(1))
+    def sign(username: str) -> str:
+        claims = {'preferred_username': username, 'exp': int(time.time()) + 3600, 'realm_access': {'roles': []}}
+        return 'Bearer ' + jwt.encode(claims, private, algorithm='RS256', headers={'kid': 'k1'})
+    return sign
+
+@pytest.mark.benchmark(group='helpers')
+@pytest.mark.parametrize('cached', [True, False], ids=['cached', 'verified'])
+def test_decode_token(benchmark, backend, corpus, signing, cached):
+    # two tokens take turns in a cache of one, so each decode verifies the signature
+    tokens = itertools.cycle([signing('user1')] if cached else [signing('user1'), signing('user2')])
+    assert backend.decode_token(next(tokens))['token_status'] == 'valid'
+    benchmark(lambda: backend.decode_token(next(tokens)))
+
+@pytest.mark.benchmark(group='helpers')
+def test_validation_check(benchmark, backend, corpus):
+    names = corpus['ids'][:50] + ['UC_Model', 'bad__name', 'Trailing_', 'lowercase']
+    benchmark(lambda: [backend.validation_check(name) for name in names])
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""Time to first byte and peak memory of the list endpoints, streamed and buffered.
+
+Run from the backend directory:
+
+    python benchmarks/streamingResponses.py --models 1000
+
+Builds a corpus of copies of the test models (all referencing the same
+ideal functionality and composite interfaces, so the `/messages`
+endpoints read every model), then serves each endpoint once per mode in
+a fresh process, so neither mode benefits from the other's caches. Peak
+RSS is the high-water mark during the request above the resident size
+before it.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent
+MODELS = BACKEND / 'tests' / 'models'
+ENDPOINTS = {
+    'index': '/model',
+    'idealFunctionalities': '/model/idealFunctionalities',
+    'compInterfaces': '/model/compInterfaces',
+    'idealFunctionalityMessages': '/model/idealFunctionalities/{if_id}/messages',
+    'compInterMessages': '/model/compInterfaces/{comp_id}/messages',
+}
+
+def build_corpus(directory: Path, count: int) -> dict:
+    sys.path.insert(0, str(BACKEND))
+    from reconciliationScript import convert_model
+    sources = [json.loads((MODELS / name).read_text()) for name in ('FullModel1.json', 'IdealOnly1.json')]
+    for full_data in sources:
+        convert_model(full_data)
+    models = directory / 'models'
+    models.mkdir()
+    for i in range(count):
+        full_data = sources[i % len(sources)]
+        full_data['model']['name'] = f'Bench{i}'
+        (models / f'Bench{i}.json').write_text(json.dumps(full_data, indent=2))
+    ideal_only = sources[1]['model']
+    return {'if_id': ideal_only['idealFunctionality']['id'], 'comp_id': ideal_only['interfaces']['compInters'][0]['id']}
+
+def rss_kib(field: str) -> int:
+    with open('/proc/self/status') as fp:
+        for line in fp:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+def measure(url: str) -> dict:
+    """Runs in the child: serve `url` once from the corpus in the working directory."""
+    sys.path.insert(0, str(BACKEND))
+    import backend
+    backend.store.catalog() # built on first use; not part of either mode
+    client = backend.app.test_client()
+    before = rss_kib('VmRSS')
+    with open('/proc/self/clear_refs', 'w') as fp:
+        fp.write('5') # reset the VmHWM high-water mark
+    start = time.perf_counter()
+    resp = client.get(url, buffered=False)
+    chunks = iter(resp.response)
+    size = len(next(chunks, b''))
+    first_byte = time.perf_counter() - start
+    for chunk in chunks:
+        size += len(chunk)
+    total = time.perf_counter() - start
+    resp.close()
+    return {'status': resp.status_code, 'bytes': size, 'ttfb_ms': round(first_byte * 1000, 2),
+            'total_ms': round(total * 1000, 2), 'peak_rss_kib': rss_kib('VmHWM') - before}
+
+def run(directory: Path, url: str, stream: bool, model_cache_bytes: int) -> dict:
+    env = dict(os.environ, BACKEND_AUTH_ENABLED='false', MODEL_VERSION='1.3',
+               STREAM_RESPONSES='on' if stream else 'off', MODEL_CACHE_BYTES=str(model_cache_bytes))
+    output = subprocess.run([sys.executable, __file__, '--child', url], cwd=directory, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare streamed and buffered list responses.')
+    parser.add_argument('--models', type=int, default=1000, help='models in the corpus')
+    parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument('--model-cache-bytes', type=int, default=64 * 1024 * 1024, help='MODEL_CACHE_BYTES of the server')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure(args.child)))
+        sys.exit()
+    directory = Path(tempfile.mkdtemp(prefix='streamingResponses-'))
+    try:
+        ids = build_corpus(directory, args.models)
+        for name in args.endpoints:
+            url = ENDPOINTS[name].format(**ids)
+            for stream in (False, True):
+                result = run(directory, url, stream, args.model_cache_bytes)
+                print(json.dumps({'endpoint': name, 'models': args.models, 'mode': 'stream' if stream else 'buffered', **result}))
+    finally:
+        shutil.rmtree(directory)
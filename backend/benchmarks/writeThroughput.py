@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Model write throughput with fsync on, grouped and off.
+
+Run from the backend directory:
+
+    python benchmarks/writeThroughput.py --threads 1 8 --writes 200
+
+Each configuration saves copies of a test model through `JsonModelStore`
+(or, with `--raw`, only through `atomic_write`, leaving out the catalog
+update) from several threads at once. Use `--directory` to measure the
+disk the models volume lives on; the default temp directory may be a
+tmpfs, where fsync costs nothing.
+"""
+
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import atomicWrite
+from atomicWrite import FSYNC_MODES, GroupCommit, atomic_write
+from modelStore import JsonModelStore
+
+MODEL = Path(__file__).resolve().parent.parent / 'tests' / 'models' / 'FullModel1.json'
+
+def run(directory: str, fsync: str, threads: int, writes: int, raw=False) -> dict:
+    atomicWrite.group_commit = GroupCommit()
+    store = JsonModelStore(directory, fsync=fsync)
+    full_data = json.loads(MODEL.read_text())
+    body = json.dumps(full_data, indent=2).encode('utf-8')
+
+    def write(thread: int):
+        for i in range(writes):
+            id = f'bench{thread}-{i % 10}'
+            if raw:
+                atomic_write(store.path(id), body, fsync)
+            else:
+                store.save(id, full_data)
+
+    workers = [threading.Thread(target=write, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    result = {'target': 'atomic_write' if raw else 'store', 'fsync': fsync,
+              'threads': threads, 'writes': threads * writes, 'seconds': round(elapsed, 3), 'writes_per_second': round(threads * writes / elapsed, 1)}
+    if fsync == 'group':
+        group = atomicWrite.group_commit
+        result['writes_per_fsync_batch'] = round(group.writes / max(group.batches, 1), 2)
+    return result
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure model write throughput with fsync on and off.')
+    parser.add_argument('--directory', help='directory to write into (default: a new temp directory)')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8], help='concurrent writers')
+    parser.add_argument('--writes', type=int, default=100, help='writes per thread')
+    parser.add_argument('--fsync', nargs='+', choices=FSYNC_MODES, default=list(FSYNC_MODES))
+    parser.add_argument('--raw', action='store_true', help='write with atomic_write only, without the catalog')
+    args = parser.parse_args()
+    for fsync in args.fsync:
+        for threads in args.threads:
+            directory = tempfile.mkdtemp(prefix='writeThroughput-', dir=args.directory)
+            try:
+                print(json.dumps(run(directory, fsync, threads, args.writes, args.raw)))
+            finally:
+                shutil.rmtree(directory)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+
+"""Synthetic models at a chosen scale, for the benchmarks and load tests.
+
+    python corpusGenerator.py ./models --count 5000 --transitions 2000 --versions 1.3 1.2 none
+
+Every model is built from its own seeded random generator, so the same
+arguments always write the same files. Models are assembled the way the
+frontend lays them out: the ideal functionality, simulator and parties
+each have a state machine, their interfaces are instances of basic
+interfaces in the composite ones, and transitions send and receive the
+messages of their owner's interfaces, of its subfunctionalities and of
+its parameter interfaces (`message/subfunctionality` references). Every
+`--ideal-every`th model is an ideal functionality on its own, which the
+models after it use as subfunctionalities and parameter interfaces.
+
+A model is first built as a pre-versioning model and then brought up to
+its version by the steps of `reconciliationScript.MIGRATIONS`, so older
+versions are exactly what the migration expects.
+"""
+
+import uuid
+import json
+import random
+import argparse
+from pathlib import Path
+from reconciliationScript import CURRENT_VERSION, MIGRATIONS
+
+# the versions a model can be generated at; None is a model from before versioning
+VERSIONS = (None, *MIGRATIONS, CURRENT_VERSION)
+PARAMETER_TYPES = ('float', 'uint16', 'int32')
+# the composite interfaces every model has: the ideal functionality's, and the real functionality's two
+BASE_COMP_INTERS = 3
+# timestamp of the first generated model; the others follow a second apart
+BASE_TIME = 1_700_000_000
+
+class Builder:
+    """Builder(rng) -> ids and parts of one model"""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.messages = []
+        self.basicInters = []
+        self.compInters = []
+
+    def id(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def parameters(self, prefix: str, most: int) -> list[dict]:
+        return [{'id': self.id(), 'name': f'{prefix}{i}', 'type': self.rng.choice(PARAMETER_TYPES)}
+                for i in range(self.rng.randint(0, most))]
+
+    def basic_inter(self, name: str, type: str) -> dict:
+        basicInter = {'id': self.id(), 'messages': [], 'name': name, 'type': type}
+        self.basicInters.append(basicInter)
+        return basicInter
+
+    def comp_inter(self, name: str, type: str, basicInters: list[dict]) -> dict:
+        compInter = {'basicInterfaces': [{'idOfBasic': basicInter['id'], 'idOfInstance': self.id(), 'name': basicInter['name']}
+                                         for basicInter in basicInters],
+                     'id': self.id(), 'name': name, 'type': type}
+        self.compInters.append(compInter)
+        return compInter
+
+    def add_messages(self, count: int) -> None:
+        """Spreads `count` messages over the basic interfaces, in and out in turn."""
+        for i in range(count):
+            message = {'id': self.id(), 'name': f'mess{i}', 'parameters': self.parameters(f'm{i}param', 2),
+                       'port': f'pt{i % 8 + 1}', 'type': 'in' if i % 2 == 0 else 'out'}
+            self.messages.append(message)
+            self.basicInters[i % len(self.basicInters)]['messages'].append(message['id'])
+
+    def messages_of(self, basicInters: list[dict]) -> list[tuple[str, dict]]:
+        """messages_of(basicInters) -> [(reference, message)] a state machine can use"""
+        byId = {message['id']: message for message in self.messages}
+        return [(messageId, byId[messageId]) for basicInter in basicInters for messageId in basicInter['messages']]
+
+def ideal_refs(full_data: dict) -> dict:
+    """ideal_refs(full_data) -> what other models need to use this one's ideal functionality"""
+    data = full_data['model']
+    idealFunctionality = data['idealFunctionality']
+    compInter = next(compInter for compInter in data['interfaces']['compInters']
+                     if compInter['id'] == idealFunctionality['compositeDirectInterface'])
+    basicIds = {basicInter['idOfBasic'] for basicInter in compInter['basicInterfaces']}
+    messageIds = {messageId for basicInter in data['interfaces']['basicInters'] if basicInter['id'] in basicIds
+                  for messageId in basicInter['messages']}
+    return {'model': data['name'], 'idealFunctionality': idealFunctionality, 'compInter': compInter,
+            'messages': [message for message in data['interfaces']['messages'] if message['id'] in messageIds]}
+
+def generate_model(name: str, seed=0, parties=2, subfunctionalities=0, parameterInterfaces=0, compInters=BASE_COMP_INTERS,
+                   basicInters=0, messages=20, states=8, transitions=12, version=CURRENT_VERSION,
+                   ideals=(), lastModified=BASE_TIME) -> dict:
+    """generate_model(name, seed, ...) -> a model file's data
+
+       The counts are totals for the model; `compInters` and `basicInters`
+       are raised to what the parties need, and every state machine gets
+       at least its initial state. Subfunctionalities and parameter
+       interfaces use the `ideals` (from `ideal_refs`) in turn.
+    """
+    if version not in VERSIONS:
+        raise ValueError(f'Unknown model version {version!r}')
+    if (subfunctionalities or parameterInterfaces) and not ideals:
+        raise ValueError('Subfunctionalities and parameter interfaces need ideal functionality models to use')
+    rng = random.Random(f'{seed}/{name}')
+    build = Builder(rng)
+    compInters = max(compInters, BASE_COMP_INTERS)
+
+    idealDirBasic = build.basic_inter('IdealDirBasic', 'direct')
+    idealAdvBasic = build.basic_inter('IdealAdvBasic', 'adversarial')
+    simAdvBasic = build.basic_inter('SimAdvBasic', 'adversarial')
+    realDirBasic = build.basic_inter('RealDirBasic', 'direct')
+    realAdvBasic = build.basic_inter('RealAdvBasic', 'adversarial')
+    partyBasics = [(build.basic_inter(f'P{i + 1}DirBasic', 'direct'), build.basic_inter(f'P{i + 1}AdvBasic', 'adversarial'))
+                   for i in range(parties)]
+    extraBasics = [build.basic_inter(f'Extra{i + 1}DirBasic', 'direct') for i in range(compInters - BASE_COMP_INTERS)]
+    # basic interfaces past what the structure needs are more instances in the ideal functionality's interface
+    idealBasics = [idealDirBasic] + [build.basic_inter(f'Ideal{i + 1}DirBasic', 'direct')
+                                     for i in range(max(basicInters - len(build.basicInters), 0))]
+    build.add_messages(messages)
+
+    idealDir = build.comp_inter('IdealDir', 'direct', idealBasics)
+    realDir = build.comp_inter('RealDir', 'direct', [realDirBasic] + [direct for direct, _ in partyBasics])
+    realAdv = build.comp_inter('RealAdv', 'adversarial', [realAdvBasic] + [adversarial for _, adversarial in partyBasics])
+    for i, basicInter in enumerate(extraBasics):
+        build.comp_inter(f'Extra{i + 1}Dir', 'direct', [basicInter])
+
+    # state machines, with the messages their transitions can use
+    machines = []
+    def state_machine(pool: list) -> str:
+        machine = {'id': build.id(), 'initState': '', 'states': [], 'transitions': []}
+        machines.append((machine, pool))
+        return machine['id']
+
+    idealFunctionality = {'id': build.id(), 'name': 'IF', 'basicAdversarialInterface': idealAdvBasic['id'],
+                          'compositeDirectInterface': idealDir['id'],
+                          'stateMachine': state_machine(build.messages_of(idealBasics + [idealAdvBasic])),
+                          'color': '#3e88c7', 'left': 250, 'top': 250}
+    realFunctionality = {'parties': [], 'subfunctionalities': [], 'id': build.id(), 'name': 'Real_Functionality',
+                         'compositeDirectInterface': realDir['id'], 'compositeAdversarialInterface': realAdv['id'],
+                         'parameterInterfaces': []}
+    simulator = {'id': build.id(), 'name': 'Sim', 'basicAdversarialInterface': simAdvBasic['id'],
+                 'realFunctionality': realFunctionality['id'], 'stateMachine': state_machine(build.messages_of([simAdvBasic])),
+                 'color': '#6bb45c', 'left': 450, 'top': 201}
+    external = [] # (reference, message) of the subfunctionalities and parameter interfaces
+    subfunctionalityList = []
+    for i in range(subfunctionalities):
+        ideal = ideals[i % len(ideals)]
+        subfunctionality = {'color': '#8a6996', 'id': build.id(), 'idealFuncModel': ideal['model'],
+                            'idealFunctionalityId': ideal['idealFunctionality']['id'],
+                            'idealFunctionalityName': ideal['idealFunctionality']['name'],
+                            'left': 600 + 40 * i, 'name': f'Ideal{i + 1}', 'top': 300 + 40 * i}
+        subfunctionalityList.append(subfunctionality)
+        realFunctionality['subfunctionalities'].append(subfunctionality['id'])
+        external.extend((f'{message["id"]}/{subfunctionality["id"]}', message) for message in ideal['messages'])
+    for i in range(parameterInterfaces):
+        ideal = ideals[(subfunctionalities + i) % len(ideals)]
+        paramInter = {'compInterName': ideal['compInter']['name'], 'id': build.id(), 'idOfInterface': ideal['compInter']['id'],
+                      'modelName': ideal['model'], 'name': f'Param{i + 1}'}
+        realFunctionality['parameterInterfaces'].append(paramInter)
+        external.extend((f'{message["id"]}/{paramInter["id"]}', message) for message in ideal['messages'])
+    partyList = []
+    for i, (direct, adversarial) in enumerate(partyBasics):
+        party = {'basicAdversarialInterface': realAdv['basicInterfaces'][i + 1]['idOfInstance'],
+                 'basicDirectInterface': realDir['basicInterfaces'][i + 1]['idOfInstance'],
+                 'color': '#c4dd88', 'id': build.id(), 'left': 400 + 40 * i, 'name': f'P{i + 1}',
+                 'stateMachine': state_machine(build.messages_of([direct, adversarial]) + external), 'top': 200 + 40 * i}
+        partyList.append(party)
+        realFunctionality['parties'].append(party['id'])
+
+    # states and transitions, spread over the state machines
+    stateList = []
+    for i in range(max(states, len(machines))):
+        machine, _ = machines[i % len(machines)]
+        state = {'color': '#e3c85b', 'id': build.id(), 'left': 270 + 60 * (i // len(machines)),
+                 'name': 'InitState' if not machine['states'] else f'State{i}',
+                 'parameters': build.parameters(f's{i}param', 1), 'top': 150 + 40 * (i % 8)}
+        stateList.append(state)
+        machine['states'].append(state['id'])
+        machine['initState'] = machine['initState'] or state['id']
+    statesById = {state['id']: state for state in stateList}
+    transitionList = []
+    for i in range(transitions):
+        machine, pool = machines[i % len(machines)]
+        inMessage = pick(rng, pool, 'in')
+        outMessage = pick(rng, pool, 'out')
+        toState = statesById[rng.choice(machine['states'])]
+        transition = {'fromState': rng.choice(machine['states']), 'guard': '', 'id': build.id(),
+                      'inMessage': inMessage[0] if inMessage else '',
+                      'outMessage': outMessage[0] if outMessage else '',
+                      'outMessageArguments': [argument(parameter) for parameter in (outMessage[1]['parameters'] if outMessage else [])],
+                      'targetPort': outMessage[1]['port'] if outMessage and '/' not in outMessage[0] else '',
+                      'toState': toState['id'], 'toStateArguments': [argument(parameter) for parameter in toState['parameters']]}
+        transitionList.append(transition)
+        machine['transitions'].append(transition['id'])
+
+    full_data = {
+        'model': {
+            'interfaces': {'compInters': build.compInters, 'basicInters': build.basicInters, 'messages': build.messages},
+            'parties': {'parties': partyList},
+            'subfunctionalities': {'subfunctionalities': subfunctionalityList},
+            'realFunctionality': realFunctionality,
+            'simulator': simulator,
+            'idealFunctionality': idealFunctionality,
+            'stateMachines': {'stateMachines': [machine for machine, _ in machines], 'states': stateList,
+                              'transitions': transitionList},
+            'id': build.id(),
+            'name': name,
+            'readOnly': False,
+        },
+        'readOnly': '',
+        'lastModified': lastModified,
+    }
+    upgrade(full_data, version)
+    return full_data
+
+def pick(rng: random.Random, pool: list, type: str):
+    """pick(rng, pool, 'in' or 'out') -> a (reference, message) of the type, or of any type if there is none"""
+    matching = [item for item in pool if item[1]['type'] == type]
+    return rng.choice(matching or pool) if pool else None
+
+def argument(parameter: dict) -> dict:
+    return {'argValue': 'FLOAT_VALUE' if parameter['type'] == 'float' else 'INT_VALUE', 'paraID': parameter['id']}
+
+def upgrade(full_data: dict, version: str | None) -> None:
+    """Runs the migration steps on a pre-versioning model until it is at `version`."""
+    if version is None:
+        return
+    current = '1.0'
+    while True:
+        full_data['modelVersion'] = current
+        full_data['model']['modelVersion'] = current
+        if current == version:
+            return
+        current, step = MIGRATIONS[current]
+        step(full_data)
+
+def populate(directory, count: int, seed=0, prefix='Synth', ideal_every=10, versions=(CURRENT_VERSION,), **scale) -> list[str]:
+    """populate(directory, count, seed, ...) -> names of the `count` models written to `directory`
+
+       Every `ideal_every`th model, the first included, is an ideal
+       functionality with no parties; the others are built at `scale`
+       (the counts of `generate_model`) and use the ideal functionality
+       models written before them. Versions are drawn from `versions`.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    ideals = []
+    names = []
+    for i in range(count):
+        name = f'{prefix}{i}'
+        version = rng.choice(versions)
+        if i % ideal_every == 0:
+            full_data = generate_model(name, seed, parties=0, messages=scale.get('messages', 20), states=scale.get('states', 8),
+                                       transitions=scale.get('transitions', 12), version=version, lastModified=BASE_TIME + i)
+            ideals.append(ideal_refs(full_data))
+        else:
+            full_data = generate_model(name, seed, version=version, ideals=ideals, lastModified=BASE_TIME + i, **scale)
+        (directory / f'{name}.json').write_text(json.dumps(full_data, indent=2))
+        names.append(name)
+    return names
+
+def version_arg(text: str) -> str | None:
+    version = None if text == 'none' else text
+    if version not in VERSIONS:
+        raise argparse.ArgumentTypeError(f'not one of {", ".join(version or "none" for version in VERSIONS)}')
+    return version
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write a corpus of synthetic models.')
+    parser.add_argument('directory', help='models directory to write to')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prefix', default='Synth', help='model names are the prefix and a number')
+    parser.add_argument('--ideal-every', type=int, default=10, help='every this many models is an ideal functionality only')
+    parser.add_argument('--versions', type=version_arg, nargs='+', default=[CURRENT_VERSION],
+                        help='model versions to draw from; none is a model from before versioning')
+    parser.add_argument('--parties', type=int, default=2)
+    parser.add_argument('--subfunctionalities', type=int, default=2)
+    parser.add_argument('--parameter-interfaces', type=int, default=1)
+    parser.add_argument('--comp-inters', type=int, default=BASE_COMP_INTERS)
+    parser.add_argument('--basic-inters', type=int, default=0, help='total, at least what the parties and compInters need')
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--states', type=int, default=8)
+    parser.add_argument('--transitions', type=int, default=12)
+    args = parser.parse_args()
+    names = populate(args.directory, args.count, args.seed, args.prefix, args.ideal_every, args.versions,
+                     parties=args.parties, subfunctionalities=args.subfunctionalities,
+                     parameterInterfaces=args.parameter_interfaces, compInters=args.comp_inters,
+                     basicInters=args.basic_inters, messages=args.messages, states=args.states,
+                     transitions=args.transitions)
+    print(f'{len(names)} models written to {args.directory}')
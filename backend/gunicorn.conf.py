@@ -0,0 +1,21 @@
+# Loaded by gunicorn from the working directory, for both backend variants.
+
+import os
+import shutil
+import tempfile
+
+def on_starting(server):
+    # serverMetrics keeps each worker's samples in PROMETHEUS_MULTIPROC_DIR;
+    # start every server from an empty one so old counts are not summed in
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+    # likewise the workers' lock contention snapshots (see lockStats.py)
+    shutil.rmtree(os.environ.get('LOCK_STATS_DIR') or os.path.join(tempfile.gettempdir(), 'backend-lockstats'),
+                  ignore_errors=True)
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import io
+import gzip
+import zlib
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+
+try:
+    import zstandard
+except ImportError: # zstd is optional; without it only gzip is offered
+    zstandard = None
+
+# Responses smaller than this go out uncompressed.
+MIN_COMPRESS_BYTES = 1024
+READ_CHUNK = 64 * 1024
+
+def encodings() -> list[str]:
+    """encodings() -> the content codings this server can produce, preferred first"""
+    return ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+
+def negotiate(accept_encodings) -> str | None:
+    """negotiate(request.accept_encodings) -> 'zstd', 'gzip' or None for identity"""
+    return accept_encodings.best_match(encodings())
+
+def compress(data: bytes, encoding: str) -> bytes:
+    match encoding:
+        case 'gzip':
+            return gzip.compress(data, compresslevel=6, mtime=0)
+        case 'zstd':
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        case _:
+            raise ValueError(f'Unknown content coding "{encoding}"')
+
+def compress_stream(chunks, encoding: str):
+    """compress_stream(chunks, 'gzip' | 'zstd') -> compressed chunks
+
+       Every input chunk is flushed through the compressor, so a client can
+       start decoding before the last chunk has been produced.
+    """
+    match encoding:
+        case 'gzip':
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+        case 'zstd':
+            compressor = zstandard.ZstdCompressor(level=3).compressobj()
+            flush = lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        case _:
+            raise ValueError(f'Unknown content coding "{encoding}"')
+    for chunk in chunks:
+        data = compressor.compress(chunk) + flush()
+        if data:
+            yield data
+    yield compressor.flush()
+
+class LimitedReader(io.RawIOBase):
+    """Decompressed view of a request body that fails once it grows past `limit` bytes.
+
+       Decompression happens as the body is read, a chunk at a time, so a
+       small compressed body cannot expand in memory beyond the limit.
+    """
+
+    def __init__(self, source, limit: int):
+        self.source = source
+        self.limit = limit
+        self.total = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        try:
+            data = self.source.read(min(len(buffer), READ_CHUNK))
+        except (OSError, EOFError, zlib.error) as e:
+            raise BadRequest(f'Request body could not be decompressed: {e}')
+        except Exception as e:
+            if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                raise BadRequest(f'Request body could not be decompressed: {e}')
+            raise
+        self.total += len(data)
+        if self.total > self.limit:
+            raise RequestEntityTooLarge(f'Decompressed request body exceeds {self.limit} bytes')
+        buffer[:len(data)] = data
+        return len(data)
+
+def decompressing_stream(stream, encoding: str, limit: int):
+    match encoding:
+        case 'gzip':
+            source = gzip.GzipFile(fileobj=stream, mode='rb')
+        case 'zstd' if zstandard is not None:
+            source = zstandard.ZstdDecompressor().stream_reader(stream)
+        case _:
+            raise UnsupportedMediaType(f'Content-Encoding "{encoding}" not supported')
+    return io.BufferedReader(LimitedReader(source, limit), READ_CHUNK)
+
+class DecompressRequests:
+    """WSGI middleware that undoes `Content-Encoding` on request bodies.
+
+       The app below sees a plain body of unknown length; reading past
+       `limit` decompressed bytes answers 413, a broken body 400 and an
+       unknown coding 415.
+    """
+
+    def __init__(self, app, limit: int):
+        self.app = app
+        self.limit = limit
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', 'identity').strip().lower()
+        if encoding in ('', 'identity'):
+            return self.app(environ, start_response)
+        try:
+            stream = decompressing_stream(environ['wsgi.input'], encoding, self.limit)
+        except UnsupportedMediaType as e:
+            return e(environ, start_response)
+        environ = dict(environ)
+        environ['wsgi.input'] = stream
+        environ['wsgi.input_terminated'] = True
+        environ.pop('CONTENT_LENGTH', None)
+        environ.pop('HTTP_CONTENT_ENCODING', None)
+        return self.app(environ, start_response)
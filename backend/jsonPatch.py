@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+class JsonPatchError(ValueError):
+    pass
+
+def parse_pointer(pointer: str) -> list[str]:
+    """parse_pointer('/a/b~1c') -> ['a', 'b/c'] (RFC 6901)"""
+    if not isinstance(pointer, str) or (pointer and not pointer.startswith('/')):
+        raise JsonPatchError(f'Invalid JSON pointer "{pointer}"')
+    if not pointer:
+        return []
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+def _copy(container):
+    if isinstance(container, dict):
+        return dict(container)
+    if isinstance(container, list):
+        return list(container)
+    raise JsonPatchError('Path goes through a value that is not an object or array')
+
+def _key(container, token: str, adding=False):
+    if isinstance(container, dict):
+        if not adding and token not in container:
+            raise JsonPatchError(f'Member "{token}" does not exist')
+        return token
+    if adding and token == '-':
+        return len(container)
+    if not token.isdigit() or (token != '0' and token.startswith('0')):
+        raise JsonPatchError(f'Invalid array index "{token}"')
+    index = int(token)
+    if index > len(container) or (index == len(container) and not adding):
+        raise JsonPatchError(f'Array index {index} out of range')
+    return index
+
+def _get(doc, tokens: list[str]):
+    for token in tokens:
+        if not isinstance(doc, (dict, list)):
+            raise JsonPatchError('Path goes through a value that is not an object or array')
+        doc = doc[_key(doc, token)]
+    return doc
+
+def _update(doc, tokens: list[str], leaf):
+    """Copies only the containers on the path to the parent of `tokens[-1]`
+       and calls leaf(parent copy, last token) on it; everything else stays
+       shared with `doc`, which is never modified.
+    """
+    container = _copy(doc)
+    if len(tokens) == 1:
+        leaf(container, tokens[0])
+    else:
+        key = _key(container, tokens[0])
+        container[key] = _update(container[key], tokens[1:], leaf)
+    return container
+
+def _add(doc, tokens: list[str], value):
+    if not tokens:
+        return value
+
+    def leaf(container, token):
+        key = _key(container, token, adding=True)
+        if isinstance(container, list):
+            container.insert(key, value)
+        else:
+            container[key] = value
+    return _update(doc, tokens, leaf)
+
+def _remove(doc, tokens: list[str]):
+    if not tokens:
+        raise JsonPatchError('Cannot remove the whole document')
+
+    def leaf(container, token):
+        del container[_key(container, token)]
+    return _update(doc, tokens, leaf)
+
+def _replace(doc, tokens: list[str], value):
+    if not tokens:
+        return value
+
+    def leaf(container, token):
+        container[_key(container, token)] = value
+    return _update(doc, tokens, leaf)
+
+def apply_operation(doc, operation: dict):
+    if not isinstance(operation, dict) or 'op' not in operation or 'path' not in operation:
+        raise JsonPatchError('Each operation needs "op" and "path"')
+    path = parse_pointer(operation['path'])
+    if operation['op'] in ('add', 'replace', 'test') and 'value' not in operation:
+        raise JsonPatchError(f'"{operation["op"]}" needs a "value"')
+    if operation['op'] in ('move', 'copy'):
+        if 'from' not in operation:
+            raise JsonPatchError(f'"{operation["op"]}" needs a "from"')
+        source = parse_pointer(operation['from'])
+    match operation['op']:
+        case 'add':
+            return _add(doc, path, operation['value'])
+        case 'remove':
+            return _remove(doc, path)
+        case 'replace':
+            return _replace(doc, path, operation['value'])
+        case 'move':
+            if path[:len(source)] == source and len(path) > len(source):
+                raise JsonPatchError('Cannot move a value into itself')
+            value = _get(doc, source)
+            return _add(_remove(doc, source), path, value)
+        case 'copy':
+            return _add(doc, path, _get(doc, source))
+        case 'test':
+            if _get(doc, path) != operation['value']:
+                raise JsonPatchError(f'Test failed at "{operation["path"]}"')
+            return doc
+        case _ as op:
+            raise JsonPatchError(f'Unknown operation "{op}"')
+
+def apply_patch(doc, operations: list[dict]):
+    """apply_patch(doc, operations) -> patched copy of doc (RFC 6902)
+
+       `doc` is not modified; the result shares every part of `doc` the
+       patch does not touch, so applying a patch costs time proportional to
+       the edited paths rather than to the document. Raises `JsonPatchError`
+       if any operation fails, in which case nothing is applied.
+    """
+    if not isinstance(operations, list):
+        raise JsonPatchError('A JSON Patch must be an array of operations')
+    for operation in operations:
+        doc = apply_operation(doc, operation)
+    return doc
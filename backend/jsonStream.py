@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+import json
+
+# Encoded elements are sent in chunks of about this many bytes.
+STREAM_CHUNK = 16 * 1024
+
+def iter_json_array(items, dumps=json.dumps, chunk_size=STREAM_CHUNK):
+    """iter_json_array(items, dumps) -> chunks of the JSON array of items
+
+       Each item is encoded with `dumps` as soon as the iterable produces it,
+       so only the current chunk is held in memory. The bytes are the same as
+       `dumps(list(items))` with compact separators, followed by a newline
+       like a `jsonify` response.
+    """
+    buffer = [b'[']
+    size = 1
+    first = True
+    for item in items:
+        data = dumps(item).encode('utf-8')
+        if not first:
+            buffer.append(b',')
+            size += 1
+        first = False
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    buffer.append(b']\n')
+    yield b''.join(buffer)
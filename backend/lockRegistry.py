@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# A lock is released automatically if its owner does not save or re-open the
+# model for this many seconds (the same limit GET /model used to enforce by
+# rewriting the model file).
+LOCK_LEASE_SECONDS = 4500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS locks (
+    model_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    username TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    tab_id TEXT NOT NULL,
+    acquired REAL NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS locks_session ON locks (username, session_id);
+"""
+
+def open_sqlite(database: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(database, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def split_owner(owner: str) -> tuple[str, str, str]:
+    """split_owner('<username>/<sessionID>/<tabID>') -> (username, sessionID, tabID)"""
+    username, _, rest = owner.partition('/')
+    session_id, _, tab_id = rest.partition('/')
+    return username, session_id, tab_id
+
+class LockRegistry:
+    """LockRegistry(database) -> who has which model open for writing
+
+       Lock owners are the '<username>/<sessionID>/<tabID>' strings the
+       frontend sees as `readOnly`. Each lock is a lease that `lock`
+       refreshes; expired leases read as unlocked. Locking and unlocking
+       are single-row writes and never touch the model itself.
+    """
+
+    def __init__(self, database: str, lease=LOCK_LEASE_SECONDS):
+        self.database = database
+        self.lease = lease
+        self.local = threading.local()
+        self.connection().executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = open_sqlite(self.database)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def owner(self, id: str) -> str:
+        row = self.connection().execute(
+            'SELECT owner FROM locks WHERE model_id = ? AND expires > ?', (id, time.time())).fetchone()
+        return row[0] if row else ""
+
+    def owners(self) -> dict[str, str]:
+        rows = self.connection().execute('SELECT model_id, owner FROM locks WHERE expires > ?', (time.time(),))
+        return dict(rows)
+
+    def lock(self, id: str, owner: str) -> None:
+        """Give `owner` the lock on `id` (whoever held it) and start a new lease."""
+        with self.transaction() as conn:
+            self._lock(conn, id, owner, time.time())
+
+    def try_lock(self, id: str, owner: str) -> tuple[str, bool]:
+        """try_lock(id, owner) -> (current owner, whether this call acquired it)
+
+           An owner re-opening its model starts a new lease.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute('SELECT owner FROM locks WHERE model_id = ? AND expires > ?', (id, now)).fetchone()
+            if row is not None:
+                if row[0] == owner:
+                    conn.execute('UPDATE locks SET expires = ? WHERE model_id = ?', (now + self.lease, id))
+                return row[0], False
+            self._lock(conn, id, owner, now)
+            return owner, True
+
+    def _lock(self, conn, id: str, owner: str, now: float) -> None:
+        conn.execute('INSERT OR REPLACE INTO locks (model_id, owner, username, session_id, tab_id, acquired, expires) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)', (id, owner, *split_owner(owner), now, now + self.lease))
+
+    def release(self, id: str) -> None:
+        self.connection().execute('DELETE FROM locks WHERE model_id = ?', (id,))
+
+    def release_session(self, username: str, session_id: str) -> list[str]:
+        """Release every lock held by any tab of the session; returns the model ids."""
+        with self.transaction() as conn:
+            rows = conn.execute('SELECT model_id FROM locks WHERE username = ? AND session_id = ? AND expires > ?',
+                                (username, session_id, time.time())).fetchall()
+            conn.execute('DELETE FROM locks WHERE username = ? AND session_id = ?', (username, session_id))
+        return [row[0] for row in rows]
+
+    def adopt(self, id: str, owner: str, lastModified: float) -> None:
+        """Carry over a lock still recorded in a model's `readOnly` field by older versions."""
+        if not owner or lastModified + self.lease <= time.time():
+            return
+        self.connection().execute(
+            'INSERT OR IGNORE INTO locks (model_id, owner, username, session_id, tab_id, acquired, expires) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)', (id, owner, *split_owner(owner), lastModified, lastModified + self.lease))
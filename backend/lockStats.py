@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+"""Contention of the backend's file locks: the catalog lock (`.catalog.lock`,
+taken around every model write of the JSON store) and `modelStore.locked_open`.
+
+No request takes `locked_open` any more, only tests and benchmarks, so
+requests contending for one model show up under the catalog lock, with
+that model as the subject. Every acquisition is recorded under its lock
+file and the model it was taken for, with the time spent waiting for it
+and holding it. When a lock is busy, the waiter notes who holds it: the
+catalog lock file names the pid and route of its holder, and each worker
+knows which of its own threads hold a lock. Each worker keeps the last
+two windows of `LOCK_STATS_SECONDS`, logs the most contended locks of
+each window and shares a snapshot with the other workers through
+`LOCK_STATS_DIR`, from which `report` builds the view of the whole server.
+"""
+
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager, suppress
+from atomicWrite import atomic_write
+import serverMetrics
+from serverMetrics import LOCK_WAIT_SECONDS
+
+LOCK_STATS_SECONDS = int(os.environ.get('LOCK_STATS_SECONDS', 60))
+LOCK_STATS_TOP = int(os.environ.get('LOCK_STATS_TOP', 10))
+LOCK_STATS_DIR = os.environ.get('LOCK_STATS_DIR') or os.path.join(tempfile.gettempdir(), 'backend-lockstats')
+# how often a worker shares its snapshot
+SNAPSHOT_SECONDS = 5
+# locks tracked per window; past it, locks that were never contended are dropped first
+MAX_TRACKED = 1000
+
+def request_route() -> str:
+    stats = serverMetrics.current.get()
+    return f'{stats.method} {stats.route}' if stats is not None else ''
+
+class Acquisition:
+    """One lock being taken by this thread, from the first attempt until its release.
+
+       With `announce`, the holder writes its pid and route into the lock
+       file, so that waiters in other workers can tell who holds it; only
+       for files that exist just to be locked.
+    """
+
+    def __init__(self, stats: 'LockStats', kind: str, path: str, fd: int, subject: str, announce: bool):
+        self.stats = stats
+        self.kind = kind
+        self.path = path
+        self.fd = fd
+        self.subject = subject
+        self.announce = announce
+        self.route = request_route()
+        self.start = time.perf_counter()
+        self.holder = None
+        self.wait = 0.0
+        self.acquired_at = None
+
+    def blocked(self) -> None:
+        """Notes who holds the lock, on the first attempt that found it busy."""
+        if self.holder is None:
+            self.holder = self.stats.holder_of(self.path, self.fd if self.announce else None)
+
+    @contextmanager
+    def deadline(self):
+        """Around the wait for the next attempt: records an acquisition that timed out."""
+        try:
+            yield
+        except Exception:
+            self.wait = time.perf_counter() - self.start
+            self.stats.record(self, None)
+            raise
+
+    def acquired(self) -> None:
+        self.acquired_at = time.perf_counter()
+        self.wait = self.acquired_at - self.start
+        LOCK_WAIT_SECONDS.labels(self.kind).observe(self.wait)
+        self.stats.holding(self)
+
+    def released(self) -> None:
+        """To call before unlocking, so no waiter reads a holder that already left."""
+        self.stats.record(self, time.perf_counter() - self.acquired_at)
+
+class LockStats:
+    """LockStats(window, top, directory) -> lock contention of this worker"""
+
+    def __init__(self, window=LOCK_STATS_SECONDS, top=LOCK_STATS_TOP, directory=LOCK_STATS_DIR):
+        self.window = window
+        self.top = top
+        self.directory = directory
+        self.mutex = threading.Lock()
+        self.current = {}
+        self.previous = {}
+        self.rotated = time.monotonic()
+        self.held = {} # lock file -> (pid, route) of a lock this worker's threads hold
+        self.pid = None
+
+    def acquisition(self, kind: str, path: str, fd: int, subject='', announce=False) -> Acquisition:
+        """acquisition(kind, lock file, fd, model) -> the record of a lock about to be taken"""
+        self.start()
+        return Acquisition(self, kind, path, fd, subject, announce)
+
+    def holder_of(self, path: str, fd: int | None) -> dict:
+        with self.mutex:
+            held = self.held.get(path)
+        if held is None and fd is not None:
+            with suppress(OSError, ValueError):
+                pid, _, route = os.pread(fd, 512, 0).decode('utf-8').partition(' ')
+                held = (int(pid), route)
+        if held is None:
+            return {'pid': None, 'route': ''}
+        return {'pid': held[0], 'route': held[1]}
+
+    def holding(self, acquisition: Acquisition) -> None:
+        with self.mutex:
+            self.held[acquisition.path] = (os.getpid(), acquisition.route)
+        if acquisition.announce:
+            with suppress(OSError):
+                os.ftruncate(acquisition.fd, 0)
+                os.pwrite(acquisition.fd, f'{os.getpid()} {acquisition.route}'.encode('utf-8'), 0)
+
+    def record(self, acquisition: Acquisition, hold: float | None) -> None:
+        """Records a released lock held for `hold` seconds, or one given up on (None)."""
+        key = f'{acquisition.path}\0{acquisition.subject}'
+        with self.mutex:
+            if hold is not None:
+                self.held.pop(acquisition.path, None)
+            self._rotate()
+            entry = self.current.get(key)
+            if entry is None:
+                if len(self.current) >= MAX_TRACKED:
+                    self._evict()
+                entry = self.current[key] = new_entry(acquisition.path, acquisition.subject)
+            entry['wait_seconds'] += acquisition.wait
+            entry['max_wait_seconds'] = max(entry['max_wait_seconds'], acquisition.wait)
+            if hold is None:
+                entry['timed_out'] += 1
+            else:
+                entry['acquired'] += 1
+                entry['hold_seconds'] += hold
+                entry['max_hold_seconds'] = max(entry['max_hold_seconds'], hold)
+                holders = entry['holding_routes']
+                holders[acquisition.route] = holders.get(acquisition.route, 0) + 1
+            if acquisition.holder is not None:
+                entry['contended'] += 1
+                waiting = entry['waiting_routes']
+                waiting[acquisition.route] = waiting.get(acquisition.route, 0) + 1
+                entry['last_holder'] = acquisition.holder
+
+    def _rotate(self) -> None:
+        now = time.monotonic()
+        if now - self.rotated < self.window:
+            return
+        self.previous = self.current if now - self.rotated < 2 * self.window else {}
+        self.current = {}
+        self.rotated = now
+
+    def _evict(self) -> None:
+        key = min(self.current, key=lambda key: (self.current[key]['contended'], self.current[key]['wait_seconds']))
+        del self.current[key]
+
+    def snapshot(self) -> dict:
+        """snapshot() -> this worker's locks of the last one to two windows"""
+        with self.mutex:
+            self._rotate()
+            entries = merged([self.previous.values(), self.current.values()])
+        return {'pid': os.getpid(), 'time': time.time(), 'window_seconds': self.window, 'locks': entries}
+
+    def start(self) -> None:
+        """Starts this worker's reporting thread, once per process."""
+        if self.pid == os.getpid():
+            return
+        with self.mutex:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.held = {}
+        threading.Thread(target=self._report_loop, name='lock-stats', daemon=True).start()
+
+    def _report_loop(self) -> None:
+        logged = time.monotonic()
+        while True:
+            time.sleep(SNAPSHOT_SECONDS)
+            snapshot = self.snapshot()
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                atomic_write(os.path.join(self.directory, f'{snapshot["pid"]}.json'),
+                             json.dumps(snapshot).encode('utf-8'), 'off')
+            except OSError as e:
+                logging.warning(f'Could not share lock statistics: {e}')
+            if time.monotonic() - logged >= self.window:
+                logged = time.monotonic()
+                self.log_summary(snapshot['locks'])
+
+    def log_summary(self, entries: list[dict]) -> None:
+        contended = top_contended(entries, self.top)
+        if not contended:
+            return
+        lines = [f'Most contended locks of worker {os.getpid()} over the last {self.window}-{2 * self.window}s:']
+        for entry in contended:
+            waiting = ', '.join(f'{route or "-"} x{count}' for route, count in entry['waiting_routes'].items())
+            holder = entry['last_holder']
+            lines.append(f'  {entry["file"]} [{entry["model"] or "-"}]: {entry["contended"]} of '
+                         f'{entry["acquired"] + entry["timed_out"]} waited, {entry["timed_out"]} timed out, '
+                         f'{entry["wait_seconds"]:.3f}s waiting (max {entry["max_wait_seconds"]:.3f}s), '
+                         f'held up to {entry["max_hold_seconds"]:.3f}s; waiting: {waiting}; '
+                         f'last holder: pid {holder["pid"]} {holder["route"] or "-"}')
+        logging.warning('\n'.join(lines))
+
+    def report(self, top: int | None = None) -> dict:
+        """report(top) -> the most contended locks of all the server's workers
+
+           Other workers' figures are from their last shared snapshot, at
+           most a few seconds old; snapshots of workers that exited are left
+           out.
+        """
+        own = self.snapshot()
+        snapshots = [own]
+        with suppress(FileNotFoundError):
+            for name in os.listdir(self.directory):
+                pid = name.removesuffix('.json')
+                if not pid.isdigit() or int(pid) == own['pid'] or not alive(int(pid)):
+                    continue
+                with suppress(OSError, ValueError):
+                    with open(os.path.join(self.directory, name), 'r') as fp:
+                        snapshots.append(json.load(fp))
+        entries = merged(snapshot['locks'] for snapshot in snapshots)
+        return {'window_seconds': self.window, 'workers': sorted(snapshot['pid'] for snapshot in snapshots),
+                'locks': top_contended(entries, top or self.top)}
+
+def new_entry(path: str, subject: str) -> dict:
+    return {'file': path, 'model': subject, 'acquired': 0, 'contended': 0, 'timed_out': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+            'hold_seconds': 0.0, 'max_hold_seconds': 0.0, 'waiting_routes': {}, 'holding_routes': {}, 'last_holder': None}
+
+def merged(groups) -> list[dict]:
+    """merged(groups of entries) -> the entries summed per lock file and model"""
+    totals = {}
+    for entries in groups:
+        for entry in entries:
+            key = (entry['file'], entry['model'])
+            if key not in totals:
+                totals[key] = new_entry(*key)
+            total = totals[key]
+            for field in ('acquired', 'contended', 'timed_out', 'wait_seconds', 'hold_seconds'):
+                total[field] += entry[field]
+            for field in ('max_wait_seconds', 'max_hold_seconds'):
+                total[field] = max(total[field], entry[field])
+            for field in ('waiting_routes', 'holding_routes'):
+                for route, count in entry[field].items():
+                    total[field][route] = total[field].get(route, 0) + count
+            total['last_holder'] = entry['last_holder'] or total['last_holder']
+    return list(totals.values())
+
+def top_contended(entries: list[dict], top: int) -> list[dict]:
+    """top_contended(entries, top) -> the `top` entries that were waited for longest"""
+    contended = [entry for entry in entries if entry['contended']]
+    return sorted(contended, key=lambda entry: (entry['wait_seconds'], entry['contended']), reverse=True)[:top]
+
+def alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# this worker's statistics, shared by every lock site
+stats = LockStats()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import os
+import threading
+from collections import OrderedDict
+from serverMetrics import CACHE_BYTES, CACHE_EVICTIONS, CACHE_LOOKUPS
+
+class CacheEntry:
+    """A parsed model plus anything derived from it, valid for one `stamp`.
+
+       `value` is shared between requests and must be treated as read-only;
+       callers that need to modify a model load their own copy.
+    """
+
+    def __init__(self, stamp, nbytes, value=None, error=None):
+        self.stamp = stamp
+        self.nbytes = nbytes
+        self.value = value
+        self.error = error
+        self.derived = {}
+
+class ModelCache:
+    """ModelCache(max_bytes, name) -> per-worker LRU cache of parsed models
+
+       Entries are keyed on the model id and revalidated against a stamp
+       (for files: `st_mtime_ns`, `st_size`, `st_ino`), so a lookup costs a
+       `stat` instead of a parse. The memory budget is measured in bytes of
+       serialized model, which is what the caller passes as `nbytes`.
+       Lookups, evictions and bytes held are exported as metrics labelled
+       with `name`.
+    """
+
+    def __init__(self, max_bytes: int, name='model'):
+        self.max_bytes = max_bytes
+        self.name = name
+        self.entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.hit_count = CACHE_LOOKUPS.labels(name, 'hit')
+        self.miss_count = CACHE_LOOKUPS.labels(name, 'miss')
+        self.eviction_count = CACHE_EVICTIONS.labels(name)
+        self.bytes_gauge = CACHE_BYTES.labels(name)
+
+    def lookup(self, key: str, stamp) -> CacheEntry | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.stamp != stamp:
+                self.misses += 1
+                self.miss_count.inc()
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.hit_count.inc()
+            return entry
+
+    def insert(self, key: str, entry: CacheEntry) -> CacheEntry:
+        with self.lock:
+            self._discard(key)
+            if entry.nbytes > self.max_bytes:
+                return entry
+            self.entries[key] = entry
+            self.nbytes += entry.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+                self.eviction_count.inc()
+            self.bytes_gauge.set(self.nbytes)
+            return entry
+
+    def invalidate(self, key: str) -> None:
+        with self.lock:
+            self._discard(key)
+            self.bytes_gauge.set(self.nbytes)
+
+    def _discard(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
+
+def file_stamp(filename: str) -> tuple[tuple[int, int, int], int]:
+    """file_stamp(filename) -> ((mtime_ns, size, inode), size)"""
+    st = os.stat(filename)
+    return (st.st_mtime_ns, st.st_size, st.st_ino), st.st_size
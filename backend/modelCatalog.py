@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+import os
+import fcntl
+import json
+import time
+import argparse
+from bisect import bisect_left, bisect_right
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+import anyio
+from modelCache import file_stamp
+from atomicWrite import atomic_write
+from serverMetrics import JSON_SECONDS, count_read, count_written, timed
+import lockStats
+
+CATALOG_VERSION = 3
+# lock file of the catalog whose lock the current context already holds (see `Catalog.locked_async`)
+held_lock = ContextVar('held_lock', default=None)
+# longest pause between two attempts at a busy lock
+LOCK_POLL_MAX_SECONDS = 0.01
+# how long a write waits for the catalog lock before failing with LockTimeout
+LOCK_TIMEOUT_SECONDS = float(os.environ.get('LOCK_TIMEOUT_SECONDS', 5))
+
+class LockTimeout(Exception):
+    """A lock stayed busy until the deadline of its acquisition."""
+
+def lock_pauses(path: str, timeout: float | None = None):
+    """lock_pauses(lock file, timeout=LOCK_TIMEOUT_SECONDS) -> the pauses to sleep
+       between attempts at a busy lock, growing from 1 ms; raises LockTimeout
+       once `timeout` seconds have passed (0: after the first attempt)
+    """
+    timeout = LOCK_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    pause = 0.001
+    while (remaining := deadline - time.monotonic()) > 0:
+        yield min(pause, remaining)
+        pause = min(pause * 2, LOCK_POLL_MAX_SECONDS)
+    raise LockTimeout(f'{os.path.basename(path)} stayed busy for {timeout:g}s')
+
+def ideal_functionality_summary(full_data: dict) -> dict:
+    data = full_data['model']
+    return {'model_id': data['id'], 'model_name': data['name'],
+            'idealFunctionality_id': data['idealFunctionality']['id'],
+            'idealFunctionality_name': data['idealFunctionality']['name'],
+            'adversarialInterface': data['idealFunctionality']['basicAdversarialInterface']}
+
+def comp_interfaces_summary(full_data: dict) -> list[dict]:
+    data = full_data['model']
+    return [{'model_id': data['id'], 'model_name': data['name'],
+             'compInterface_id': compInt['id'], 'compInterface_name': compInt['name']}
+            for compInt in data['interfaces']['compInters'] if compInt['type'] == 'direct']
+
+def summarize(id: str, full_data: dict) -> dict:
+    """summarize(id, full_data) -> catalog entry
+
+       Everything the list endpoints need from a model: the landing page
+       fields plus the ideal functionality and direct composite interface
+       summaries. Models missing those parts get `None` / `[]` instead of
+       failing the write that is cataloguing them. Lock state is not part of
+       the entry; it lives in the lock registry.
+    """
+    entry = {'id': id,
+             'name': full_data['model']['name'],
+             'lastModified': full_data['lastModified'],
+             'modelVersion': full_data.get('modelVersion', "")}
+    try:
+        entry['idealFunctionality'] = ideal_functionality_summary(full_data)
+    except (KeyError, TypeError):
+        entry['idealFunctionality'] = None
+    try:
+        entry['compInterfaces'] = comp_interfaces_summary(full_data)
+    except (KeyError, TypeError):
+        entry['compInterfaces'] = []
+    try:
+        entry['compInterIds'] = [compInter['id'] for compInter in full_data['model']['interfaces']['compInters']]
+    except (KeyError, TypeError):
+        entry['compInterIds'] = []
+    return entry
+
+def model_refs(entry: dict) -> list[tuple[str, str]]:
+    """model_refs(entry) -> [(kind, ref_id)] the reverse indexes file this model under"""
+    refs = []
+    if entry.get('idealFunctionality') is not None:
+        refs.append(('idealFunctionality', entry['idealFunctionality']['idealFunctionality_id']))
+    refs.extend(('compInter', compInterId) for compInterId in entry.get('compInterIds', []))
+    return refs
+
+def reverse_index(entries) -> dict[tuple[str, str], list[str]]:
+    """reverse_index(entries) -> {(kind, ref_id): [model ids]}"""
+    index = {}
+    for entry in entries:
+        for ref in model_refs(entry):
+            index.setdefault(ref, []).append(entry['id'])
+    return index
+
+def interface_index(full_data: dict) -> dict:
+    """interface_index(full_data) -> per-model lookups for the message endpoints
+
+       - `compInters`: compInter id -> [compInter]
+       - `basicInterMessages`: basicInter id -> [message id]
+       - `messageOwner`: message id -> the (last) basicInter listing it
+       - `messages`: message id -> [(position in the model, message)]
+    """
+    interfaces = full_data['model']['interfaces']
+    compInters = {}
+    for compInter in interfaces['compInters']:
+        compInters.setdefault(compInter['id'], []).append(compInter)
+    basicInterMessages = {}
+    messageOwner = {}
+    for basicInter in interfaces['basicInters']:
+        basicInterMessages.setdefault(basicInter['id'], []).extend(basicInter['messages'])
+        for messageId in basicInter['messages']:
+            messageOwner[messageId] = basicInter
+    messages = {}
+    for position, message in enumerate(interfaces['messages']):
+        messages.setdefault(message['id'], []).append((position, message))
+    return {'compInters': compInters, 'basicInterMessages': basicInterMessages,
+            'messageOwner': messageOwner, 'messages': messages}
+
+# the orders `listing` can return the catalog in
+SORT_KEYS = ('name', 'lastModified')
+# sorts after every name starting with the prefix it is appended to
+PREFIX_END = '\U0010ffff'
+
+def sort_key(entry: dict, sort: str) -> tuple:
+    """sort_key(entry, 'name' | 'lastModified') -> (value, id); corrupted models sort as lastModified 0"""
+    return entry['name'] if sort == 'name' else entry.get('lastModified', 0), entry['id']
+
+def sorted_order(entries, sort: str) -> tuple[list[tuple], list[str]]:
+    """sorted_order(entries, sort) -> (sort keys, ids), both in sort order"""
+    order = sorted((sort_key(entry, sort), entry['id']) for entry in entries)
+    return [key for key, _ in order], [id for _, id in order]
+
+def iter_listing(entries: dict, keys: list[tuple], ids: list[str], sort: str, descending=False,
+                 prefix='', after: tuple | None = None):
+    """Yields the entries in (keys, ids) order, starting after the sort key `after`,
+       that have a name starting with `prefix`. Finding the start is a bisection,
+       so a later page costs the same as the first.
+    """
+    if not descending:
+        start = bisect_right(keys, after) if after is not None else 0
+        if sort == 'name' and prefix:
+            start = max(start, bisect_left(keys, (prefix, '')))
+        positions = range(start, len(keys))
+    else:
+        stop = bisect_left(keys, after) if after is not None else len(keys)
+        if sort == 'name' and prefix:
+            stop = min(stop, bisect_left(keys, (prefix + PREFIX_END, '')))
+        positions = range(stop - 1, -1, -1)
+    for position in positions:
+        entry = entries[ids[position]]
+        if not entry['name'].startswith(prefix):
+            if sort == 'name':
+                break
+            continue
+        yield entry
+
+def corrupted_entry(id: str) -> dict:
+    return {'id': id, 'name': id, 'corrupted': True}
+
+class Catalog:
+    """Catalog(directory, scan) -> the `.catalog` index of a models directory
+
+       The catalog is a single JSON document mapping model id to its
+       `summarize` entry. Writers update it while holding `.catalog.lock`
+       and replace the file with `atomic_write`, so readers never lock and
+       never see a partial catalog. `scan` rebuilds the entries from the model
+       files and is used when the catalog is missing or unreadable.
+    """
+
+    def __init__(self, directory, scan, fsync=None):
+        self.path = os.path.join(directory, '.catalog')
+        self.lock_path = self.path + '.lock'
+        self.scan = scan
+        self.fsync = fsync
+        self.cached = None
+        self.reverse = None
+        self.orders = {}
+        self.stale = None
+
+    def read(self) -> dict[str, dict]:
+        entries = self._read()
+        if entries is None:
+            with self.updating() as entries:
+                pass
+        return entries
+
+    def stamp(self) -> tuple[int, int, int]:
+        """stamp() -> stat stamp of the catalog file, building it first if missing"""
+        try:
+            return file_stamp(self.path)[0]
+        except FileNotFoundError:
+            self.read()
+            return file_stamp(self.path)[0]
+
+    def models_referencing(self, kind: str, ref_id: str) -> list[str]:
+        entries = self.read()
+        if self.reverse is None or self.reverse[0] is not entries:
+            self.reverse = (entries, reverse_index(entries.values()))
+        return self.reverse[1].get((kind, ref_id), [])
+
+    def outdated(self, version: str) -> list[str]:
+        entries = self.read()
+        if self.stale is None or self.stale[:2] != (entries, version):
+            self.stale = (entries, version, [id for id, entry in entries.items()
+                                             if not entry.get('corrupted') and entry['modelVersion'] != version])
+        return self.stale[2]
+
+    def listing(self, sort='name', descending=False, prefix='', after=None):
+        entries = self.read()
+        if sort not in self.orders or self.orders[sort][0] is not entries:
+            self.orders[sort] = (entries, *sorted_order(entries.values(), sort))
+        _, keys, ids = self.orders[sort]
+        return iter_listing(entries, keys, ids, sort, descending, prefix, after)
+
+    def _read(self) -> dict[str, dict] | None:
+        try:
+            stamp, _ = file_stamp(self.path)
+            if self.cached is not None and self.cached[0] == stamp:
+                return self.cached[1]
+            with open(self.path, 'r') as fp:
+                count_read(os.fstat(fp.fileno()).st_size)
+                with timed(JSON_SECONDS.labels('load', 'catalog')):
+                    catalog = json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if catalog.get('version') != CATALOG_VERSION:
+            return None
+        self.cached = (stamp, catalog['models'])
+        return catalog['models']
+
+    @contextmanager
+    def locked(self, subject='', timeout=None):
+        """Holds `.catalog.lock`, which serializes the backend's model writes, without
+           touching the catalog itself. `subject` is the model written, for `lockStats`.
+           Raises LockTimeout if another writer holds it for `timeout` seconds
+           (default LOCK_TIMEOUT_SECONDS).
+        """
+        if held_lock.get() == self.lock_path:
+            yield # taken by `locked_async` around this call
+            return
+        with open(self.lock_path, 'a+') as lock_fp:
+            acquisition = lockStats.stats.acquisition('catalog', self.lock_path, lock_fp.fileno(), subject, announce=True)
+            pauses = lock_pauses(self.lock_path, timeout)
+            while True:
+                try:
+                    fcntl.flock(lock_fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    acquisition.blocked()
+                    with acquisition.deadline():
+                        time.sleep(next(pauses))
+            acquisition.acquired()
+            try:
+                yield
+            finally:
+                acquisition.released()
+                fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+    @asynccontextmanager
+    async def locked_async(self, subject='', timeout=None):
+        """`locked` for an event loop: waits for `.catalog.lock` with non-blocking
+           attempts and sleeps in between, so the loop keeps serving while
+           another writer holds it. Store writes run from this context (e.g. in
+           a thread started with `anyio.to_thread.run_sync`) use the held lock.
+        """
+        with open(self.lock_path, 'a+') as lock_fp:
+            acquisition = lockStats.stats.acquisition('catalog', self.lock_path, lock_fp.fileno(), subject, announce=True)
+            pauses = lock_pauses(self.lock_path, timeout)
+            while True:
+                try:
+                    fcntl.flock(lock_fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    acquisition.blocked()
+                    with acquisition.deadline():
+                        pause = next(pauses)
+                    await anyio.sleep(pause)
+            acquisition.acquired()
+            token = held_lock.set(self.lock_path)
+            try:
+                yield
+            finally:
+                held_lock.reset(token)
+                acquisition.released()
+                fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+    @contextmanager
+    def updating(self, subject='', timeout=None):
+        """Yields the entries for modification under the catalog lock, then saves them."""
+        with self.locked(subject, timeout):
+            entries = self._read()
+            entries = dict(entries) if entries is not None else self.scan()
+            yield entries
+            self._write(entries)
+
+    def rebuild(self) -> int:
+        with self.locked():
+            entries = self.scan()
+            self._write(entries)
+        return len(entries)
+
+    def _write(self, entries: dict[str, dict]) -> None:
+        catalog = {'version': CATALOG_VERSION, 'models': entries}
+        with timed(JSON_SECONDS.labels('dump', 'catalog')):
+            data = json.dumps(catalog, separators=(',', ':')).encode('utf-8')
+        count_written(len(data))
+        atomic_write(self.path, data, self.fsync)
+        self.cached = None
+
+# main
+if __name__ == "__main__":
+    from modelStore import JsonModelStore
+    parser = argparse.ArgumentParser(description='Rebuild the .catalog index of a models directory.')
+    parser.add_argument('--models', default='./models', help='directory of *.json models')
+    args = parser.parse_args()
+    count = JsonModelStore(args.models).catalog_index.rebuild()
+    print(f'{count} model(s) catalogued in {os.path.join(args.models, ".catalog")}')
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import deque
+from lockRegistry import open_sqlite
+
+EVENT_TYPES = ('lock-acquired', 'lock-released', 'model-updated', 'model-deleted')
+# rows older than the newest EVENTS_KEPT are pruned
+EVENTS_KEPT = 10000
+# events each worker keeps in memory for its streams
+EVENTS_BUFFERED = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+class EventLog:
+    """EventLog(database, poll_seconds) -> model events shared by every worker on the host
+
+       `publish` appends an event to a table of the (lock registry's) SQLite
+       database, so an event from any worker reaches all of them. One
+       thread per worker polls the table for new rows, keeps the latest
+       EVENTS_BUFFERED in memory and wakes the streams blocked in `wait`;
+       an open stream therefore costs an idle connection, not a query per
+       poll. Events are numbered by their row, which is the SSE event id
+       a reconnecting client resumes after.
+    """
+
+    def __init__(self, database: str, poll_seconds=0.25, kept=EVENTS_KEPT):
+        self.database = database
+        self.poll_seconds = poll_seconds
+        self.kept = kept
+        self.local = threading.local()
+        self.connection().executescript(SCHEMA)
+        self.cond = threading.Condition()
+        self.recent = deque(maxlen=EVENTS_BUFFERED)
+        self.latest = self.last()
+        self.pid = None
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = open_sqlite(self.database)
+        return conn
+
+    def publish(self, type: str, model_id: str, **data) -> int:
+        """publish(type, model_id, **data) -> id of the new event"""
+        if type not in EVENT_TYPES:
+            raise ValueError(f'Unknown event type "{type}"')
+        conn = self.connection()
+        seq = conn.execute('INSERT INTO events (type, model_id, data, created) VALUES (?, ?, ?, ?)',
+                           (type, model_id, json.dumps(data), time.time())).lastrowid
+        if seq % 100 == 0:
+            conn.execute('DELETE FROM events WHERE seq <= ?', (seq - self.kept,))
+        return seq
+
+    def last(self) -> int:
+        """last() -> id of the newest event, 0 if there is none"""
+        row = self.connection().execute('SELECT max(seq) FROM events').fetchone()
+        return row[0] or 0
+
+    def since(self, seq: int, limit=EVENTS_BUFFERED) -> list[dict]:
+        """since(seq) -> the events after `seq`, oldest first, as
+           {'id', 'event', 'model', ...data}
+        """
+        rows = self.connection().execute(
+            'SELECT seq, type, model_id, data FROM events WHERE seq > ? ORDER BY seq LIMIT ?', (seq, limit)).fetchall()
+        return [{'id': seq, 'event': type, 'model': model_id, **json.loads(data)} for seq, type, model_id, data in rows]
+
+    def start(self) -> None:
+        """Starts this worker's polling thread, once per process."""
+        with self.cond:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        threading.Thread(target=self._poll_loop, name='model-events', daemon=True).start()
+
+    def _poll_loop(self) -> None:
+        while True:
+            try:
+                self.poll()
+            except sqlite3.Error as e:
+                logging.warning(f'Could not read model events: {e}')
+            time.sleep(self.poll_seconds)
+
+    def poll(self) -> None:
+        """Moves the events published since the last poll into memory and wakes the waiting streams."""
+        events = self.since(self.latest)
+        if not events:
+            return
+        with self.cond:
+            self.recent.extend(events)
+            self.latest = events[-1]['id']
+            self.cond.notify_all()
+
+    def wait(self, seq: int, timeout: float) -> list[dict]:
+        """wait(seq, timeout) -> the events after `seq`, waiting up to `timeout`
+           seconds for one if there are none yet
+        """
+        self.start()
+        with self.cond:
+            self.cond.wait_for(lambda: self.latest > seq, timeout)
+        events = self.buffered(seq)
+        # further back than this worker keeps in memory
+        return events if events is not None else self.since(seq)
+
+    def buffered(self, seq: int) -> list[dict] | None:
+        """buffered(seq) -> the events after `seq` this worker has in memory, without
+           waiting; None if some of them are older than it keeps
+        """
+        with self.cond:
+            if self.latest <= seq:
+                return []
+            if not self.recent or self.recent[0]['id'] > seq + 1:
+                return None
+            events = []
+            for event in reversed(self.recent):
+                if event['id'] <= seq:
+                    break
+                events.append(event)
+            return events[::-1]
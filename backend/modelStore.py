@@ -0,0 +1,842 @@
+#!/usr/bin/env python
+
+import os
+import fcntl
+import hashlib
+import logging
+import sqlite3
+import threading
+import json
+import time
+import argparse
+from contextlib import contextmanager, suppress
+from reconciliationScript import CURRENT_VERSION, convert_model, sniff_version
+from atomicWrite import atomic_write, fsync_directory, fsync_mode
+from modelCache import CacheEntry, ModelCache, file_stamp
+from modelCatalog import Catalog, summarize, corrupted_entry, model_refs, reverse_index, sorted_order, iter_listing
+from modelCatalog import PREFIX_END, LOCK_TIMEOUT_SECONDS, LockTimeout, lock_pauses
+from lockRegistry import LockRegistry, open_sqlite
+from jsonPatch import JsonPatchError, apply_patch
+from serverMetrics import JSON_SECONDS, corrupted_hit, count_read, count_written, timed
+import lockStats
+
+# A model's patch log is folded back into the model after this many patches.
+PATCH_COMPACT_AFTER = 100
+
+class RevisionConflict(Exception):
+    """The model is no longer at the revision a patch was made against."""
+
+    def __init__(self, revision: int):
+        super().__init__(f'Model is at revision {revision}')
+        self.revision = revision
+
+def content_etag(*parts) -> str:
+    """content_etag(*parts) -> hex digest identifying `parts` (str, bytes or JSON values)"""
+    digest = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = part.encode('utf-8') if isinstance(part, str) else json.dumps(part, sort_keys=True).encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+def apply_record(full_data: dict, record: dict) -> dict:
+    """apply_record(full_data, {'revision', 'lastModified', 'patch'}) -> patched copy
+
+       The patch applies to the model itself (what GET /model/<id> returns),
+       not to the stored wrapper around it.
+    """
+    full_data = dict(full_data)
+    full_data['model'] = apply_patch(full_data['model'], record['patch'])
+    full_data['revision'] = record['revision']
+    full_data['lastModified'] = record['lastModified']
+    return full_data
+
+def patch_record(id: str, full_data: dict, revision: int, operations: list[dict]) -> tuple[dict, dict]:
+    """patch_record(id, full_data, revision, operations) -> (record, patched full_data)
+
+       Raises `RevisionConflict` unless `full_data` is at `revision`, and
+       `JsonPatchError` if the patch does not apply or renames the model.
+    """
+    current = full_data.get('revision', 0)
+    if revision != current:
+        raise RevisionConflict(current)
+    record = {'revision': current + 1, 'lastModified': time.time(), 'patch': operations}
+    patched = apply_record(full_data, record)
+    if not isinstance(patched['model'], dict) or patched['model'].get('name') != full_data['model']['name']:
+        raise JsonPatchError('A patch cannot rename the model; use PUT')
+    return record, patched
+
+def model_bytes(full_data: dict) -> bytes:
+    """model_bytes(full_data) -> the contents of a model file"""
+    with timed(JSON_SECONDS.labels('dump', 'model')):
+        data = json.dumps(full_data, indent=2).encode('utf-8')
+    count_written(len(data))
+    return data
+
+@contextmanager
+def locked_open(filename, mode, lock_type, timeout=None):
+    """locked_open(filename, mode='r') -> <open file object>
+
+       Context manager that on entry opens the path `filename`, using `mode`
+       (default: `r`), and applies an advisory write lock on the file which
+       is released when leaving the context. Yields the open file object for
+       use within the context. Raises LockTimeout if the file stays locked
+       for `timeout` seconds (default LOCK_TIMEOUT_SECONDS).
+
+       No request path uses it since model locks moved to `LockRegistry`
+       and writes to `atomic_write`; it is kept for tests and benchmarks.
+    """
+    with open(filename, mode) as fd:
+        acquisition = lockStats.stats.acquisition('file', os.path.abspath(filename), fd.fileno(),
+                                                  os.path.splitext(os.path.basename(filename))[0])
+        try:
+            pauses = lock_pauses(filename, timeout)
+            while True:
+                try:
+                    fcntl.flock(fd, lock_type | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    acquisition.blocked()
+                    with acquisition.deadline():
+                        time.sleep(next(pauses))
+            acquisition.acquired()
+            logging.debug(f'acquired lock on {filename}')
+            yield fd
+        finally:
+            logging.debug(f'releasing lock on {filename}')
+            if acquisition.acquired_at is not None:
+                acquisition.released()
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+class ModelStore:
+    """Interface shared by the model storage backends.
+
+       Models are addressed by id (the model name) and stored as the
+       "full data" dict the backend has always written: `model`,
+       `modelVersion`, `readOnly` and `lastModified`. `load` raises
+       `FileNotFoundError` for unknown ids and `json.JSONDecodeError` for
+       corrupted models, so callers handle both backends the same way.
+       Writes are atomic: `load` sees a model either before or after a
+       concurrent `save`, never in between.
+
+       Who has a model open for writing is kept in `locks`, a
+       `LockRegistry`; the stored `readOnly` field is always "".
+
+       `revision` counts the saves of a model and guards `patch`; models
+       written before it existed are at revision 0.
+    """
+
+    locks: LockRegistry
+
+    def ids(self) -> list[str]:
+        raise NotImplementedError
+
+    def exists(self, id: str) -> bool:
+        raise NotImplementedError
+
+    def load(self, id: str) -> dict:
+        raise NotImplementedError
+
+    def load_cached(self, id: str) -> dict:
+        """load_cached(id) -> dict
+
+           Like `load`, but the result may be shared with other requests and
+           must not be modified.
+        """
+        return self.load(id)
+
+    def derived(self, id: str, name: str, fn):
+        """derived(id, name, fn) -> fn(full_data), memoized alongside the cached model"""
+        return fn(self.load_cached(id))
+
+    def etag(self, id: str) -> str:
+        """etag(id) -> changes whenever the stored model changes
+
+           Works from metadata only, never by parsing the model, so callers
+           can answer conditional requests cheaply. Take the etag before
+           loading: the model loaded afterwards is at least that new.
+        """
+        raise NotImplementedError
+
+    def catalog_etag(self) -> str:
+        """catalog_etag() -> changes whenever `catalog` may have changed"""
+        raise NotImplementedError
+
+    def save(self, id: str, full_data: dict) -> None:
+        raise NotImplementedError
+
+    def patch(self, id: str, revision: int, operations: list[dict]) -> dict:
+        """patch(id, revision, operations) -> the patched full data
+
+           Applies a JSON Patch to the model if it is still at `revision`,
+           storing only the patch; the store folds its patches back into the
+           model every `PATCH_COMPACT_AFTER` patches.
+        """
+        raise NotImplementedError
+
+    def remove(self, id: str) -> None:
+        raise NotImplementedError
+
+    def migrate(self, id: str, timeout=None) -> None:
+        """migrate(id) -> None; brings the model up to CURRENT_VERSION if it is older
+
+           Raises LockTimeout if another write keeps the store busy for
+           `timeout` seconds (default LOCK_TIMEOUT_SECONDS), like every write.
+        """
+        raise NotImplementedError
+
+    def outdated(self) -> list[str]:
+        """outdated() -> ids of the models the catalog lists as older than CURRENT_VERSION"""
+        return [entry['id'] for entry in self.catalog()
+                if not entry.get('corrupted') and entry['modelVersion'] != CURRENT_VERSION]
+
+    def catalog(self) -> list[dict]:
+        """catalog() -> [modelCatalog.summarize entries]
+
+           Corrupted models are listed with just `id`, `name` and
+           `corrupted` set.
+        """
+        res = []
+        for id in self.ids():
+            try:
+                res.append(self.derived(id, 'catalog', lambda full_data: summarize(id, full_data)))
+            except json.JSONDecodeError:
+                res.append(corrupted_entry(id))
+            except FileNotFoundError:
+                continue
+        return res
+
+    def entry(self, id: str) -> dict | None:
+        """entry(id) -> the catalog entry of one model, or None if it does not exist"""
+        for entry in self.catalog():
+            if entry['id'] == id:
+                return entry
+        return None
+
+    def models_referencing(self, kind: str, ref_id: str) -> list[str]:
+        """models_referencing(kind, ref_id) -> ids of the models containing it
+
+           `kind` is 'idealFunctionality' or 'compInter'.
+        """
+        return reverse_index(self.catalog()).get((kind, ref_id), [])
+
+    def listing(self, sort='name', descending=False, prefix='', after=None):
+        """listing(sort, descending, prefix, after) -> iterator of catalog entries
+
+           Entries come ordered by `modelCatalog.sort_key(entry, sort)`,
+           restricted to names starting with `prefix` and, for paging,
+           to the keys after (or, descending, before) `after`.
+        """
+        entries = {entry['id']: entry for entry in self.catalog()}
+        return iter_listing(entries, *sorted_order(entries.values(), sort), sort, descending, prefix, after)
+
+    def wait_exists(self, id: str, wait_time=0.25, wait_max=1) -> bool:
+        """wait_exists(id, wait_time=0.25, wait_max=1) -> bool
+
+           This functions waits for the specified max time (sleeping for the
+           specified wait time each iteration until either the time expires or
+           the model exists. If the model exists, this returns true.
+        """
+        wait_counter = 0
+        while not self.exists(id):
+            time.sleep(wait_time)
+            wait_counter += wait_time
+            if wait_counter > wait_max:
+                break
+
+        return self.exists(id)
+
+class JsonModelStore(ModelStore):
+    """One pretty-printed JSON file per model in `directory`.
+
+       Every write also updates the `.catalog` index in the same directory,
+       so `catalog` is a single read no matter how many models there are.
+       Model files are only ever replaced through `atomic_write`, so reading
+       one needs no lock; `fsync` is its durability mode.
+
+       Patches are appended to `<id>.patches` as one JSON record per line,
+       each tagged with the stamp of the model file it applies to, so a
+       later save or compaction makes the older records stale without
+       having to touch the log.
+    """
+
+    def __init__(self, directory='models', cache_bytes=64 * 1024 * 1024, fsync=None):
+        self.directory = directory
+        self.fsync = fsync if fsync is not None else fsync_mode()
+        self.cache = ModelCache(cache_bytes)
+        self.catalog_index = Catalog(directory, self.scan, self.fsync)
+        self.locks = LockRegistry(os.path.join(directory, '.locks.sqlite3'))
+        # id -> (inode, mtime_ns) of a model file migrate has already dealt with
+        self.migrated = {}
+
+    def path(self, id: str) -> str:
+        return os.path.join(self.directory, id) + '.json'
+
+    def log_path(self, id: str) -> str:
+        return os.path.join(self.directory, id) + '.patches'
+
+    def stamp(self, id: str) -> tuple[tuple, int]:
+        """stamp(id) -> ((model file stamp, patch log stamp or None), total size)"""
+        stamp, nbytes = file_stamp(self.path(id))
+        try:
+            log_stamp, log_bytes = file_stamp(self.log_path(id))
+        except FileNotFoundError:
+            return (stamp, None), nbytes
+        return (stamp, log_stamp), nbytes + log_bytes
+
+    def read_log(self, id: str) -> list[dict]:
+        try:
+            with open(self.log_path(id), 'r') as fp:
+                lines = fp.readlines()
+        except FileNotFoundError:
+            return []
+        count_read(sum(len(line) for line in lines))
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # an append cut short by a crash; nothing after it was acknowledged
+                break
+        return records
+
+    def ids(self) -> list[str]:
+        return [file.removesuffix('.json') for file in os.listdir(self.directory) if file.endswith('.json')]
+
+    def exists(self, id: str) -> bool:
+        return os.path.exists(self.path(id))
+
+    def load(self, id: str) -> dict:
+        fileName = self.path(id)
+        try:
+            with open(fileName, 'r') as fp:
+                st = os.fstat(fp.fileno())
+                count_read(st.st_size)
+                with timed(JSON_SECONDS.labels('load', 'model')):
+                    full_data = json.load(fp)
+        except json.JSONDecodeError:
+            logging.debug(f'File {fileName} is corrupted!')
+            raise
+        base = [st.st_mtime_ns, st.st_size, st.st_ino]
+        for record in self.read_log(id):
+            if record['base'] == base and record['revision'] == full_data.get('revision', 0) + 1:
+                full_data = apply_record(full_data, record)
+        return full_data
+
+    def cache_entry(self, id: str) -> CacheEntry:
+        stamp, nbytes = self.stamp(id)
+        entry = self.cache.lookup(id, stamp)
+        if entry is None:
+            try:
+                entry = CacheEntry(stamp, nbytes, value=self.load(id))
+            except json.JSONDecodeError as e:
+                entry = CacheEntry(stamp, nbytes, error=e)
+            entry = self.cache.insert(id, entry)
+        return entry
+
+    def load_cached(self, id: str) -> dict:
+        entry = self.cache_entry(id)
+        if entry.error is not None:
+            corrupted_hit()
+            raise entry.error
+        return entry.value
+
+    def derived(self, id: str, name: str, fn):
+        entry = self.cache_entry(id)
+        if entry.error is not None:
+            corrupted_hit()
+            raise entry.error
+        if name not in entry.derived:
+            entry.derived[name] = fn(entry.value)
+        return entry.derived[name]
+
+    def save(self, id: str, full_data: dict) -> None:
+        # The model is written outside the catalog lock so concurrent saves
+        # can share a group commit; the catalog then takes the summary of
+        # whichever save is current on disk.
+        stamp = atomic_write(self.path(id), model_bytes(full_data), self.fsync)
+        entry = summarize(id, full_data)
+        with self.catalog_index.updating(id) as entries:
+            self.cache.invalidate(id)
+            try:
+                current, _ = file_stamp(self.path(id))
+            except FileNotFoundError:
+                return
+            if current != stamp:
+                return
+            if any(record['base'] == list(stamp) for record in self.read_log(id)):
+                # patched between our write and taking the catalog lock
+                entry = summarize(id, self.load_cached(id))
+            else:
+                with suppress(FileNotFoundError):
+                    os.remove(self.log_path(id))
+            entries[id] = entry
+
+    def patch(self, id: str, revision: int, operations: list[dict]) -> dict:
+        with self.catalog_index.updating(id) as entries:
+            cached = self.cache_entry(id)
+            if cached.error is not None:
+                raise cached.error
+            if self.stamp(id)[0] != cached.stamp:
+                # replaced by a save while it was being read
+                raise RevisionConflict(self.load(id).get('revision', 0))
+            record, full_data = patch_record(id, cached.value, revision, operations)
+            base, log = cached.stamp
+            record['base'] = list(base)
+            records = [record for record in self.read_log(id) if record['base'] == list(base)]
+            with timed(JSON_SECONDS.labels('dump', 'patch')):
+                line = json.dumps(record, separators=(',', ':')) + '\n'
+            log_bytes = (log[1] if log is not None and records else 0) + len(line.encode('utf-8'))
+            if len(records) + 1 >= PATCH_COMPACT_AFTER or log_bytes > base[1]:
+                stamp = self._compact(id, full_data)
+                self.cache.insert(id, CacheEntry((stamp, None), stamp[1], value=full_data))
+            else:
+                # a log of stale records is started over
+                with open(self.log_path(id), 'a' if records else 'w') as fp:
+                    fp.write(line)
+                    count_written(len(line))
+                    fp.flush()
+                    if self.fsync != 'off':
+                        os.fsync(fp.fileno())
+                    st = os.fstat(fp.fileno())
+                if not records and self.fsync != 'off':
+                    fsync_directory(self.directory)
+                log = (st.st_mtime_ns, st.st_size, st.st_ino)
+                self.cache.insert(id, CacheEntry((base, log), base[1] + st.st_size, value=full_data))
+            entries[id] = summarize(id, full_data)
+        return full_data
+
+    def _compact(self, id: str, full_data: dict) -> tuple[int, int, int]:
+        """Writes the patched model in full and drops its patch log."""
+        stamp = atomic_write(self.path(id), model_bytes(full_data), self.fsync)
+        with suppress(FileNotFoundError):
+            os.remove(self.log_path(id))
+        return stamp
+
+    def remove(self, id: str) -> None:
+        with self.catalog_index.updating(id) as entries:
+            os.remove(self.path(id))
+            with suppress(FileNotFoundError):
+                os.remove(self.log_path(id))
+            self.cache.invalidate(id)
+            entries.pop(id, None)
+        self.locks.release(id)
+
+    def migrate(self, id: str, timeout=None) -> None:
+        # A file whose (inode, mtime) was seen before is current, or failed to
+        # convert and will again until it changes: skip it after one stat.
+        st = os.stat(self.path(id))
+        if self.migrated.get(id) == (st.st_ino, st.st_mtime_ns):
+            return
+        with self.catalog_index.updating(id, timeout) as entries:
+            if not os.path.exists(self.log_path(id)) and sniff_version(self.path(id)) == CURRENT_VERSION:
+                # current on disk; only the catalog entry was out of date
+                full_data = self.load_cached(id)
+            else:
+                full_data = self.load(id)
+                try:
+                    converted = convert_model(full_data)
+                except (KeyError, TypeError, AttributeError) as e:
+                    logging.warning(f'Model {id} could not be migrated: {e!r}')
+                    st = os.stat(self.path(id))
+                    self.migrated[id] = (st.st_ino, st.st_mtime_ns)
+                    return
+                if converted:
+                    full_data['revision'] = full_data.get('revision', 0) + 1
+                    self._compact(id, full_data)
+                    logging.info('%s updated', id)
+                self.cache.invalidate(id)
+            entries[id] = summarize(id, full_data)
+            st = os.stat(self.path(id))
+            self.migrated[id] = (st.st_ino, st.st_mtime_ns)
+
+    def scan(self) -> dict[str, dict]:
+        """scan() -> catalog entries built from the model files themselves"""
+        entries = {}
+        for id in sorted(self.ids()):
+            try:
+                full_data = self.load_cached(id)
+                entries[id] = summarize(id, full_data)
+                self.locks.adopt(id, full_data.get('readOnly', ""), full_data['lastModified'])
+            except json.JSONDecodeError:
+                entries[id] = corrupted_entry(id)
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def catalog(self) -> list[dict]:
+        return list(self.catalog_index.read().values())
+
+    def entry(self, id: str) -> dict | None:
+        return self.catalog_index.read().get(id)
+
+    def models_referencing(self, kind: str, ref_id: str) -> list[str]:
+        return self.catalog_index.models_referencing(kind, ref_id)
+
+    def listing(self, sort='name', descending=False, prefix='', after=None):
+        return self.catalog_index.listing(sort, descending, prefix, after)
+
+    def outdated(self) -> list[str]:
+        return self.catalog_index.outdated(CURRENT_VERSION)
+
+    def etag(self, id: str) -> str:
+        stamp, _ = self.stamp(id)
+        return content_etag(stamp)
+
+    def catalog_etag(self) -> str:
+        return content_etag(self.catalog_index.stamp())
+
+# Each step upgrades the database schema by one `PRAGMA user_version`.
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS models (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        readOnly TEXT NOT NULL DEFAULT '',
+        lastModified REAL NOT NULL DEFAULT 0,
+        modelVersion TEXT NOT NULL DEFAULT '',
+        corrupted INTEGER NOT NULL DEFAULT 0,
+        body BLOB NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS models_readOnly ON models (readOnly);
+    CREATE INDEX IF NOT EXISTS models_lastModified ON models (lastModified);
+    CREATE INDEX IF NOT EXISTS models_modelVersion ON models (modelVersion);
+    """,
+    # catalog entry (summarize) of the model
+    """
+    ALTER TABLE models ADD COLUMN summary TEXT;
+    """,
+    # reverse index from ideal functionality / compInter ids to models
+    """
+    CREATE TABLE IF NOT EXISTS model_refs (
+        kind TEXT NOT NULL,
+        ref_id TEXT NOT NULL,
+        model_id TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS model_refs_ref ON model_refs (kind, ref_id);
+    CREATE INDEX IF NOT EXISTS model_refs_model ON model_refs (model_id);
+    UPDATE models SET summary = NULL;
+    """,
+    # lock state moved to the locks table (see backfill); summaries no longer carry it
+    """
+    UPDATE models SET summary = NULL;
+    """,
+    # patches not yet folded into the body (see SqliteModelStore.patch)
+    """
+    CREATE TABLE IF NOT EXISTS model_patches (
+        model_id TEXT NOT NULL,
+        revision INTEGER NOT NULL,
+        lastModified REAL NOT NULL,
+        patch TEXT NOT NULL,
+        PRIMARY KEY (model_id, revision)
+    );
+    """,
+    # content hash of the body and its patches (see backfill)
+    """
+    ALTER TABLE models ADD COLUMN etag TEXT;
+    """,
+    # keyset pagination in both listing orders
+    """
+    CREATE INDEX IF NOT EXISTS models_name_id ON models (name, id);
+    CREATE INDEX IF NOT EXISTS models_lastModified_id ON models (lastModified, id);
+    """,
+]
+
+class SqliteModelStore(ModelStore):
+    """One row per model in a SQLite database running in WAL mode.
+
+       `lastModified` and `modelVersion` are kept in indexed columns so
+       listing models never has to parse a model body; the lock registry
+       is a `locks` table in the same database. Each thread gets its own
+       connection; WAL lets the gunicorn workers read while another worker
+       writes. Patches are rows in `model_patches` until every
+       `PATCH_COMPACT_AFTER`th one rewrites the body.
+    """
+
+    def __init__(self, database='models/models.sqlite3'):
+        self.database = database
+        self.local = threading.local()
+        conn = self.connection()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for step in range(version, len(SCHEMA)):
+            conn.executescript(f'BEGIN; {SCHEMA[step]} PRAGMA user_version = {step + 1}; COMMIT;')
+        self.locks = LockRegistry(database)
+        # id -> etag of a model that failed to convert, not retried until it changes
+        self.migrated = {}
+        self.backfill()
+
+    @contextmanager
+    def transaction(self, timeout=None):
+        """A write transaction; raises LockTimeout if another writer keeps the
+           database for `timeout` seconds (default LOCK_TIMEOUT_SECONDS).
+        """
+        conn = self.connection()
+        # the longest busy timeout SQLite takes stands in for an infinite one
+        milliseconds = min(1000 * (LOCK_TIMEOUT_SECONDS if timeout is None else timeout), 2**31 - 1)
+        conn.execute(f'PRAGMA busy_timeout = {int(milliseconds)}')
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            raise LockTimeout(f'{os.path.basename(self.database)} stayed busy') from e
+        finally:
+            if timeout is not None:
+                # the connection's reads keep the default
+                conn.execute(f'PRAGMA busy_timeout = {int(1000 * LOCK_TIMEOUT_SECONDS)}')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def backfill(self) -> None:
+        """Fill in the summary, reverse index and etag of rows written by older
+           schemas, and move lock owners out of the readOnly column into the
+           lock registry.
+        """
+        rows = self.connection().execute(
+            "SELECT id, readOnly, lastModified FROM models WHERE readOnly != '' AND corrupted = 0").fetchall()
+        for id, readOnly, lastModified in rows:
+            self.locks.adopt(id, readOnly, lastModified)
+        self.connection().execute("UPDATE models SET readOnly = '' WHERE readOnly != ''")
+        rows = self.connection().execute(
+            'SELECT id FROM models WHERE summary IS NULL AND corrupted = 0').fetchall()
+        for (id,) in rows:
+            try:
+                full_data = self.load(id)
+            except json.JSONDecodeError:
+                continue
+            with self.transaction() as conn:
+                self._index(conn, id, summarize(id, full_data))
+        rows = self.connection().execute('SELECT id, body FROM models WHERE etag IS NULL').fetchall()
+        with self.transaction() as conn:
+            conn.executemany('UPDATE models SET etag = ? WHERE id = ? AND etag IS NULL',
+                             [(content_etag(body), id) for id, body in rows])
+
+    def _index(self, conn, id: str, entry: dict) -> None:
+        conn.execute('UPDATE models SET summary = ? WHERE id = ?', (json.dumps(entry), id))
+        conn.execute('DELETE FROM model_refs WHERE model_id = ?', (id,))
+        conn.executemany('INSERT INTO model_refs (kind, ref_id, model_id) VALUES (?, ?, ?)',
+                         [(kind, ref_id, id) for kind, ref_id in model_refs(entry)])
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = open_sqlite(self.database)
+        return conn
+
+    def ids(self) -> list[str]:
+        return [row[0] for row in self.connection().execute('SELECT id FROM models ORDER BY id')]
+
+    def exists(self, id: str) -> bool:
+        row = self.connection().execute('SELECT 1 FROM models WHERE id = ?', (id,)).fetchone()
+        return row is not None
+
+    def load(self, id: str) -> dict:
+        conn = self.connection()
+        # one read transaction, so the body and its patches match
+        conn.execute('BEGIN')
+        try:
+            return self._load(conn, id)
+        finally:
+            conn.execute('COMMIT')
+
+    def _load(self, conn, id: str) -> dict:
+        row = conn.execute('SELECT body FROM models WHERE id = ?', (id,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(id)
+        count_read(len(row[0]))
+        try:
+            with timed(JSON_SECONDS.labels('load', 'model')):
+                full_data = json.loads(row[0])
+        except json.JSONDecodeError:
+            logging.debug(f'Model {id} is corrupted!')
+            corrupted_hit()
+            raise
+        rows = conn.execute(
+            'SELECT revision, lastModified, patch FROM model_patches WHERE model_id = ? AND revision > ? '
+            'ORDER BY revision', (id, full_data.get('revision', 0))).fetchall()
+        for revision, lastModified, patch in rows:
+            if revision != full_data.get('revision', 0) + 1:
+                break
+            full_data = apply_record(full_data, {'revision': revision, 'lastModified': lastModified,
+                                                 'patch': json.loads(patch)})
+        return full_data
+
+    def save(self, id: str, full_data: dict) -> None:
+        with self.transaction() as conn:
+            self._save(conn, id, full_data)
+
+    def _save(self, conn, id: str, full_data: dict) -> None:
+        with timed(JSON_SECONDS.labels('dump', 'model')):
+            body = json.dumps(full_data).encode('utf-8')
+        count_written(len(body))
+        conn.execute(
+            'INSERT OR REPLACE INTO models (id, name, readOnly, lastModified, modelVersion, corrupted, body, etag) '
+            'VALUES (?, ?, ?, ?, ?, 0, ?, ?)',
+            (id, full_data['model']['name'], full_data.get('readOnly', ""), full_data['lastModified'],
+             full_data.get('modelVersion', ""), body, content_etag(body)))
+        conn.execute('DELETE FROM model_patches WHERE model_id = ?', (id,))
+        self._index(conn, id, summarize(id, full_data))
+
+    def patch(self, id: str, revision: int, operations: list[dict]) -> dict:
+        with self.transaction() as conn:
+            record, full_data = patch_record(id, self._load(conn, id), revision, operations)
+            count = conn.execute('SELECT COUNT(*) FROM model_patches WHERE model_id = ?', (id,)).fetchone()[0]
+            if count + 1 >= PATCH_COMPACT_AFTER:
+                self._save(conn, id, full_data)
+                return full_data
+            conn.execute('INSERT INTO model_patches (model_id, revision, lastModified, patch) VALUES (?, ?, ?, ?)',
+                         (id, record['revision'], record['lastModified'], json.dumps(record['patch'])))
+            # chained, so the etag still follows the content without re-serializing it
+            conn.execute('UPDATE models SET lastModified = ?, etag = ? WHERE id = ?',
+                         (record['lastModified'], content_etag(self._etag(conn, id), record), id))
+            self._index(conn, id, summarize(id, full_data))
+        return full_data
+
+    def save_raw(self, id: str, body: bytes) -> None:
+        """Store a body that does not parse, so it keeps reporting as corrupted."""
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO models (id, name, corrupted, body, etag) VALUES (?, ?, 1, ?, ?)',
+                (id, id, body, content_etag(body)))
+            conn.execute('DELETE FROM model_patches WHERE model_id = ?', (id,))
+            conn.execute('DELETE FROM model_refs WHERE model_id = ?', (id,))
+
+    def remove(self, id: str) -> None:
+        with self.transaction() as conn:
+            cur = conn.execute('DELETE FROM models WHERE id = ?', (id,))
+            if cur.rowcount == 0:
+                raise FileNotFoundError(id)
+            conn.execute('DELETE FROM model_patches WHERE model_id = ?', (id,))
+            conn.execute('DELETE FROM model_refs WHERE model_id = ?', (id,))
+        self.locks.release(id)
+
+    def migrate(self, id: str, timeout=None) -> None:
+        row = self.connection().execute(
+            'SELECT modelVersion, corrupted, etag FROM models WHERE id = ?', (id,)).fetchone()
+        if row is None or row[0] == CURRENT_VERSION or row[1] or self.migrated.get(id) == row[2]:
+            return
+        with self.transaction(timeout) as conn:
+            # checked again in the transaction: a save or patch may have landed since
+            row = conn.execute('SELECT modelVersion, corrupted, etag FROM models WHERE id = ?', (id,)).fetchone()
+            if row is None or row[0] == CURRENT_VERSION or row[1] or self.migrated.get(id) == row[2]:
+                return
+            full_data = self._load(conn, id)
+            try:
+                converted = convert_model(full_data)
+            except (KeyError, TypeError, AttributeError) as e:
+                logging.warning(f'Model {id} could not be migrated: {e!r}')
+                self.migrated[id] = row[2]
+                return
+            if not converted:
+                return
+            full_data['revision'] = full_data.get('revision', 0) + 1
+            self._save(conn, id, full_data)
+        logging.info('%s updated', id)
+
+    def outdated(self) -> list[str]:
+        rows = self.connection().execute(
+            'SELECT id FROM models WHERE modelVersion != ? AND corrupted = 0', (CURRENT_VERSION,)).fetchall()
+        return [id for id, in rows]
+
+    def catalog(self) -> list[dict]:
+        res = []
+        rows = self.connection().execute(
+            'SELECT id, corrupted, summary FROM models ORDER BY id').fetchall()
+        for id, corrupted, summary in rows:
+            if corrupted or summary is None:
+                res.append(corrupted_entry(id))
+                continue
+            res.append(json.loads(summary))
+        return res
+
+    def entry(self, id: str) -> dict | None:
+        row = self.connection().execute('SELECT corrupted, summary FROM models WHERE id = ?', (id,)).fetchone()
+        if row is None:
+            return None
+        if row[0] or row[1] is None:
+            return corrupted_entry(id)
+        return json.loads(row[1])
+
+    def models_referencing(self, kind: str, ref_id: str) -> list[str]:
+        rows = self.connection().execute(
+            'SELECT model_id FROM model_refs WHERE kind = ? AND ref_id = ? ORDER BY model_id', (kind, ref_id))
+        return [row[0] for row in rows]
+
+    def listing(self, sort='name', descending=False, prefix='', after=None):
+        column = {'name': 'name', 'lastModified': 'lastModified'}[sort]
+        op, order = ('<', 'DESC') if descending else ('>', 'ASC')
+        where, params = [], []
+        if prefix:
+            where.append('name >= ? AND name < ?')
+            params += [prefix, prefix + PREFIX_END]
+        if after is not None:
+            where.append(f'({column}, id) {op} (?, ?)')
+            params += list(after)
+        cursor = self.connection().execute(
+            f'SELECT id, corrupted, summary FROM models {"WHERE " + " AND ".join(where) if where else ""} '
+            f'ORDER BY {column} {order}, id {order}', params)
+        try:
+            for id, corrupted, summary in cursor:
+                yield corrupted_entry(id) if corrupted or summary is None else json.loads(summary)
+        finally:
+            cursor.close()
+
+    def _etag(self, conn, id: str) -> str:
+        row = conn.execute('SELECT etag FROM models WHERE id = ?', (id,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(id)
+        return row[0]
+
+    def etag(self, id: str) -> str:
+        return self._etag(self.connection(), id)
+
+    def catalog_etag(self) -> str:
+        rows = self.connection().execute('SELECT id, etag FROM models ORDER BY id').fetchall()
+        return content_etag(rows)
+
+def import_directory(directory: str, store: SqliteModelStore) -> int:
+    """Copy every `*.json` model in `directory` into `store`; returns the count.
+
+       Corrupted files are imported as-is so they keep reporting as corrupted.
+    """
+    count = 0
+    for file in sorted(os.listdir(directory)):
+        if not file.endswith('.json'):
+            continue
+        id = file.removesuffix('.json')
+        with open(os.path.join(directory, file), 'rb') as fp:
+            body = fp.read()
+        try:
+            full_data = json.loads(body)
+        except json.JSONDecodeError:
+            store.save_raw(id, body)
+        else:
+            store.locks.adopt(id, full_data.get('readOnly', ""), full_data['lastModified'])
+            full_data['readOnly'] = ""
+            store.save(id, full_data)
+        count += 1
+    return count
+
+def get_store() -> ModelStore:
+    """Select the storage backend from the MODEL_STORE environment variable."""
+    match os.environ.get('MODEL_STORE', 'json'):
+        case 'sqlite':
+            return SqliteModelStore(os.environ.get('MODEL_DATABASE', os.path.join('models', 'models.sqlite3')))
+        case 'json':
+            return JsonModelStore('models', int(os.environ.get('MODEL_CACHE_BYTES', 64 * 1024 * 1024)))
+        case _ as name:
+            raise ValueError(f'Unknown MODEL_STORE "{name}"')
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Import a models directory into a SQLite model store.')
+    parser.add_argument('--models', default='./models', help='directory of *.json models to import')
+    parser.add_argument('--database', default='./models/models.sqlite3', help='SQLite database to create or update')
+    args = parser.parse_args()
+    count = import_directory(args.models, SqliteModelStore(args.database))
+    print(f'{count} model(s) imported into {args.database}')
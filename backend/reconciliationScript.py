@@ -1,176 +1,335 @@
 #!/usr/bin/env python
 
-# import os
+import os
+import re
 import json
+import math
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import suppress
 from pathlib import Path
+from atomicWrite import atomic_write
 
-def convert_files(filenames: list[Path]):
+# the version convert_model brings models to
+CURRENT_VERSION = '1.3'
+# how much of each end of a model file sniff_version looks at
+SNIFF_BYTES = 4096
+# a top-level key of a model written with json.dumps(indent=2)
+TOP_LEVEL_VERSION = re.compile(rb'^  "modelVersion": "([^"\\\n]*)",?\r?$', re.MULTILINE)
+
+def sniff_version(filename) -> str | None:
+    """sniff_version(filename) -> the top-level modelVersion, or None if it is not
+       where the backend writes it (near either end of the file)
+
+       Reads at most 2 * SNIFF_BYTES, so an up-to-date model can be skipped
+       without parsing it.
+    """
+    with open(filename, 'rb') as fp:
+        head = fp.read(SNIFF_BYTES)
+        size = os.fstat(fp.fileno()).st_size
+        if size > SNIFF_BYTES:
+            fp.seek(max(size - SNIFF_BYTES, SNIFF_BYTES))
+            tail = fp.read()
+            # drop the partial first line so a nested key cannot pass for a top-level one
+            head, tail = head.rsplit(b'\n', 1)[0], tail.split(b'\n', 1)[-1]
+        else:
+            tail = b''
+    matches = TOP_LEVEL_VERSION.findall(tail) or TOP_LEVEL_VERSION.findall(head)
+    return matches[-1].decode('utf-8') if matches else None
+
+def convert_files(filenames: list[Path], fsync=None):
     for fileName in filenames:
+        if sniff_version(fileName) == CURRENT_VERSION:
+            continue
         with open(fileName, 'r') as fp:
             full_data = json.load(fp)
-        if 'modelVersion' in full_data and full_data['modelVersion'] == '1.3':
+        if not convert_model(full_data):
             # skip this model
             continue
-        if 'modelVersion' in full_data and full_data['modelVersion'] == '1.2':
-            # add blank comments to json
-            add_comment_to_messages(full_data)
-            add_comment_to_basic_interfaces(full_data)
-            add_comment_to_comp_interfaces(full_data)
-            add_comment_to_parties(full_data)
-            add_comment_to_states(full_data)
-            # Change model version
-            full_data['modelVersion'] = '1.3'
-            full_data['model']['modelVersion'] = '1.3'
-
-            with open(fileName, 'w') as fp:
-                json.dump(full_data, fp, indent=2)
-
-                print(fileName.stem + " updated")
-            # then skip
+
+        atomic_write(str(fileName), json.dumps(full_data, indent=2).encode('utf-8'), fsync)
+
+        print(fileName.stem + " updated")
+
+def convert_model(full_data: dict) -> bool:
+    """convert_model(full_data) -> bool
+
+       Brings the model dict up to CURRENT_VERSION in place by running the
+       MIGRATIONS steps from its version onwards. Returns False if the model
+       was already current and nothing was changed.
+    """
+    version = full_data.get('modelVersion')
+    if version == CURRENT_VERSION:
+        return False
+    if version not in MIGRATIONS:
+        # models from before versioning
+        version = '1.0'
+    while version != CURRENT_VERSION:
+        version, step = MIGRATIONS[version]
+        step(full_data)
+        full_data['modelVersion'] = version
+        full_data['model']['modelVersion'] = version
+    return True
+
+# migration steps
+def add_parameter_interface_layout(full_data: dict) -> None:
+    for paramInter in full_data['model']['realFunctionality']['parameterInterfaces']:
+        paramInter['left'] = ''
+        paramInter['top'] = ''
+        paramInter['color'] = '#de8989'
+
+def add_transition_layout(full_data: dict) -> None:
+    """Names transitions, gives them edge handles and moves the states into
+       the new canvas origin.
+
+       A state machine whose transitions all connect the same two states
+       fans them out over the handles, 13/1, 13-n/1+n, 13-2n/1+2n and so on
+       for n transitions, keeping handles they already have; in any other
+       state machine every transition is reset to handles 13/1. Transitions
+       are found through an id index, so this is linear in the model.
+    """
+    stateMachines = full_data['model']['stateMachines']
+    transitionsById = {}
+    for transition in stateMachines['transitions']:
+        if 'name' not in transition:
+            transition['name'] = ''
+        transitionsById.setdefault(transition['id'], []).append(transition)
+
+    for stateMachine in stateMachines['stateMachines']:
+        stateMachineTransitions = [transition for transitionId in stateMachine['transitions']
+                                   for transition in transitionsById.get(transitionId, [])]
+        edges = {(transition['fromState'], transition['toState']) for transition in stateMachineTransitions}
+        if len(edges) > 1:
+            for transition in stateMachineTransitions:
+                transition['sourceHandle'] = '13'
+                transition['targetHandle'] = '1'
             continue
-        # Update parameter interface object
-        if 'modelVersion' not in full_data or full_data['modelVersion'] != '1.1':
-            paramInters = full_data['model']['realFunctionality']['parameterInterfaces']
-            for paramInter in paramInters:
-                paramInter['left'] = ''
-                paramInter['top'] = ''
-                paramInter['color'] = '#de8989'
-
-        # add blank comments to json
-        add_comment_to_messages(full_data)
-        add_comment_to_basic_interfaces(full_data)
-        add_comment_to_comp_interfaces(full_data)
-        add_comment_to_parties(full_data)
-        add_comment_to_states(full_data)
-
-        # Update transitions
-        transitions = full_data['model']['stateMachines']['transitions']
-
-        # Add transition name
-        for transition in transitions:
-            if 'name' not in transition:
-                transition['name'] = ''
-
-        stateMachines = full_data['model']['stateMachines']['stateMachines']
-        for stateMachine in stateMachines:
-            stateMachineTransitionsId = stateMachine['transitions']
-            stateMachineTransitions = []
-            for transitionA in stateMachineTransitionsId:
-                for transitionB in transitions:
-                    if transitionA == transitionB['id']:
-                        stateMachineTransitions.append(transitionB)
-
-            # Add transition handles
-            count = 0
-            for transitionA in stateMachineTransitions:
-                for transitionB in stateMachineTransitions:
-                    if (transitionA['fromState'] == transitionB['fromState']) and (transitionA['toState'] == transitionB['toState']):
-                        if 'sourceHandle' not in transitionA:
-                            sourceHandle = 13 - count
-                            transitionA['sourceHandle'] = str(sourceHandle)
-
-                        if 'targetHandle' not in transitionA:
-                            targetHandle = 1 + count
-                            transitionA['targetHandle'] = str(targetHandle)
-
-                        count += 1
-                    else:
-                        transitionA['sourceHandle'] = '13'
-                        transitionA['targetHandle'] = '1'
-
-        # Update state positioning
-        states = full_data['model']['stateMachines']['states']
-        for state in states:
-            state['left'] = state['left'] - 245
-            state['top'] = state['top'] - 100
-        
-        # Change model version
-        full_data['modelVersion'] = '1.3'
-        full_data['model']['modelVersion'] = '1.3'
-
-        with open(fileName, 'w') as fp:
-            json.dump(full_data, fp, indent=2)
-
-            print(fileName.stem + " updated")
+        count = len(stateMachineTransitions)
+        for position, transition in enumerate(stateMachineTransitions):
+            transition.setdefault('sourceHandle', str(13 - position * count))
+            transition.setdefault('targetHandle', str(1 + position * count))
 
-# helper functions
-def add_comment_to_messages(data):
+    for state in stateMachines['states']:
+        state['left'] = state['left'] - 245
+        state['top'] = state['top'] - 100
+
+def add_comments(full_data: dict) -> None:
+    add_comment_to_messages(full_data)
+    add_comment_to_basic_interfaces(full_data)
+    add_comment_to_comp_interfaces(full_data)
+    add_comment_to_parties(full_data)
+    add_comment_to_states(full_data)
 
-    updated_messages = []
-    for msg in data['model']['interfaces']['messages']:
-        if "messageComment" not in msg:
-            new_msg = msg.copy()
-            for key in msg:
-                new_msg[key] = msg[key]
-                if 'id' in msg:
-                    new_msg["messageComment"] = ""
-            msg = new_msg
-        updated_messages.append(msg)
+# helper functions
+def add_comment(items: list[dict], key: str) -> None:
+    """Adds an empty `key` to every item that has an id and no `key` yet."""
+    for item in items:
+        if key not in item and 'id' in item:
+            item[key] = ""
 
-    data['model']['interfaces']["messages"] = updated_messages
+def add_comment_to_messages(data):
+    add_comment(data['model']['interfaces']['messages'], 'messageComment')
 
 def add_comment_to_comp_interfaces(data):
-    updated_comps = []
-    for compInter in data['model']['interfaces']['compInters']:
-        if "interfaceComment" not in compInter:
-            new_comp = compInter.copy()
-            for key in compInter:
-                new_comp[key] = compInter[key]
-                if key == "id":
-                    new_comp["interfaceComment"] = ""
-            compInter = new_comp
-        updated_comps.append(compInter)
-
-    data['model']['interfaces']["compInters"] = updated_comps
+    add_comment(data['model']['interfaces']['compInters'], 'interfaceComment')
 
 def add_comment_to_basic_interfaces(data):
-    updated_basics = []
-    for basicInter in data['model']['interfaces']['basicInters']:
-        if "interfaceComment" not in basicInter:
-            new_basic = basicInter.copy()
-            for key in basicInter:
-                new_basic[key] = basicInter[key]
-                if key == "id":
-                    new_basic["interfaceComment"] = ""
-            basicInter = new_basic
-        updated_basics.append(basicInter)
-
-    data['model']['interfaces']["basicInters"] = updated_basics
+    add_comment(data['model']['interfaces']['basicInters'], 'interfaceComment')
 
 def add_comment_to_parties(data):
-    updated_parties = []
-    for party in data['model']['parties']['parties']:
-        if "comment" not in party:
-            new_party = party.copy()
-            for key in party:
-                new_party[key] = party[key]
-                if key == "id":
-                    new_party["comment"] = ""
-            party = new_party
-        updated_parties.append(party)
-
-    data['model']['parties']["parties"] = updated_parties
+    add_comment(data['model']['parties']['parties'], 'comment')
 
 def add_comment_to_states(data):
-    updated_states = []
-    for state in data['model']['stateMachines']['states']:
-        if "comment" not in state:
-            new_state = state.copy()
-            for key in state:
-                new_state[key] = state[key]
-                if key == "id":
-                    new_state["comment"] = ""
-            state = new_state
-        updated_states.append(state)
+    add_comment(data['model']['stateMachines']['states'], 'comment')
+
+# version -> (next version, step upgrading a model from version to next version)
+MIGRATIONS = {
+    '1.0': ('1.1', add_parameter_interface_layout),
+    '1.1': ('1.2', add_transition_layout),
+    '1.2': ('1.3', add_comments),
+}
+
+# bulk migration
+# catalog entries of migrated models are saved every this many models
+CATALOG_BATCH = 500
+# per-process store of the pool workers
+worker_stores = {}
+
+def migrate_file(filename: str, dry_run=False) -> dict:
+    """migrate_file(filename, dry_run) -> {'id', 'status', 'from', 'ms', 'stamp', ...}
+
+       Migrates one model file of a JSON store; runs in the pool of
+       `migrate_directory`. The conversion happens without any lock; the
+       write takes the catalog lock the backend's writes take and is
+       skipped, as 'changed', if the model was saved or patched since it
+       was read. `stamp` is the stamp of the file as examined or written.
+    """
+    from modelStore import JsonModelStore
+    from modelCatalog import summarize
+    start = time.perf_counter()
+    directory, id = os.path.dirname(filename) or '.', Path(filename).stem
+    if directory not in worker_stores:
+        worker_stores[directory] = JsonModelStore(directory, cache_bytes=0)
+    store = worker_stores[directory]
+    result = {'id': id, 'status': 'current', 'from': None, 'stamp': None}
+    try:
+        stamp, _ = store.stamp(id)
+        result['stamp'] = list(stamp[0])
+        result['from'] = sniff_version(filename)
+        if result['from'] == CURRENT_VERSION and stamp[1] is None:
+            return result
+        full_data = store.load(id)
+        result['from'] = full_data.get('modelVersion')
+        if not convert_model(full_data):
+            return result
+        if dry_run:
+            result['status'] = 'would update'
+            return result
+        full_data['revision'] = full_data.get('revision', 0) + 1
+        body = json.dumps(full_data, indent=2).encode('utf-8')
+        # unlike the backend's requests, a migration waits however long the lock is busy
+        with store.catalog_index.locked(id, timeout=math.inf):
+            if store.stamp(id)[0] != stamp:
+                result['status'] = 'changed'
+                return result
+            result['stamp'] = list(atomic_write(filename, body))
+            with suppress(FileNotFoundError):
+                os.remove(store.log_path(id))
+        result.update(status='updated', summary=summarize(id, full_data))
+    except json.JSONDecodeError:
+        result['status'] = 'corrupted'
+    except FileNotFoundError:
+        result['status'] = 'missing'
+    except (KeyError, TypeError, AttributeError) as e:
+        result.update(status='failed', error=repr(e))
+    finally:
+        result['ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+def read_checkpoint(checkpoint: str) -> dict[str, list]:
+    """read_checkpoint(checkpoint) -> id -> stamp of the files an earlier run finished"""
+    done = {}
+    try:
+        with open(checkpoint, 'r') as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break # cut short by the interruption
+                done[record['id']] = record['stamp']
+    except FileNotFoundError:
+        pass
+    return done
+
+def migrate_directory(directory: str, workers: int | None = None, dry_run=False, checkpoint: str | None = None) -> Counter:
+    """migrate_directory(directory, workers, dry_run, checkpoint) -> count of models by status
+
+       Migrates every model file of a JSON store in a process pool, printing
+       a line per file. Finished files are appended to `checkpoint` (default
+       `<directory>/.migration-checkpoint`), and a rerun skips those that are
+       unchanged since, so an interrupted run resumes where it stopped; the
+       checkpoint is removed once a run completes. The catalog is updated in
+       batches as models are migrated. A dry run writes nothing.
+    """
+    from modelStore import JsonModelStore
+    from modelCache import file_stamp
+    store = JsonModelStore(directory, cache_bytes=0)
+    checkpoint = checkpoint or os.path.join(directory, '.migration-checkpoint')
+    done = read_checkpoint(checkpoint) if not dry_run else {}
+    todo = []
+    for id in sorted(store.ids()):
+        with suppress(FileNotFoundError):
+            if done.get(id) != list(file_stamp(store.path(id))[0]):
+                todo.append(store.path(id))
+    counts = Counter(resumed=len(store.ids()) - len(todo))
+    pending = []
+
+    def save_entries():
+        # the entries of models saved again since are left to the backend's own writes
+        if pending and os.path.exists(store.catalog_index.path):
+            with store.catalog_index.updating(timeout=math.inf) as entries:
+                for result in pending:
+                    with suppress(FileNotFoundError):
+                        if list(file_stamp(store.path(result['id']))[0]) == result['stamp']:
+                            entries[result['id']] = result['summary']
+        pending.clear()
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool, open(os.devnull if dry_run else checkpoint, 'a') as fp:
+        futures = []
+        try:
+            futures = [pool.submit(migrate_file, filename, dry_run) for filename in todo]
+            for future in as_completed(futures):
+                result = future.result()
+                counts[result['status']] += 1
+                change = f' {result["from"] or "unversioned"} -> {CURRENT_VERSION}' if result['status'] in ('updated', 'would update') else ''
+                error = f' {result["error"]}' if 'error' in result else ''
+                print(f'{result["id"]}: {result["status"]}{change}{error} ({result["ms"]:.1f} ms)', flush=True)
+                if result['status'] in ('current', 'updated', 'corrupted'):
+                    fp.write(json.dumps({'id': result['id'], 'stamp': result['stamp']}) + '\n')
+                    fp.flush()
+                if result['status'] == 'updated':
+                    pending.append(result)
+                    if len(pending) >= CATALOG_BATCH:
+                        save_entries()
+        finally:
+            for future in futures:
+                future.cancel()
+            save_entries()
+    if not dry_run:
+        os.remove(checkpoint)
+    counts['seconds'] = round(time.perf_counter() - start, 3)
+    return counts
 
-    data['model']['stateMachines']["states"] = updated_states
+def migrate_database(database: str, dry_run=False) -> Counter:
+    """migrate_database(database, dry_run) -> count of models by status
 
+       Migrates the outdated models of a SQLite store one by one, since its
+       writes are serialized by the database anyway.
+    """
+    from modelStore import SqliteModelStore
+    store = SqliteModelStore(database)
+    counts = Counter()
+    start = time.perf_counter()
+    for id in store.outdated():
+        begin = time.perf_counter()
+        version = None
+        try:
+            if dry_run:
+                full_data = store.load(id)
+                version = full_data.get('modelVersion')
+                convert_model(full_data)
+                status = 'would update'
+            else:
+                version = (store.entry(id) or {}).get('modelVersion')
+                # waits out the backend's writes instead of giving up on a busy database
+                store.migrate(id, timeout=math.inf)
+                status = 'updated' if (store.entry(id) or {}).get('modelVersion') == CURRENT_VERSION else 'failed'
+        except json.JSONDecodeError:
+            status = 'corrupted'
+        except (KeyError, TypeError, AttributeError):
+            status = 'failed'
+        counts[status] += 1
+        change = f' {version or "unversioned"} -> {CURRENT_VERSION}' if status in ('updated', 'would update') else ''
+        print(f'{id}: {status}{change} ({(time.perf_counter() - begin) * 1000:.1f} ms)', flush=True)
+    counts['seconds'] = round(time.perf_counter() - start, 3)
+    return counts
 
 # main
 if __name__ == "__main__":
-    model_folder = Path('./models')
-    filenames = [
-        filepath for filepath in model_folder.iterdir()
-        if filepath.suffix == '.json'
-    ]
-    convert_files(filenames)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=f'Migrate every model of a store to version {CURRENT_VERSION}.')
+    parser.add_argument('--models', default='./models', help='directory of *.json models')
+    parser.add_argument('--database', help='migrate this SQLite model store instead of --models')
+    parser.add_argument('--workers', type=int, help='processes to convert models in (default: one per CPU)')
+    parser.add_argument('--checkpoint', help='progress file to resume from (default: <models>/.migration-checkpoint)')
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without writing')
+    args = parser.parse_args()
+    if args.database:
+        counts = migrate_database(args.database, args.dry_run)
+    else:
+        counts = migrate_directory(args.models, args.workers, args.dry_run, args.checkpoint)
+    seconds = counts.pop('seconds')
+    summary = ', '.join(f'{count} {status}' for status, count in sorted(counts.items()) if count)
+    print(f'{summary or "no models to migrate"} in {seconds} s')
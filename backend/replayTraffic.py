@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+"""Replays a traffic capture (see `trafficCapture.py`) against a backend, and compares the latencies of two runs.
+
+    python replayTraffic.py replay capture.jsonl --url http://127.0.0.1:5000 --speed 10 --output replay.jsonl
+    python replayTraffic.py diff capture.jsonl replay.jsonl --fail-above 20
+
+Replay against a backend with `BACKEND_AUTH_ENABLED=false` serving a copy
+of the models as they were when the capture started, so the captured
+`Model-Revision`s still apply. Each request is sent at its captured time,
+`--speed` times faster (0: as soon as possible). The requests of a
+session (its `SessionTabId`, or `TestUsername` without one) are sent in
+their captured order, each only once the one before it has been
+answered, so a save never overtakes the open that locked its model;
+requests of no session are sent on their own. Event streams are not
+replayed. Captured bodies are sent as they were; without them, saves send
+the model as the backend has it, patches an empty patch, returns and
+creations the least the route takes, and imports are skipped.
+
+A replay writes its requests in the capture's format, with `captured_status`
+next to the status it got, so `diff` compares any two captures or
+replays: request counts and p50/p95/p99 latency per route. It exits with
+status 1 when a route's p95 is more than `--fail-above` percent slower in
+the second.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from trafficCapture import bodies_dir
+
+# routes that are not replayed: event streams stay open for an hour
+SKIPPED_ROUTES = ('/model/events',)
+
+def load(path: str) -> list[dict]:
+    """load(capture) -> its requests, oldest first"""
+    with open(path, 'r') as fp:
+        records = [json.loads(line) for line in fp if line.strip()]
+    return sorted(records, key=lambda record: record['time'])
+
+def session_of(record: dict) -> str | None:
+    headers = record.get('headers', {})
+    return headers.get('SessionTabId') or headers.get('TestUsername') or None
+
+def sessions(records: list[dict]) -> tuple[dict[str, list[dict]], list[dict]]:
+    """sessions(records) -> ({session: its requests in order}, requests of no session)"""
+    bySession, independent = {}, []
+    for record in records:
+        if (session := session_of(record)) is None:
+            independent.append(record)
+        else:
+            bySession.setdefault(session, []).append(record)
+    return bySession, independent
+
+class HttpSender:
+    """HttpSender(url, capture path) -> send(record) for `replay`, over one connection per thread"""
+
+    def __init__(self, url: str, capture: str | None = None):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.bodies = bodies_dir(capture) if capture else None
+        self.local = threading.local()
+
+    def request(self, method: str, path: str, body: bytes | None, headers: dict) -> tuple[int, bytes]:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+        try:
+            conn.request(method, self.prefix + path, body=body, headers=headers)
+            resp = conn.getresponse()
+            return resp.status, resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self.local.conn = None
+            raise
+
+    def body(self, record: dict) -> bytes | None:
+        """body(record) -> the request body to send, None to skip the request"""
+        if not record['request_bytes']:
+            return b''
+        if self.bodies:
+            try:
+                with open(os.path.join(self.bodies, record['request_sha256']), 'rb') as fp:
+                    return fp.read()
+            except FileNotFoundError:
+                pass
+        id = record['path'].split('?')[0].rsplit('/', 1)[-1]
+        match (record['method'], record['route']):
+            case ('PUT', '/model/return/<id>'):
+                return json.dumps({'readOnly': ''}).encode('utf-8')
+            case ('POST', '/model/<id>'):
+                return json.dumps({'name': id}).encode('utf-8')
+            case ('PATCH', '/model/<id>'):
+                return b'[]'
+            case ('PUT', '/model/<id>'):
+                status, body = self.request('GET', record['path'], None, record['headers'])
+                if status != 200:
+                    return None
+                model = json.loads(body)
+                model.pop('readOnly', None)
+                return json.dumps(model).encode('utf-8')
+        return None
+
+    def __call__(self, record: dict) -> dict | None:
+        body = self.body(record)
+        if body is None:
+            return None
+        headers = dict(record['headers'])
+        if body and 'Content-Type' not in headers:
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        try:
+            status, data = self.request(record['method'], record['path'], body, headers)
+        except (OSError, http.client.HTTPException):
+            status, data = 0, b''
+        return {'status': status, 'response_bytes': len(data), 'seconds': time.perf_counter() - start}
+
+def replay(records: list[dict], send, speed=1.0, workers=64) -> list[dict]:
+    """replay(records, send(record) -> {status, response_bytes, seconds} or None, speed) -> the replayed requests
+
+       Sessions are replayed by a thread each, requests of no session by a
+       pool of `workers` threads; requests `send` skips are left out.
+    """
+    records = [record for record in records if record['route'] not in SKIPPED_ROUTES]
+    if not records:
+        return []
+    bySession, independent = sessions(records)
+    first, start = records[0]['time'], time.monotonic()
+    results, mutex = [], threading.Lock()
+
+    def wait_for(record):
+        if speed:
+            time.sleep(max(start + (record['time'] - first) / speed - time.monotonic(), 0))
+
+    def send_one(record):
+        sent = time.time()
+        result = send(record)
+        if result is None:
+            return
+        with mutex:
+            results.append(dict(record, time=round(sent, 6), status=result['status'], captured_status=record['status'],
+                                response_bytes=result['response_bytes'], duration_ms=round(result['seconds'] * 1000, 3),
+                                pid=None))
+
+    def run_session(lane):
+        for record in lane:
+            wait_for(record)
+            send_one(record)
+
+    threads = [threading.Thread(target=run_session, args=(lane,)) for lane in bySession.values()]
+    for thread in threads:
+        thread.start()
+    with ThreadPoolExecutor(workers) as pool:
+        for record in independent:
+            wait_for(record)
+            pool.submit(send_one, record)
+    for thread in threads:
+        thread.join()
+    return sorted(results, key=lambda result: result['time'])
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else float('nan')
+
+def latencies(records: list[dict]) -> dict[str, dict]:
+    """latencies(records) -> {'METHOD route': {'requests', 'p50_ms', 'p95_ms', 'p99_ms'}}"""
+    byRoute = {}
+    for record in records:
+        byRoute.setdefault(f'{record["method"]} {record["route"]}', []).append(record['duration_ms'])
+    return {route: {'requests': len(values), **{f'p{q}_ms': round(percentile(values, q / 100), 3) for q in (50, 95, 99)}}
+            for route, values in sorted(byRoute.items())}
+
+def diff(before: list[dict], after: list[dict]) -> list[dict]:
+    """diff(records, records) -> per route, the latencies of both and the change of the p95 in percent"""
+    old, new = latencies(before), latencies(after)
+    rows = []
+    for route in sorted(set(old) | set(new)):
+        row = {'route': route, 'before': old.get(route), 'after': new.get(route), 'p95_change_percent': None}
+        if route in old and route in new and old[route]['p95_ms'] > 0:
+            row['p95_change_percent'] = round((new[route]['p95_ms'] / old[route]['p95_ms'] - 1) * 100, 1)
+        rows.append(row)
+    return rows
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay captured backend traffic and compare latencies.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    replaying = commands.add_parser('replay', help='send the requests of a capture to a backend')
+    replaying.add_argument('capture', help='JSONL file written with TRAFFIC_CAPTURE_FILE')
+    replaying.add_argument('--url', default='http://127.0.0.1:5000', help='backend to send the requests to')
+    replaying.add_argument('--speed', type=float, default=1.0, help='times faster than captured; 0 sends without pauses')
+    replaying.add_argument('--workers', type=int, default=64, help='threads sending requests of no session')
+    replaying.add_argument('--output', help='JSONL file for the replayed requests, to diff against the capture')
+    diffing = commands.add_parser('diff', help='compare the latencies of two captures or replays')
+    diffing.add_argument('before')
+    diffing.add_argument('after')
+    diffing.add_argument('--fail-above', type=float, help='exit with status 1 if a p95 grew by more than this percent')
+    args = parser.parse_args()
+    if args.command == 'replay':
+        records = load(args.capture)
+        start = time.monotonic()
+        results = replay(records, HttpSender(args.url, args.capture), args.speed, args.workers)
+        seconds = time.monotonic() - start
+        if args.output:
+            with open(args.output, 'w') as fp:
+                fp.writelines(json.dumps(result) + '\n' for result in results)
+        print(json.dumps({'captured': len(records), 'replayed': len(results), 'seconds': round(seconds, 1),
+                          'requests_per_s': round(len(results) / seconds, 1) if seconds else None,
+                          'status_changed': sum(result['status'] != result['captured_status'] for result in results),
+                          'routes': latencies(results)}))
+    else:
+        rows = diff(load(args.before), load(args.after))
+        for row in rows:
+            print(json.dumps(row))
+        if args.fail_above is not None and any(row['p95_change_percent'] is not None and row['p95_change_percent'] > args.fail_above
+                                               for row in rows):
+            sys.exit(1)
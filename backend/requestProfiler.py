@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""Profiles of single requests, for finding out why one is slow in production.
+
+Off unless `PROFILE_DIR` is set; the apps then profile requests that carry
+the `X-Profile` header from an administrator (see `backend.validate_admin`)
+and a `PROFILE_SAMPLE_RATE` fraction of all others. A profiled request's
+threads are sampled every `PROFILE_INTERVAL_SECONDS` until its response is
+sent, and the samples are written to `PROFILE_DIR` as a speedscope file
+(https://www.speedscope.app) named after the request's method, route, model
+and payload size. Only the newest `PROFILE_SPOOL_FILES` files are kept.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import threading
+import itertools
+from contextlib import suppress
+from contextvars import ContextVar
+from datetime import datetime
+from atomicWrite import atomic_write
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_SECONDS', 0.001))
+PROFILE_SPOOL_FILES = int(os.environ.get('PROFILE_SPOOL_FILES', 200))
+PROFILE_HEADER = 'X-Profile'
+# the response to a profiled request names its file in this header
+PROFILE_FILE_HEADER = 'X-Profile-File'
+# deepest stack kept of a sample
+MAX_DEPTH = 256
+
+# the profile of the request being served by this thread or task
+current = ContextVar('current_profile', default=None)
+numbers = itertools.count()
+
+def wanted(header: str | None, is_admin) -> bool:
+    """wanted(X-Profile header, is_admin() -> bool) -> whether to profile the request"""
+    if header:
+        return is_admin()
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def slug(text: str) -> str:
+    return re.sub(r'[^A-Za-z0-9]+', '_', text).strip('_')[:60] or '_'
+
+class Profile:
+    """Profile(method, route, model, request_bytes) -> samples of one request's threads"""
+
+    def __init__(self, method: str, route: str, model: str, request_bytes: int, directory=None, interval=None):
+        self.method = method
+        self.route = route
+        self.model = model
+        self.request_bytes = request_bytes
+        self.directory = directory or PROFILE_DIR
+        self.interval = interval or PROFILE_INTERVAL_SECONDS
+        stamp = datetime.now().strftime('%Y%m%dT%H%M%S.%f')
+        self.filename = (f'{stamp}-{os.getpid()}-{next(numbers)}-{method}-{slug(route)}-{slug(model) if model else "-"}'
+                         f'-{request_bytes}B.speedscope.json')
+        self.threads = set()
+        self.frames = {} # (name, file, line) -> index
+        self.samples = []
+        self.weights = []
+        self.stop = threading.Event()
+        self.sampler = threading.Thread(target=self._sample_loop, name='request-profile', daemon=True)
+        self.start = time.perf_counter()
+
+    def add_thread(self, ident=None) -> None:
+        self.threads.add(ident or threading.get_ident())
+
+    def remove_thread(self, ident=None) -> None:
+        self.threads.discard(ident or threading.get_ident())
+
+    def _sample_loop(self) -> None:
+        last = time.perf_counter()
+        while not self.stop.wait(self.interval):
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            for ident in list(self.threads):
+                if (frame := frames.get(ident)) is not None:
+                    self.samples.append(self.stack(frame))
+                    self.weights.append(now - last)
+            last = now
+
+    def stack(self, frame) -> list[int]:
+        """stack(frame) -> frame indexes of the stack, outermost first"""
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            if (index := self.frames.get(key)) is None:
+                index = self.frames[key] = len(self.frames)
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def finish(self, status: int, response_bytes: int | None) -> str:
+        """finish(status, response bytes) -> path of the profile written"""
+        self.stop.set()
+        self.sampler.join()
+        duration = time.perf_counter() - self.start
+        name = (f'{self.method} {self.route} {self.model or ""} -> {status} in {duration * 1000:.1f} ms, '
+                f'request {self.request_bytes} B, response {"?" if response_bytes is None else response_bytes} B')
+        document = {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'requestProfiler',
+            'activeProfileIndex': 0,
+            'shared': {'frames': [{'name': function, 'file': file, 'line': line} for function, file, line in self.frames]},
+            'profiles': [{'type': 'sampled', 'name': name, 'unit': 'seconds', 'startValue': 0,
+                          'endValue': sum(self.weights), 'samples': self.samples, 'weights': self.weights}],
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, self.filename)
+        atomic_write(path, json.dumps(document, separators=(',', ':')).encode('utf-8'), 'off')
+        trim_spool(self.directory)
+        return path
+
+def begin(method: str, route: str, model: str, request_bytes: int, sample_caller=True) -> Profile:
+    """begin(method, route, model, request bytes) -> the profile of the request this
+       thread or task starts serving, sampling this thread unless not `sample_caller`
+    """
+    profile = Profile(method, route, model, request_bytes)
+    current.set(profile)
+    if sample_caller:
+        profile.add_thread()
+    profile.sampler.start()
+    return profile
+
+def trim_spool(directory: str) -> None:
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.speedscope.json'))
+    for name in names[:max(len(names) - PROFILE_SPOOL_FILES, 0)]:
+        with suppress(FileNotFoundError):
+            os.remove(os.path.join(directory, name))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# With PROMETHEUS_MULTIPROC_DIR set (before this module is imported), every
+# gunicorn worker keeps its samples in files there and `exposition` sums them,
+# so /metrics shows the whole server whichever worker answers it.
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10)) # 1 KiB .. 256 MiB
+
+REQUEST_SECONDS = Histogram('backend_request_seconds', 'Time to serve a request, until the last byte of its body',
+                            ['route', 'method'], buckets=SECONDS_BUCKETS)
+REQUESTS = Counter('backend_requests', 'Requests served', ['route', 'method', 'status'])
+STORAGE_BYTES = Histogram('backend_request_storage_bytes', 'Bytes of models, patch logs and catalog read or written by a request',
+                          ['route', 'direction'], buckets=BYTES_BUCKETS)
+JSON_SECONDS = Histogram('backend_json_seconds', 'Time spent parsing (load) and serializing (dump) stored JSON',
+                         ['operation', 'document'], buckets=SECONDS_BUCKETS)
+LOCK_WAIT_SECONDS = Histogram('backend_lock_wait_seconds', 'Time spent waiting for a file lock', ['lock'], buckets=SECONDS_BUCKETS)
+TOKEN_SECONDS = Histogram('backend_token_verify_seconds', 'Time decode_token took, by resulting token status',
+                          ['status'], buckets=SECONDS_BUCKETS)
+CORRUPTED = Counter('backend_corrupted_model_hits', 'Times a request ran into a corrupted model', ['route'])
+CACHE_LOOKUPS = Counter('backend_cache_lookups', 'Lookups in the parsed model and response caches, by result',
+                        ['cache', 'result'])
+CACHE_EVICTIONS = Counter('backend_cache_evictions', 'Entries evicted from a cache to stay within its budget', ['cache'])
+CACHE_BYTES = Gauge('backend_cache_bytes', 'Bytes held by a cache, summed over the live workers', ['cache'],
+                    multiprocess_mode='livesum')
+
+class RequestStats:
+    """What one request did, collected while it runs."""
+
+    def __init__(self, route: str, method: str):
+        self.route = route
+        self.method = method
+        self.start = time.perf_counter()
+        self.read = 0
+        self.written = 0
+
+# the request being served by this thread or task; threads started from it
+# with a copy of the context (anyio.to_thread) count into the same request
+current = ContextVar('current_request', default=None)
+
+def begin(route: str, method: str) -> RequestStats:
+    """begin(route template, method) -> stats of the request that starts now"""
+    stats = RequestStats(route, method)
+    current.set(stats)
+    return stats
+
+def finish(stats: RequestStats, status: int) -> None:
+    """Records a request once its response has been sent."""
+    REQUEST_SECONDS.labels(stats.route, stats.method).observe(time.perf_counter() - stats.start)
+    REQUESTS.labels(stats.route, stats.method, str(status)).inc()
+    STORAGE_BYTES.labels(stats.route, 'read').observe(stats.read)
+    STORAGE_BYTES.labels(stats.route, 'written').observe(stats.written)
+
+def count_read(nbytes: int) -> None:
+    if (stats := current.get()) is not None:
+        stats.read += nbytes
+
+def count_written(nbytes: int) -> None:
+    if (stats := current.get()) is not None:
+        stats.written += nbytes
+
+def corrupted_hit() -> None:
+    stats = current.get()
+    CORRUPTED.labels(stats.route if stats is not None else '').inc()
+
+@contextmanager
+def timed(histogram):
+    """with timed(JSON_SECONDS.labels('load', 'model')): ... observes the time the block took"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+def exposition() -> tuple[bytes, str]:
+    """exposition() -> (body, content type) of the /metrics response"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,146 @@
+import pytest
+import json
+import gzip
+import fcntl
+import threading
+import time
+from os import environ
+from pathlib import Path
+from starlette import status
+from starlette.testclient import TestClient
+
+if "TEST_DATA_FN" in environ:
+    TEST_DATA_PATH = Path(environ["TEST_DATA_FN"])
+else:
+    TEST_DATA_PATH = Path("./tests") / "testdata.json"
+    environ["MODEL_VERSION"] = "1.1"
+    environ["BACKEND_AUTH_ENABLED"] = "false"
+
+import asgiBackend
+from backend import app as flask_app
+
+MODEL_ID = "AsgiTest1"
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(asgiBackend.app) as client:
+        yield client
+
+@pytest.fixture(scope="module")
+def data():
+    with open(TEST_DATA_PATH, "rb") as f:
+        return json.load(f)
+
+def headers_for(data, **headers):
+    return {"SessionTabId": data["tab_ids"][1], "TestUsername": "user1", "Accept-Encoding": "identity", **headers}
+
+class TestAsgiBackend:
+    """Test the ASGI app against the Flask app it mirrors"""
+
+    def test_same_responses(self, client, data):
+        comp_id = data["ids"]["compInters"]["IdealOnly1"][0]
+        model_id = data["ids"]["models"]["IdealOnly2"]
+        urls = ["/model", "/model?limit=2", "/model/idealFunctionalities", "/model/compInterfaces",
+                f"/model/compInterfaces/{comp_id}/messages", f"/model/export/{model_id}", f"/model/{model_id}",
+                "/model/NoSuchModel", "/model?limit=0"]
+        flask_client = flask_app.test_client()
+        for url in urls:
+            expected = flask_client.get(url, headers=headers_for(data))
+            resp = client.get(url, headers=headers_for(data))
+            assert resp.status_code == expected.status_code, url
+            assert resp.content == expected.data, url
+            assert resp.headers.get("ETag") == expected.headers.get("ETag"), url
+            assert resp.headers.get("Model-Revision") == expected.headers.get("Model-Revision"), url
+            if resp.status_code == status.HTTP_200_OK:
+                etag = resp.headers["ETag"]
+                assert client.get(url, headers=headers_for(data, **{"If-None-Match": etag})).status_code == status.HTTP_304_NOT_MODIFIED
+                zipped = client.get(url, headers=headers_for(data, **{"Accept-Encoding": "gzip"}))
+                assert zipped.content == expected.data # httpx undoes the gzip coding
+        resp = client.get("/model", headers={"Authorization": "invalid token"})
+        assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_write_cycle(self, client, data):
+        body = {**data["postData"]["PostTest4"], "name": MODEL_ID}
+        resp = client.post(f"/model/{MODEL_ID}", json=body, headers=headers_for(data))
+        assert resp.status_code == status.HTTP_201_CREATED
+        assert resp.headers["Model-Revision"] == "0"
+        assert client.post(f"/model/{MODEL_ID}", json=body, headers=headers_for(data)).status_code == status.HTTP_412_PRECONDITION_FAILED
+        patch = [{"op": "replace", "path": "/interfaces/messages", "value": []}]
+        resp = client.patch(f"/model/{MODEL_ID}", content=gzip.compress(json.dumps(patch).encode()),
+                            headers=headers_for(data, **{"Content-Type": "application/json-patch+json", "Content-Encoding": "gzip",
+                                                         "Model-Revision": "0"}))
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.json() == {"revision": 1}
+        resp = client.patch(f"/model/{MODEL_ID}", content=json.dumps(patch),
+                            headers=headers_for(data, **{"Content-Type": "application/json-patch+json", "Model-Revision": "0"}))
+        assert resp.status_code == status.HTTP_409_CONFLICT
+        resp = client.put(f"/model/{MODEL_ID}", json=body, headers=headers_for(data))
+        assert resp.status_code == status.HTTP_201_CREATED
+        assert resp.headers["Model-Revision"] == "2"
+        resp = client.get(f"/model/{MODEL_ID}", headers=headers_for(data))
+        assert resp.json()["interfaces"] == body["interfaces"] and resp.json()["readOnly"] == ""
+        # open for writing elsewhere
+        assert client.delete(f"/model/{MODEL_ID}").status_code == status.HTTP_403_FORBIDDEN
+        assert client.put(f"/model/return/{MODEL_ID}", json={"readOnly": ""}).status_code == status.HTTP_200_OK
+        assert client.delete(f"/model/{MODEL_ID}").status_code == status.HTTP_204_NO_CONTENT
+        assert client.get(f"/model/{MODEL_ID}", headers=headers_for(data)).status_code == status.HTTP_404_NOT_FOUND
+
+    def test_catalog_lock_does_not_block(self, client, data):
+        catalog = getattr(asgiBackend.store, "catalog_index", None)
+        if catalog is None:
+            pytest.skip("only the JSON store has a catalog lock")
+        body = {**data["postData"]["PostTest4"], "name": MODEL_ID}
+        assert client.post(f"/model/{MODEL_ID}", json=body, headers=headers_for(data)).status_code == status.HTTP_201_CREATED
+        results = []
+        with open(catalog.lock_path, "a") as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            patching = threading.Thread(target=lambda: results.append(
+                client.patch(f"/model/{MODEL_ID}", content="[]", headers=headers_for(data, **{
+                    "Content-Type": "application/json-patch+json", "Model-Revision": "0"}))))
+            patching.start()
+            time.sleep(0.1)
+            # the patch waits for the lock while the loop keeps serving
+            assert client.get("/model/idealFunctionalities").status_code == status.HTTP_200_OK
+            assert not results
+            fcntl.flock(lock_fp, fcntl.LOCK_UN)
+        patching.join(5)
+        assert results[0].status_code == status.HTTP_200_OK
+        client.put(f"/model/return/{MODEL_ID}", json={"readOnly": ""})
+        assert client.delete(f"/model/{MODEL_ID}").status_code == status.HTTP_204_NO_CONTENT
+
+    def test_catalog_lock_timeout(self, client, data, monkeypatch):
+        import modelCatalog
+        catalog = getattr(asgiBackend.store, "catalog_index", None)
+        if catalog is None:
+            pytest.skip("only the JSON store has a catalog lock")
+        monkeypatch.setattr(modelCatalog, "LOCK_TIMEOUT_SECONDS", 0.1)
+        body = {**data["postData"]["PostTest4"], "name": MODEL_ID}
+        assert client.post(f"/model/{MODEL_ID}", json=body, headers=headers_for(data)).status_code == status.HTTP_201_CREATED
+        with open(catalog.lock_path, "a") as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            resp = client.patch(f"/model/{MODEL_ID}", content="[]", headers=headers_for(data, **{
+                "Content-Type": "application/json-patch+json", "Model-Revision": "0"}))
+            assert resp.status_code == status.HTTP_423_LOCKED
+            assert resp.headers["Retry-After"] == "1"
+            fcntl.flock(lock_fp, fcntl.LOCK_UN)
+        client.put(f"/model/return/{MODEL_ID}", json={"readOnly": ""})
+        assert client.delete(f"/model/{MODEL_ID}").status_code == status.HTTP_204_NO_CONTENT
+
+    def test_events(self, client, data, monkeypatch):
+        monkeypatch.setattr(asgiBackend, "EVENTS_STREAM_SECONDS", 0.5)
+        seq = asgiBackend.events.last()
+        asgiBackend.events.publish("model-updated", MODEL_ID, revision=3)
+        asgiBackend.events.publish("model-updated", "OtherModel", revision=1)
+        resp = client.get("/model/events", params={"lastEventId": seq, "models": MODEL_ID})
+        assert resp.headers["Content-Type"].startswith("text/event-stream")
+        assert resp.text.startswith("retry: ")
+        assert f"id: {seq + 1}\nevent: model-updated\ndata: " in resp.text
+        assert "OtherModel" not in resp.text
+
+    def test_metrics(self, client, data):
+        model_id = data["ids"]["models"]["IdealOnly2"]
+        assert client.get(f"/model/export/{model_id}", headers=headers_for(data)).status_code == status.HTTP_200_OK
+        resp = client.get("/metrics")
+        assert resp.status_code == status.HTTP_200_OK
+        # the same route labels as the Flask app
+        assert 'backend_requests_total{method="GET",route="/model/export/<id>",status="200"}' in resp.text
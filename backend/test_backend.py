@@ -2,13 +2,17 @@ from backend import app
 import pytest
 from typing import Any
 import json
+import gzip
 from starlette import status
 from flask.testing import FlaskClient
 from flask import Response
-from os import environ
+from os import environ, getpid
+import time
 import re
 from pathlib import Path
 from werkzeug.datastructures import FileStorage
+from werkzeug.test import encode_multipart
+from prometheus_client.parser import text_string_to_metric_families
 
 if "TEST_DATA_FN" in environ:
     TEST_DATA_PATH = Path(environ["TEST_DATA_FN"])
@@ -188,6 +192,11 @@ def refresh_model(
     )
 
 
+def cursor_for(client: FlaskClient, sort: str) -> str:
+    with client:
+        return client.get("/model", query_string={"limit": 1, "sort": sort}).json["nextCursor"]
+
+
 class TestEndpoints:
     """Test all endpoints"""
 
@@ -202,6 +211,36 @@ class TestEndpoints:
             })
         assert resp.status_code == status.HTTP_401_UNAUTHORIZED
 
+    def test_index_pages(self, client, data):
+        with client:
+            names = [model["name"] for model in client.get("/model").json]
+        pages, cursor = [], None
+        while True:
+            with client:
+                resp = client.get("/model", query_string={"limit": 2, **({"cursor": cursor} if cursor else {})})
+            assert resp.status_code == status.HTTP_200_OK
+            assert len(resp.json["models"]) <= 2
+            pages += resp.json["models"]
+            cursor = resp.json["nextCursor"]
+            if cursor is None:
+                break
+        assert [model["name"] for model in pages] == sorted(names)
+        with client:
+            resp = client.get("/model", query_string={"prefix": "IdealOnly", "sort": "-lastModified"})
+        models = resp.json["models"]
+        assert models and all(model["name"].startswith("IdealOnly") for model in models)
+        assert [model["lastModified"] for model in models] == sorted((model["lastModified"] for model in models), reverse=True)
+        get_model(client, data["ids"]["models"]["IdealOnly1"], "user1", data["tab_ids"][0])
+        with client:
+            locked = client.get("/model", query_string={"locked": "true", "limit": 1000}).json["models"]
+            unlocked = client.get("/model", query_string={"locked": "false", "limit": 1000}).json["models"]
+        assert "IdealOnly1" in [model["name"] for model in locked]
+        assert all(model["readOnly"] for model in locked) and not any(model["readOnly"] for model in unlocked)
+        for query in ({"limit": 0}, {"sort": "size"}, {"locked": "maybe"}, {"cursor": "bm90IGEgY3Vyc29y"},
+                      {"cursor": cursor_for(client, "name"), "sort": "lastModified"}):
+            with client:
+                assert client.get("/model", query_string=query).status_code == status.HTTP_400_BAD_REQUEST
+
     def test_get_model_pos(self, client, data):
         model_id = data["ids"]["models"]["IdealOnly1"]
         resp = get_model(
@@ -569,6 +608,310 @@ class TestEndpoints:
         resp = delete_model(client, id=model_ids[1])
         assert resp.status_code == status.HTTP_204_NO_CONTENT
 
+    def test_patch_model(self, client, data):
+        model_id = data["ids"]["models"]["PostTest4"]
+        resp = create_model(
+            client,
+            model_id,
+            data["postData"]["PostTest4"],
+            "user1",
+            data["tab_ids"][0],
+        )
+        assert resp.status_code == status.HTTP_201_CREATED
+        resp = get_model(client, model_id, "user1", data["tab_ids"][0])
+        revision = resp.headers["Model-Revision"]
+        headers = {
+            "SessionTabId": data["tab_ids"][0],
+            "TestUsername": "user1",
+            "Content-Type": "application/json-patch+json",
+            "Model-Revision": revision,
+        }
+        patch = [{"op": "add", "path": "/interfaces/messages/-", "value": data["putData"][0]["interfaces"]["messages"][0]}]
+        with client:
+            resp = client.patch(f"/model/{model_id}", data=json.dumps(patch), headers=headers)
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.json["revision"] == int(revision) + 1
+        resp2 = get_model(client, model_id, "user1", data["tab_ids"][0])
+        assert resp2.headers["Model-Revision"] == str(resp.json["revision"])
+        assert len(resp2.json["interfaces"]["messages"]) == len(data["postData"]["PostTest4"]["interfaces"]["messages"]) + 1
+        with client:
+            # stale revision
+            resp = client.patch(f"/model/{model_id}", data=json.dumps(patch), headers=headers)
+            assert resp.status_code == status.HTTP_409_CONFLICT
+            assert resp.headers["Model-Revision"] == resp2.headers["Model-Revision"]
+            headers["Model-Revision"] = resp2.headers["Model-Revision"]
+            resp = client.patch(f"/model/{model_id}", data=json.dumps([{"op": "remove", "path": "/missing"}]), headers=headers)
+            assert resp.status_code == status.HTTP_400_BAD_REQUEST
+            resp = client.patch(f"/model/{model_id}", data=json.dumps([{"op": "replace", "path": "/name", "value": "PostTest9"}]), headers=headers)
+            assert resp.status_code == status.HTTP_400_BAD_REQUEST
+            resp = client.patch("/model/MissingModel", data=json.dumps(patch), headers=headers)
+            assert resp.status_code == status.HTTP_404_NOT_FOUND
+            del headers["Model-Revision"]
+            resp = client.patch(f"/model/{model_id}", data=json.dumps(patch), headers=headers)
+            assert resp.status_code == status.HTTP_428_PRECONDITION_REQUIRED
+        resp = return_model(client, model_id, data["postData"]["PostTest4"])
+        assert resp.status_code == status.HTTP_200_OK
+        resp = delete_model(client, id=model_id)
+        assert resp.status_code == status.HTTP_204_NO_CONTENT
+
+    def test_etags(self, client, data, monkeypatch):
+        import backend
+        model_id = data["ids"]["models"]["IdealOnly1"]
+        if_id = data["ids"]["IFs"]["IdealOnly1"]
+        comp_id = data["ids"]["compInters"]["IdealOnly1"][0]
+        urls = [
+            # opening the model locks it, which changes the index; open it first
+            f"/model/{model_id}",
+            "/model",
+            "/model/idealFunctionalities",
+            "/model/compInterfaces",
+            f"/model/idealFunctionalities/{if_id}/messages",
+            f"/model/compInterfaces/{comp_id}/messages",
+            f"/model/export/{model_id}",
+        ]
+        headers = {"SessionTabId": data["tab_ids"][3], "TestUsername": "user2"}
+        with client:
+            etags = {url: client.get(url, headers=headers).headers["ETag"] for url in urls}
+
+        def fail(*args, **kwargs):
+            raise AssertionError("a 304 must not load models")
+
+        # unchanged: answered without loading any model
+        monkeypatch.setattr(backend.store, "load_cached", fail)
+        monkeypatch.setattr(backend.store, "derived", fail)
+        with client:
+            for url in urls:
+                resp = client.get(url, headers={**headers, "If-None-Match": etags[url]})
+                assert resp.status_code == status.HTTP_304_NOT_MODIFIED
+                assert resp.headers["ETag"] == etags[url]
+        monkeypatch.undo()
+        # another tab sees the model as read-only, a different representation
+        resp = get_model(client, model_id, "user1", data["tab_ids"][0])
+        assert resp.json["readOnly"] == f"user2/{data['tab_ids'][3]}"
+        assert resp.headers["ETag"] != etags[f"/model/{model_id}"]
+        revision = resp.headers["Model-Revision"]
+        # a save changes every representation built from the model
+        with client:
+            resp = client.patch(
+                f"/model/{model_id}",
+                json=[{"op": "add", "path": "/comment", "value": "etag test"}],
+                headers={**headers, "Model-Revision": revision},
+            )
+            assert resp.status_code == status.HTTP_200_OK
+            for url in urls:
+                resp = client.get(url, headers={**headers, "If-None-Match": etags[url]})
+                assert resp.status_code == status.HTTP_200_OK
+                assert resp.headers["ETag"] != etags[url]
+        resp = return_model(client, model_id, {"readOnly": ""})
+        assert resp.status_code == status.HTTP_200_OK
+
+    def test_compression(self, client, data, monkeypatch):
+        import backend
+        model_id = data["ids"]["models"]["FullModel1"]
+        with client:
+            plain = client.get(f"/model/export/{model_id}")
+            resp = client.get(f"/model/export/{model_id}", headers={"Accept-Encoding": "gzip"})
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert resp.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+        assert gzip.decompress(resp.data) == plain.data
+        # the compressed bytes are cached with the response
+        monkeypatch.setattr(backend, "compress", None)
+        with client:
+            again = client.get(f"/model/export/{model_id}", headers={"Accept-Encoding": "gzip"})
+            assert again.data == resp.data
+            resp = client.get(f"/model/export/{model_id}", headers={"Accept-Encoding": "gzip", "If-None-Match": resp.headers["ETag"]})
+            assert resp.status_code == status.HTTP_304_NOT_MODIFIED
+        monkeypatch.undo()
+
+    def test_streaming(self, client, data, monkeypatch):
+        import backend
+        comp_id = data["ids"]["compInters"]["IdealOnly1"][0]
+        urls = ["/model", "/model/idealFunctionalities", "/model/compInterfaces",
+                f"/model/compInterfaces/{comp_id}/messages"]
+        monkeypatch.setattr(backend, "STREAM_RESPONSES", False)
+        with client:
+            buffered = {url: client.get(url) for url in urls}
+        monkeypatch.setattr(backend, "STREAM_RESPONSES", True)
+        for url in urls:
+            etag = buffered[url].headers["ETag"].strip('"')
+            backend.responses.invalidate(etag)
+            with client:
+                resp = client.get(url)
+            assert resp.is_streamed
+            # same bytes and ETag either way
+            assert resp.data == buffered[url].data
+            assert resp.headers["ETag"] == buffered[url].headers["ETag"]
+            # the streamed body was cached once complete
+            assert backend.responses.lookup(etag, etag).value["identity"] == resp.data
+            backend.responses.invalidate(etag)
+            with client:
+                resp = client.get(url, headers={"Accept-Encoding": "gzip"})
+            assert resp.headers["Content-Encoding"] == "gzip"
+            assert resp.headers["ETag"] == f'"{etag}-gzip"'
+            assert gzip.decompress(resp.data) == buffered[url].data
+
+    def test_events(self, client, data):
+        import backend
+        model_id = data["ids"]["models"]["FullModel1"]
+        seq = backend.events.last()
+        resp = get_model(client, model_id, "user1", data["tab_ids"][0])
+        assert resp.status_code == status.HTTP_200_OK
+        resp = return_model(client, model_id, {"readOnly": ""})
+        assert resp.status_code == status.HTTP_200_OK
+        with client:
+            resp = client.get("/model/events", query_string={"models": model_id, "lastEventId": seq}, buffered=False)
+            assert resp.status_code == status.HTTP_200_OK
+            assert resp.mimetype == "text/event-stream"
+            chunks = iter(resp.response)
+            assert next(chunks).startswith(b"retry: ")
+            frames = next(chunks).decode().strip().split("\n\n")
+            resp.close()
+        events = [dict(line.split(": ", 1) for line in frame.split("\n")) for frame in frames]
+        assert [event["event"] for event in events] == ["lock-acquired", "lock-released"]
+        assert int(events[0]["id"]) > seq
+        assert json.loads(events[0]["data"]) == {"model": model_id, "owner": f'user1/{data["tab_ids"][0]}'}
+        # resuming after the last event waits for the next one
+        with client:
+            resp = client.get("/model/events", headers={"Last-Event-ID": events[-1]["id"]}, buffered=False)
+            chunks = iter(resp.response)
+            next(chunks)
+            backend.events.publish("model-updated", model_id, revision=7)
+            assert b"event: model-updated" in next(chunks)
+            resp.close()
+
+    def test_events_limit(self, client, data, monkeypatch):
+        import backend
+        import threading
+        monkeypatch.setattr(backend, "stream_slots", threading.BoundedSemaphore(2))
+        model_id = data["ids"]["models"]["FullModel1"]
+        streams = [client.get("/model/events", buffered=False) for _ in range(2)]
+        assert [resp.status_code for resp in streams] == [status.HTTP_200_OK] * 2
+        resp = client.get("/model/events")
+        assert resp.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert resp.headers["Retry-After"] == str(backend.EVENTS_RETRY_AFTER_SECONDS)
+        # the other routes are not held up by the streams
+        assert client.get("/model").status_code == status.HTTP_200_OK
+        assert client.get(f"/model/export/{model_id}").status_code == status.HTTP_200_OK
+        # a closed stream gives its slot back, started or not
+        next(iter(streams[0].response))
+        for resp in streams:
+            resp.close()
+        streams = [client.get("/model/events", buffered=False) for _ in range(2)]
+        assert [resp.status_code for resp in streams] == [status.HTTP_200_OK] * 2
+        for resp in streams:
+            resp.close()
+
+    def test_metrics(self, client, data):
+        model_id = data["ids"]["models"]["FullModel1"]
+
+        def sample(text, name, **labels):
+            return sum(s.value for family in text_string_to_metric_families(text) for s in family.samples
+                       if s.name == name and labels.items() <= s.labels.items())
+
+        before = client.get("/metrics").data.decode()
+        # a request is recorded once the server closes its response
+        with client.get(f"/model/export/{model_id}") as resp:
+            assert resp.status_code == status.HTTP_200_OK
+        with client.get("/model/NoSuchModel/x") as resp:
+            assert resp.status_code == status.HTTP_404_NOT_FOUND
+        resp = client.get("/metrics")
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.mimetype == "text/plain"
+        after = resp.data.decode()
+        route = "/model/export/<id>"
+        for name, labels in [("backend_request_seconds_count", {"route": route, "method": "GET"}),
+                             ("backend_requests_total", {"route": route, "method": "GET", "status": "200"}),
+                             ("backend_requests_total", {"route": "unmatched", "method": "GET", "status": "404"})]:
+            assert sample(after, name, **labels) == sample(before, name, **labels) + 1, name
+        assert sample(after, "backend_request_storage_bytes_count", route=route, direction="read") == \
+            sample(before, "backend_request_storage_bytes_count", route=route, direction="read") + 1
+        assert "backend_json_seconds_count" in after and "backend_corrupted_model_hits_total" in after
+        # exporting again is answered from the response cache
+        with client.get(f"/model/export/{model_id}") as resp:
+            assert resp.status_code == status.HTTP_200_OK
+        cached = client.get("/metrics").data.decode()
+        assert sample(cached, "backend_cache_lookups_total", cache="response", result="hit") > \
+            sample(after, "backend_cache_lookups_total", cache="response", result="hit")
+        assert sample(cached, "backend_cache_bytes", cache="response") > 0
+
+    def test_busy_lock(self, client, monkeypatch):
+        import backend
+        import fcntl
+        import modelCatalog
+        catalog = getattr(backend.store, "catalog_index", None)
+        if catalog is None:
+            pytest.skip("only the JSON store has a catalog lock")
+        monkeypatch.setattr(modelCatalog, "LOCK_TIMEOUT_SECONDS", 0.1)
+        with open(TEST_DATA_PATH.parent / "models" / "IdealOnly2.json") as f:
+            outdated = json.load(f)
+        outdated["model"]["name"] = "StaleTest1"
+        backend.store.save("StaleTest1", outdated)
+        with open(catalog.lock_path, "a") as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            # lists do not wait to migrate; they name the models they could not
+            with client:
+                resp = client.get("/model")
+                assert resp.status_code == status.HTTP_200_OK
+                assert "StaleTest1" in resp.headers["Stale-Models"].split(",")
+                assert "StaleTest1" in [model["name"] for model in resp.json]
+                resp = client.get("/model", query_string={"prefix": "StaleTest"})
+                assert resp.json["stale"] == ["StaleTest1"]
+            # writes give up with 423 Locked
+            with client:
+                resp = client.delete("/model/StaleTest1")
+            assert resp.status_code == status.HTTP_423_LOCKED
+            assert resp.headers["Retry-After"] == "1"
+            fcntl.flock(lock_fp, fcntl.LOCK_UN)
+        with client:
+            assert "Stale-Models" not in client.get("/model").headers
+        assert backend.store.entry("StaleTest1")["modelVersion"] == backend.CURRENT_VERSION
+        with client:
+            assert client.delete("/model/StaleTest1").status_code == status.HTTP_204_NO_CONTENT
+
+    def test_compressed_uploads(self, client, data, model_imports, monkeypatch):
+        model_id = data["ids"]["models"]["PostTest4"]
+        headers = {
+            "SessionTabId": data["tab_ids"][0],
+            "TestUsername": "user1",
+            "Content-Type": "application/json",
+            "Content-Encoding": "gzip",
+        }
+        body = gzip.compress(json.dumps(data["postData"]["PostTest4"]).encode())
+        with client:
+            resp = client.post(f"/model/{model_id}", data=body, headers=headers)
+            assert resp.status_code == status.HTTP_201_CREATED
+            assert resp.json["name"] == model_id
+            updated = {**data["postData"]["PostTest4"], **data["putData"][1], "name": model_id}
+            resp = client.put(f"/model/{model_id}", data=gzip.compress(json.dumps(updated).encode()), headers=headers)
+            assert resp.status_code == status.HTTP_201_CREATED
+            assert len(resp.json["interfaces"]["messages"]) == len(updated["interfaces"]["messages"])
+            resp = client.put(f"/model/{model_id}", data=b"not gzip", headers=headers)
+            assert resp.status_code == status.HTTP_400_BAD_REQUEST
+            resp = client.put(f"/model/{model_id}", data=body, headers={**headers, "Content-Encoding": "br"})
+            assert resp.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        import backend
+        monkeypatch.setattr(backend.app.wsgi_app, "limit", 1000)
+        with client:
+            resp = client.put(f"/model/{model_id}", data=gzip.compress(b" " * 100000), headers=headers)
+            assert resp.status_code == 413
+        monkeypatch.undo()
+        file_data, fn = next(model_imports[0]())
+        boundary, body = encode_multipart({fn: file_data})
+        with client:
+            resp = client.post(
+                f"/model/import/{fn}",
+                data=gzip.compress(body),
+                headers={"Content-Type": f"multipart/form-data; boundary={boundary}", "Content-Encoding": "gzip"},
+            )
+        assert resp.status_code == status.HTTP_201_CREATED
+        resp = delete_model(client, id=resp.json["model"]["name"])
+        assert resp.status_code == status.HTTP_204_NO_CONTENT
+        resp = return_model(client, model_id, data["postData"]["PostTest4"])
+        assert resp.status_code == status.HTTP_200_OK
+        resp = delete_model(client, id=model_id)
+        assert resp.status_code == status.HTTP_204_NO_CONTENT
+
     def test_return_pos(self, client, data):
         model_ids = [
             data["ids"]["models"]["IdealOnly1"],
@@ -724,3 +1067,157 @@ class TestEndpoints:
                     num_messages.append(len(resp.json))
         assert len(responses) == len(comp_ids)
         assert num_messages == message_counts
+
+
+class TestTokens:
+    """Test token verification against locally generated signing keys"""
+
+    @pytest.fixture
+    def signing(self, monkeypatch):
+        import backend
+        import jwt
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from tokenAuth import KeyStore, TokenCache
+        private = {kid: rsa.generate_private_key(public_exponent=65537, key_size=2048) for kid in ("k1", "k2")}
+        published = {"k1": private["k1"].public_key()}
+        keys = KeyStore("http://keycloak.invalid/realms/test")
+        fetches = []
+        monkeypatch.setattr(keys, "fetch", lambda: fetches.append(1) or dict(published))
+        keys.pid = getpid() # no refresh thread
+        tokens = TokenCache(2)
+        keys.listeners.append(tokens.retain)
+        monkeypatch.setattr(backend, "keys", keys)
+        monkeypatch.setattr(backend, "tokens", tokens)
+
+        def sign(kid, username="user1", lifetime=300, roles=()):
+            claims = {"preferred_username": username, "exp": int(time.time()) + lifetime,
+                      "realm_access": {"roles": list(roles)}}
+            return jwt.encode(claims, private[kid], algorithm="RS256", headers={"kid": kid})
+        return {"sign": sign, "published": published, "private": private, "tokens": tokens, "fetches": fetches}
+
+    def test_cached_verification(self, signing):
+        from backend import decode_token
+        token = signing["sign"]("k1")
+        assert decode_token(f"Bearer {token}")["username"] == "user1"
+        assert decode_token(f"Bearer {token}")["username"] == "user1"
+        assert (signing["tokens"].misses, signing["tokens"].hits) == (1, 1)
+        # least recently used tokens are evicted, expired ones never served
+        for username in ("user2", "user3"):
+            decode_token(signing["sign"]("k1", username))
+        assert signing["tokens"].lookup(token) is None
+        expired = signing["sign"]("k1", lifetime=-10)
+        assert decode_token(expired)["token_status"] == "invalid"
+        assert decode_token("not a token")["token_status"] == "invalid"
+        assert decode_token("")["token_status"] == "token_missing"
+
+    def test_key_rotation(self, signing):
+        import backend
+        from backend import decode_token
+        old = signing["sign"]("k1")
+        assert decode_token(old)["token_status"] == "valid"
+        # Keycloak rotates to k2: a token with the new kid refreshes the keys
+        signing["published"].clear()
+        signing["published"]["k2"] = signing["private"]["k2"].public_key()
+        backend.keys.refreshed = None
+        assert decode_token(signing["sign"]("k2", "user2"))["username"] == "user2"
+        # tokens verified with the retired key are dropped from the cache
+        assert signing["tokens"].lookup(old) is None
+        assert decode_token(old)["token_status"] == "invalid"
+        # unknown kids refresh at most every KEY_MISS_REFRESH_SECONDS
+        fetches = len(signing["fetches"])
+        decode_token(signing["sign"]("k1"))
+        assert len(signing["fetches"]) == fetches
+
+    def test_admin_role(self, client, signing, monkeypatch):
+        monkeypatch.setenv("BACKEND_AUTH_ENABLED", "true")
+        resp = client.get("/admin/locks", headers={"Authorization": f'Bearer {signing["sign"]("k1")}'})
+        assert resp.status_code == status.HTTP_403_FORBIDDEN
+        admin = signing["sign"]("k1", "admin", roles=["backend-admin"])
+        resp = client.get("/admin/locks", query_string={"top": 3}, headers={"Authorization": f"Bearer {admin}"})
+        assert resp.status_code == status.HTTP_200_OK
+        assert getpid() in resp.json["workers"] and isinstance(resp.json["locks"], list)
+        assert client.get("/admin/locks").status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestRequestProfiler:
+    """Test request profiles and their spool"""
+
+    def test_profile(self, tmp_path, monkeypatch):
+        import requestProfiler
+        monkeypatch.setattr(requestProfiler, "PROFILE_DIR", str(tmp_path))
+        monkeypatch.setattr(requestProfiler, "PROFILE_SPOOL_FILES", 2)
+
+        def busy_work(until):
+            while time.perf_counter() < until:
+                pass
+
+        paths = []
+        for i in range(3):
+            profile = requestProfiler.begin("GET", "/model/<id>", f"Model{i}", 12)
+            busy_work(time.perf_counter() + 0.05)
+            paths.append(profile.finish(200, 345))
+        # only the newest files are kept
+        assert sorted(fp.name for fp in tmp_path.iterdir()) == sorted(Path(path).name for path in paths[1:])
+        assert "-GET-model_id-Model2-12B." in paths[2]
+        with open(paths[2]) as f:
+            document = json.load(f)
+        assert document["name"].startswith("GET /model/<id> Model2 -> 200 in ")
+        [profile] = document["profiles"]
+        assert profile["samples"] and len(profile["samples"]) == len(profile["weights"])
+        names = {frame["name"] for frame in document["shared"]["frames"]}
+        assert "busy_work" in names
+        assert not requestProfiler.wanted(None, None)
+        assert requestProfiler.wanted("1", lambda: True) and not requestProfiler.wanted("1", lambda: False)
+
+
+class TestTrafficCapture:
+    """Test capturing requests and replaying them"""
+
+    def test_record(self, tmp_path):
+        from trafficCapture import Capture, bodies_dir
+        path = str(tmp_path / "capture.jsonl")
+        capture = Capture(path, bodies=True)
+        headers = {"SessionTabId": "tab1", "TestUsername": "user1", "Authorization": "Bearer secret"}
+        capture.record("PUT", "/model/<id>", "/model/Model1", headers, b'{"name": "Model1"}', 200, 12, 0.25)
+        capture.record("GET", "/model", "/model?limit=5", {}, b"", 200, 34, 0.5)
+        with open(path) as f:
+            put, get = [json.loads(line) for line in f]
+        assert put["headers"] == {"SessionTabId": "tab1", "TestUsername": "user1"}
+        assert (put["route"], put["request_bytes"], put["duration_ms"], put["pid"]) == ("/model/<id>", 18, 250.0, getpid())
+        assert get["path"] == "/model?limit=5" and get["request_sha256"] == ""
+        with open(Path(bodies_dir(path)) / put["request_sha256"], "rb") as f:
+            assert f.read() == b'{"name": "Model1"}'
+
+    def test_replay(self, client):
+        import replayTraffic
+
+        class ClientSender(replayTraffic.HttpSender):
+            def request(self, method, path, body, headers):
+                with client.open(path, method=method, data=body, headers=headers) as resp:
+                    return resp.status_code, resp.data
+
+        def record(time, method, route, id, tab, request_bytes=0, status=200, **headers):
+            return {"time": time, "method": method, "route": route, "path": route.replace("<id>", id),
+                    "headers": {"SessionTabId": tab, "TestUsername": "replay", **headers}, "request_bytes": request_bytes,
+                    "request_sha256": "", "status": status, "response_bytes": 0, "duration_ms": 1.0, "pid": 1}
+
+        # two tabs editing their own models; bodies were not captured
+        records, revision = [], {"Content-Type": "application/json-patch+json", "Model-Revision": "1"}
+        for tab, id in (("replay/tab1", "ReplayOne"), ("replay/tab2", "ReplayTwo")):
+            records += [record(0, "POST", "/model/<id>", id, tab, 20, status=201), record(1, "GET", "/model/<id>", id, tab),
+                        record(2, "PUT", "/model/<id>", id, tab, 500), record(3, "PATCH", "/model/<id>", id, tab, 2, **revision),
+                        record(4, "PUT", "/model/return/<id>", id, tab, 16), record(5, "GET", "/model/events", id, tab),
+                        record(6, "POST", "/model/import/<id>", id, tab, 900), record(7, "DELETE", "/model/<id>", id, tab)]
+        records.sort(key=lambda r: r["time"])
+        results = replayTraffic.replay(records, ClientSender("http://backend"), speed=0)
+        for id in ("ReplayOne", "ReplayTwo"):
+            replayed = [(r["method"], r["route"]) for r in results if r["path"].endswith(id)]
+            # in the session's order; the event stream and the import without its file are skipped
+            assert replayed == [("POST", "/model/<id>"), ("GET", "/model/<id>"), ("PUT", "/model/<id>"),
+                                ("PATCH", "/model/<id>"), ("PUT", "/model/return/<id>"), ("DELETE", "/model/<id>")]
+        assert all(200 <= r["status"] < 300 for r in results), [(r["method"], r["path"], r["status"]) for r in results]
+
+        slower = [dict(r, duration_ms=r["duration_ms"] * 2) for r in results]
+        rows = {row["route"]: row for row in replayTraffic.diff(results, slower)}
+        assert rows["GET /model/<id>"]["before"]["requests"] == 2
+        assert rows["GET /model/<id>"]["p95_change_percent"] == 100.0
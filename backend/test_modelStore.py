@@ -0,0 +1,715 @@
+import os
+import json
+import time
+import fcntl
+import threading
+import pytest
+from pathlib import Path
+import modelStore
+from modelStore import JsonModelStore, SqliteModelStore, LockTimeout, RevisionConflict, import_directory
+from jsonPatch import JsonPatchError, apply_patch
+from modelCache import ModelCache, file_stamp
+from lockRegistry import LockRegistry
+from modelEvents import EventLog
+import lockStats
+from lockStats import LockStats
+import serverMetrics
+import atomicWrite
+from atomicWrite import atomic_write, GroupCommit
+from reconciliationScript import (CURRENT_VERSION, MIGRATIONS, convert_files, convert_model, migrate_database,
+                                  migrate_directory, sniff_version)
+from tests import legacyReconciliation
+from corpusGenerator import generate_model, ideal_refs, populate
+
+MODELS_DIR = Path(__file__).parent / "tests" / "models"
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "json":
+        store = JsonModelStore(str(tmp_path))
+        for fp in MODELS_DIR.glob("*.json"):
+            (tmp_path / fp.name).write_bytes(fp.read_bytes())
+        return store
+    store = SqliteModelStore(str(tmp_path / "models.sqlite3"))
+    import_directory(str(MODELS_DIR), store)
+    return store
+
+
+class TestModelStore:
+    """Test both storage backends behave the same"""
+
+    def test_ids(self, store):
+        assert sorted(store.ids()) == sorted(fp.stem for fp in MODELS_DIR.glob("*.json"))
+
+    def test_load(self, store):
+        full_data = store.load("FullModel1")
+        assert full_data["model"]["name"] == "FullModel1"
+        with pytest.raises(json.JSONDecodeError):
+            store.load("CorruptedModel")
+        with pytest.raises(FileNotFoundError):
+            store.load("MissingModel")
+
+    def test_save_remove(self, store):
+        full_data = store.load("IdealOnly1")
+        full_data["model"]["name"] = "IdealOnlyCopy"
+        full_data["readOnly"] = "user1/abc/def"
+        store.save("IdealOnlyCopy", full_data)
+        assert store.exists("IdealOnlyCopy")
+        assert store.load("IdealOnlyCopy") == full_data
+        store.remove("IdealOnlyCopy")
+        assert not store.exists("IdealOnlyCopy")
+        with pytest.raises(FileNotFoundError):
+            store.remove("IdealOnlyCopy")
+
+    def test_catalog(self, store):
+        metas = {meta["id"]: meta for meta in store.catalog()}
+        assert metas["CorruptedModel"]["corrupted"]
+        assert metas["FullModel1"]["modelVersion"] == "1.2"
+        assert "readOnly" not in metas["FullModel1"]
+
+    def test_models_referencing(self, store):
+        if_id = "4272dfb5-66d5-520a-c454-a67085c4aa37"
+        assert store.models_referencing("idealFunctionality", if_id) == ["IdealOnly1"]
+        assert store.models_referencing("compInter", "d31bb636-b59c-6bb0-a51e-bf642cbb57d6") == ["IdealOnly1"]
+        full_data = store.load("IdealOnly1")
+        full_data["model"]["name"] = "IdealOnlyCopy"
+        store.save("IdealOnlyCopy", full_data)
+        assert sorted(store.models_referencing("idealFunctionality", if_id)) == ["IdealOnly1", "IdealOnlyCopy"]
+        store.remove("IdealOnly1")
+        assert store.models_referencing("idealFunctionality", if_id) == ["IdealOnlyCopy"]
+        assert store.models_referencing("compInter", "missing") == []
+
+    def test_etags(self, store):
+        etag, catalog_etag = store.etag("IdealOnly1"), store.catalog_etag()
+        assert store.etag("IdealOnly1") == etag
+        assert store.etag("IdealOnly2") != etag
+        store.patch("IdealOnly1", 0, [{"op": "add", "path": "/comment", "value": "x"}])
+        assert store.etag("IdealOnly1") not in (etag, store.etag("IdealOnly2"))
+        assert store.catalog_etag() != catalog_etag
+        etag, catalog_etag = store.etag("IdealOnly1"), store.catalog_etag()
+        store.save("IdealOnly1", store.load("IdealOnly1"))
+        assert store.etag("IdealOnly1") != etag
+        store.remove("IdealOnly2")
+        assert store.catalog_etag() != catalog_etag
+        with pytest.raises(FileNotFoundError):
+            store.etag("IdealOnly2")
+
+    def test_listing(self, store):
+        names = [meta["name"] for meta in store.listing()]
+        assert names == sorted(names) and "CorruptedModel" in names
+        assert [meta["name"] for meta in store.listing(descending=True)] == names[::-1]
+        # a page continues strictly after the key it is given, in either direction
+        assert [meta["name"] for meta in store.listing(after=("FullModel1", "FullModel1"))] == \
+            names[names.index("FullModel1") + 1:]
+        assert [meta["name"] for meta in store.listing(descending=True, after=("FullModel1", "FullModel1"))] == \
+            names[:names.index("FullModel1")][::-1]
+        assert [meta["name"] for meta in store.listing(prefix="IdealOnly")] == ["IdealOnly1", "IdealOnly2"]
+        assert list(store.listing(prefix="Missing")) == []
+        full_data = store.load("IdealOnly2")
+        full_data["lastModified"] = time.time() + 1000
+        store.save("IdealOnly2", full_data)
+        newest = [meta["id"] for meta in store.listing("lastModified", descending=True)]
+        assert newest[0] == "IdealOnly2" and newest[-1] == "CorruptedModel"
+        assert [meta["id"] for meta in store.listing("lastModified", prefix="Ideal")][-1] == "IdealOnly2"
+
+    def test_migrate(self, store):
+        store.migrate("FullModel1")
+        full_data = store.load("FullModel1")
+        assert full_data["modelVersion"] == "1.3"
+        assert full_data["model"]["modelVersion"] == "1.3"
+
+    def test_outdated(self, store, monkeypatch):
+        assert sorted(store.outdated()) == ["FullModel1", "IdealOnly1", "IdealOnly2", "ReadOnlyModel"]
+        store.migrate("FullModel1")
+        assert "FullModel1" not in store.outdated()
+        # a model that fails to convert is not read again until it changes
+        calls = []
+
+        def broken(full_data):
+            calls.append(full_data)
+            raise KeyError("stateMachines")
+        monkeypatch.setattr(modelStore, "convert_model", broken)
+        store.migrate("IdealOnly1")
+        store.migrate("IdealOnly1")
+        assert len(calls) == 1 and "IdealOnly1" in store.outdated()
+
+
+class TestSniffVersion:
+    def test_sniff_version(self, tmp_path):
+        assert sniff_version(MODELS_DIR / "FullModel1.json") == "1.2"
+        full_data = json.loads((MODELS_DIR / "FullModel1.json").read_text())
+        convert_model(full_data)
+        (tmp_path / "indented.json").write_text(json.dumps(full_data, indent=2))
+        assert sniff_version(tmp_path / "indented.json") == "1.3"
+        # key order does not matter, other layouts are not sniffed
+        (tmp_path / "first.json").write_text(json.dumps({"modelVersion": "1.3", **full_data}, indent=2))
+        assert sniff_version(tmp_path / "first.json") == "1.3"
+        (tmp_path / "compact.json").write_text(json.dumps(full_data))
+        assert sniff_version(tmp_path / "compact.json") is None
+
+    def test_convert_files_skips_current(self, tmp_path):
+        full_data = json.loads((MODELS_DIR / "FullModel1.json").read_text())
+        convert_model(full_data)
+        current = tmp_path / "Current.json"
+        current.write_text(json.dumps(full_data, indent=2))
+        old = tmp_path / "Old.json"
+        old.write_bytes((MODELS_DIR / "IdealOnly1.json").read_bytes())
+        before = current.stat().st_mtime_ns
+        convert_files([current, old])
+        assert current.stat().st_mtime_ns == before
+        assert sniff_version(old) == "1.3"
+
+
+def older_model(full_data: dict, version: str | None) -> dict:
+    """A copy of a 1.2 model made to look like it was saved by an older version."""
+    full_data = json.loads(json.dumps(full_data))
+    model = full_data["model"]
+    if version is None:
+        del full_data["modelVersion"], model["modelVersion"]
+    else:
+        full_data["modelVersion"] = model["modelVersion"] = version
+    if version in ("1.0", "1.1", None):
+        transitions = model["stateMachines"]["transitions"]
+        for i, transition in enumerate(transitions):
+            # keep some handles and names, so both the fill-in and the reset are covered
+            for key in (("name", "sourceHandle") if i % 2 else ("targetHandle",)):
+                transition.pop(key, None)
+        for state in model["stateMachines"]["states"]:
+            state["left"] += 245
+            state["top"] += 100
+        machines = model["stateMachines"]["stateMachines"]
+        if transitions:
+            # one state machine with parallel transitions only, listed twice, plus a dangling id
+            parallel = [dict(transitions[0], id=f"parallel-{i}") for i in range(3)]
+            for transition in parallel[1:]:
+                transition.pop("sourceHandle", None)
+                transition.pop("targetHandle", None)
+            transitions.extend(parallel)
+            machines.append({"id": "parallel", "initState": "", "states": [],
+                             "transitions": [t["id"] for t in parallel] + ["parallel-0", "missing"]})
+    if version in ("1.0", None):
+        for paramInter in model["realFunctionality"]["parameterInterfaces"]:
+            del paramInter["left"], paramInter["top"], paramInter["color"]
+    return full_data
+
+
+class TestMigrations:
+    """Test the migration steps and the bulk migrator"""
+
+    @pytest.fixture
+    def json_store(self, tmp_path):
+        for fp in MODELS_DIR.glob("*.json"):
+            (tmp_path / fp.name).write_bytes(fp.read_bytes())
+        return JsonModelStore(str(tmp_path))
+
+    @pytest.mark.parametrize("version", [None, "1.0", "1.1", "1.2", "1.3"])
+    @pytest.mark.parametrize("name", ["FullModel1", "IdealOnly1", "IdealOnly2", "ReadOnlyModel"])
+    def test_same_as_legacy(self, name, version):
+        full_data = older_model(json.loads((MODELS_DIR / f"{name}.json").read_text()), version)
+        expected = json.loads(json.dumps(full_data))
+        changed = convert_model(full_data)
+        assert changed == legacyReconciliation.convert_model(expected)
+        # byte for byte, so the saved files do not change either
+        assert json.dumps(full_data, indent=2) == json.dumps(expected, indent=2)
+
+    def test_migrate_directory(self, json_store, tmp_path, capsys):
+        json_store.catalog()
+        before = {fp.name: fp.read_bytes() for fp in tmp_path.glob("*.json")}
+        counts = migrate_directory(str(tmp_path), workers=2, dry_run=True)
+        assert counts["would update"] == 4 and counts["corrupted"] == 1
+        assert {fp.name: fp.read_bytes() for fp in tmp_path.glob("*.json")} == before
+        assert not (tmp_path / ".migration-checkpoint").exists()
+        # an interrupted run left FullModel1 done: it is not looked at again
+        stamp = list(file_stamp(str(tmp_path / "FullModel1.json"))[0])
+        (tmp_path / ".migration-checkpoint").write_text(json.dumps({"id": "FullModel1", "stamp": stamp}) + "\n{\"id\": \"Ide")
+        counts = migrate_directory(str(tmp_path), workers=2)
+        assert counts["updated"] == 3 and counts["resumed"] == 1
+        assert "IdealOnly1: updated 1.2 -> 1.3" in capsys.readouterr().out
+        assert not (tmp_path / ".migration-checkpoint").exists()
+        assert sniff_version(tmp_path / "FullModel1.json") == "1.2"
+        assert json_store.load("IdealOnly1")["modelVersion"] == "1.3"
+        assert json_store.load("IdealOnly1")["revision"] == 1
+        assert sorted(json_store.outdated()) == ["FullModel1"]
+
+    def test_migrate_database_waits_for_writers(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.setattr(modelStore, "LOCK_TIMEOUT_SECONDS", 0.05)
+        store = SqliteModelStore(str(tmp_path / "models.sqlite3"))
+        import_directory(str(MODELS_DIR), store)
+        outdated = SqliteModelStore.outdated
+
+        def busy_writer():
+            other = modelStore.open_sqlite(store.database)
+            other.execute("BEGIN IMMEDIATE")
+            holding.set()
+            time.sleep(0.3)
+            other.execute("ROLLBACK")
+
+        def outdated_then_busy(self):
+            # once the run has started, a writer keeps the database for longer than the lock timeout
+            thread = threading.Thread(target=busy_writer)
+            thread.start()
+            holding.wait()
+            return outdated(self)
+        holding = threading.Event()
+        monkeypatch.setattr(SqliteModelStore, "outdated", outdated_then_busy)
+        counts = migrate_database(store.database)
+        monkeypatch.undo()
+        assert counts["updated"] == 4 and not counts["failed"]
+        assert "IdealOnly1: updated 1.2 -> 1.3" in capsys.readouterr().out
+        assert store.outdated() == []
+
+    def test_steps_reach_current(self):
+        version, seen = "1.0", set()
+        while version != CURRENT_VERSION:
+            assert version not in seen
+            seen.add(version)
+            version, _ = MIGRATIONS[version]
+
+
+class TestModelCache:
+    """Test the parsed-model cache of the JSON store"""
+
+    @pytest.fixture
+    def json_store(self, tmp_path):
+        for fp in MODELS_DIR.glob("*.json"):
+            (tmp_path / fp.name).write_bytes(fp.read_bytes())
+        return JsonModelStore(str(tmp_path))
+
+    def test_hits_and_revalidation(self, json_store, tmp_path):
+        first = json_store.load_cached("FullModel1")
+        assert json_store.load_cached("FullModel1") is first
+        assert json_store.cache.hits == 1
+        assert json_store.cache.misses == 1
+        full_data = json.loads((tmp_path / "FullModel1.json").read_text())
+        full_data["readOnly"] = "someone else/abc/def"
+        # written behind the store's back; the stat stamp must catch it
+        (tmp_path / "FullModel1.json").write_text(json.dumps(full_data))
+        assert json_store.load_cached("FullModel1")["readOnly"] == "someone else/abc/def"
+        assert json_store.cache.misses == 2
+
+    def test_corrupted_is_cached(self, json_store):
+        for _ in range(2):
+            with pytest.raises(json.JSONDecodeError):
+                json_store.load_cached("CorruptedModel")
+        assert json_store.cache.hits == 1
+
+    def test_lru_eviction(self, json_store, tmp_path):
+        size = (tmp_path / "IdealOnly1.json").stat().st_size
+        json_store.cache = ModelCache(size + 1)
+        json_store.load_cached("IdealOnly1")
+        json_store.load_cached("IdealOnly2")
+        assert json_store.cache.evictions == 1
+        assert list(json_store.cache.entries) == ["IdealOnly2"]
+        assert json_store.cache.nbytes <= json_store.cache.max_bytes
+
+
+class TestCorpusGenerator:
+    """Test the synthetic models of corpusGenerator"""
+
+    def test_deterministic(self, tmp_path):
+        populate(tmp_path / "a", 12, seed=1, subfunctionalities=2)
+        populate(tmp_path / "b", 12, seed=1, subfunctionalities=2)
+        populate(tmp_path / "c", 12, seed=2, subfunctionalities=2)
+        files = {fp.name: fp.read_bytes() for fp in (tmp_path / "a").glob("*.json")}
+        assert len(files) == 12
+        assert files == {fp.name: fp.read_bytes() for fp in (tmp_path / "b").glob("*.json")}
+        assert files["Synth3.json"] != (tmp_path / "c" / "Synth3.json").read_bytes()
+
+    def test_references(self):
+        ideal = ideal_refs(generate_model("Ideal", parties=0, messages=30))
+        full_data = generate_model("Real", parties=3, subfunctionalities=2, parameterInterfaces=1, compInters=5,
+                                   basicInters=20, messages=50, states=40, transitions=200, ideals=[ideal])
+        model = full_data["model"]
+        interfaces = model["interfaces"]
+        assert (len(interfaces["compInters"]), len(interfaces["basicInters"]), len(interfaces["messages"])) == (5, 20, 50)
+        basicIds = {basicInter["id"] for basicInter in interfaces["basicInters"]}
+        instances = {instance["idOfInstance"] for compInter in interfaces["compInters"] for instance in compInter["basicInterfaces"]}
+        assert all(instance["idOfBasic"] in basicIds for compInter in interfaces["compInters"] for instance in compInter["basicInterfaces"])
+        assert {messageId for basicInter in interfaces["basicInters"] for messageId in basicInter["messages"]} == \
+            {message["id"] for message in interfaces["messages"]}
+        for party in model["parties"]["parties"]:
+            assert party["basicDirectInterface"] in instances and party["basicAdversarialInterface"] in instances
+        assert model["idealFunctionality"]["basicAdversarialInterface"] in basicIds
+        assert model["simulator"]["realFunctionality"] == model["realFunctionality"]["id"]
+        machines = model["stateMachines"]
+        assert (len(machines["states"]), len(machines["transitions"])) == (40, 200)
+        assert {machine["id"] for machine in machines["stateMachines"]} == \
+            {owner["stateMachine"] for owner in [model["idealFunctionality"], model["simulator"], *model["parties"]["parties"]]}
+        messageIds = {message["id"] for message in interfaces["messages"]} | {message["id"] for message in ideal["messages"]}
+        externalIds = set(model["realFunctionality"]["subfunctionalities"]) | \
+            {paramInter["id"] for paramInter in model["realFunctionality"]["parameterInterfaces"]}
+        transitions = {transition["id"]: transition for transition in machines["transitions"]}
+        for machine in machines["stateMachines"]:
+            assert machine["initState"] in machine["states"]
+            for transitionId in machine["transitions"]:
+                transition = transitions[transitionId]
+                assert transition["fromState"] in machine["states"] and transition["toState"] in machine["states"]
+                for reference in (transition["inMessage"], transition["outMessage"]):
+                    messageId, _, owner = reference.partition("/")
+                    assert messageId in messageIds and (not owner or owner in externalIds)
+        assert any("/" in transition["inMessage"] for transition in transitions.values())
+
+    @pytest.mark.parametrize("version", [None, "1.0", "1.1", "1.2"])
+    def test_older_versions(self, version):
+        ideal = ideal_refs(generate_model("Ideal", parties=0))
+        current = generate_model("Real", subfunctionalities=1, parameterInterfaces=1, ideals=[ideal])
+        older = generate_model("Real", subfunctionalities=1, parameterInterfaces=1, ideals=[ideal], version=version)
+        assert older.get("modelVersion") == version and older != current
+        assert convert_model(older)
+        assert older == current
+
+    def test_catalog(self, tmp_path):
+        populate(tmp_path, 20, subfunctionalities=1, parameterInterfaces=1, versions=("1.2", CURRENT_VERSION))
+        entries = JsonModelStore(str(tmp_path)).catalog()
+        assert len(entries) == 20 and not any(entry.get("corrupted") for entry in entries)
+        assert {entry["modelVersion"] for entry in entries} == {"1.2", CURRENT_VERSION}
+        assert all(len(entry["compInterfaces"]) == 2 for entry in entries)
+
+
+class TestCatalog:
+    """Test the .catalog index kept next to the JSON models"""
+
+    @pytest.fixture
+    def json_store(self, tmp_path):
+        for fp in MODELS_DIR.glob("*.json"):
+            (tmp_path / fp.name).write_bytes(fp.read_bytes())
+        return JsonModelStore(str(tmp_path))
+
+    def test_built_when_missing(self, json_store, tmp_path):
+        assert not (tmp_path / ".catalog").exists()
+        entries = {entry["id"]: entry for entry in json_store.catalog()}
+        assert (tmp_path / ".catalog").exists()
+        assert entries["CorruptedModel"] == {"id": "CorruptedModel", "name": "CorruptedModel", "corrupted": True}
+        assert entries["IdealOnly1"]["idealFunctionality"]["idealFunctionality_id"] == "4272dfb5-66d5-520a-c454-a67085c4aa37"
+        assert [comp["compInterface_name"] for comp in entries["IdealOnly1"]["compInterfaces"]] == ["IdealDir"]
+
+    def test_follows_writes(self, json_store):
+        json_store.catalog()
+        full_data = json_store.load("IdealOnly1")
+        full_data["lastModified"] = 1.0
+        json_store.save("IdealOnly1", full_data)
+        full_data["model"]["name"] = "IdealOnlyCopy"
+        json_store.save("IdealOnlyCopy", full_data)
+        json_store.remove("IdealOnly2")
+        entries = {entry["id"]: entry for entry in JsonModelStore(json_store.directory).catalog()}
+        assert entries["IdealOnly1"]["lastModified"] == 1.0
+        assert entries["IdealOnlyCopy"]["name"] == "IdealOnlyCopy"
+        assert "IdealOnly2" not in entries
+
+    def test_rebuild(self, json_store, tmp_path):
+        json_store.catalog()
+        (tmp_path / "FullModel1.json").rename(tmp_path / "Renamed.json")
+        assert "FullModel1" in {entry["id"] for entry in json_store.catalog()}
+        assert json_store.catalog_index.rebuild() == 5
+        ids = {entry["id"] for entry in json_store.catalog()}
+        assert "Renamed" in ids and "FullModel1" not in ids
+
+
+class TestLockRegistry:
+    """Test lock ownership kept outside the model bodies"""
+
+    @pytest.fixture
+    def locks(self, tmp_path):
+        return LockRegistry(str(tmp_path / "locks.sqlite3"))
+
+    def test_lock_release(self, locks):
+        assert locks.try_lock("Model1", "user1/abc/def") == ("user1/abc/def", True)
+        assert locks.try_lock("Model1", "user1/abc/def") == ("user1/abc/def", False)
+        assert locks.try_lock("Model1", "user2/xyz/uvw") == ("user1/abc/def", False)
+        locks.lock("Model1", "user2/xyz/uvw")
+        assert locks.owner("Model1") == "user2/xyz/uvw"
+        locks.release("Model1")
+        assert locks.owner("Model1") == ""
+        assert locks.owners() == {}
+
+    def test_lease_expiry(self, locks):
+        locks.lease = -1
+        locks.lock("Model1", "user1/abc/def")
+        assert locks.owner("Model1") == ""
+        assert locks.try_lock("Model1", "user2/xyz/uvw") == ("user2/xyz/uvw", True)
+
+    def test_reopen_renews_lease(self, locks):
+        def expires():
+            return locks.connection().execute("SELECT expires FROM locks WHERE model_id = 'Model1'").fetchone()[0]
+        locks.lock("Model1", "user1/abc/def")
+        locks.connection().execute("UPDATE locks SET expires = ? WHERE model_id = 'Model1'", (time.time() + 1,))
+        assert locks.try_lock("Model1", "user1/abc/def") == ("user1/abc/def", False)
+        assert expires() > time.time() + locks.lease - 5
+        # someone else's attempt leaves the lease alone
+        locks.connection().execute("UPDATE locks SET expires = ? WHERE model_id = 'Model1'", (time.time() + 1,))
+        assert locks.try_lock("Model1", "user2/xyz/uvw") == ("user1/abc/def", False)
+        assert expires() < time.time() + 5
+
+    def test_release_session(self, locks):
+        locks.lock("Model1", "user1/abc/def")
+        locks.lock("Model2", "user1/abc/ghi")
+        locks.lock("Model3", "user1/xyz/def")
+        locks.lock("Model4", "user2/abc/def")
+        assert sorted(locks.release_session("user1", "abc")) == ["Model1", "Model2"]
+        assert locks.owners() == {"Model3": "user1/xyz/def", "Model4": "user2/abc/def"}
+
+    def test_model_body_untouched(self, store):
+        before = store.load("IdealOnly1")
+        store.locks.lock("IdealOnly1", "user1/abc/def")
+        store.locks.release("IdealOnly1")
+        assert store.load("IdealOnly1") == before
+
+    def test_adopt_legacy_lock(self, store):
+        full_data = store.load("IdealOnly1")
+        full_data["readOnly"] = "user1/abc/def"
+        full_data["lastModified"] = time.time()
+        full_data["model"]["name"] = "LegacyLocked"
+        store.save("LegacyLocked", full_data)
+        if isinstance(store, SqliteModelStore):
+            store.backfill()
+        else:
+            store.catalog_index.rebuild()
+        assert store.locks.owner("LegacyLocked") == "user1/abc/def"
+
+
+class TestEventLog:
+    """Test model events shared through the lock registry's database"""
+
+    def test_publish_wait(self, tmp_path):
+        database = str(tmp_path / "locks.sqlite3")
+        events = EventLog(database, poll_seconds=0.01)
+        # another worker's log on the same database
+        other = EventLog(database)
+        seq = other.publish("lock-acquired", "Model1", owner="user1/abc/def")
+        assert events.wait(0, timeout=5) == [{"id": seq, "event": "lock-acquired", "model": "Model1", "owner": "user1/abc/def"}]
+        assert events.wait(seq, timeout=0.05) == []
+        waiter = threading.Timer(0.05, other.publish, ("model-deleted", "Model1"))
+        waiter.start()
+        assert [event["event"] for event in events.wait(seq, timeout=5)] == ["model-deleted"]
+        assert [event["id"] for event in events.since(0)] == [seq, seq + 1]
+        with pytest.raises(ValueError):
+            events.publish("model-renamed", "Model1")
+
+    def test_prune(self, tmp_path):
+        events = EventLog(str(tmp_path / "locks.sqlite3"), kept=10)
+        for _ in range(100):
+            events.publish("model-updated", "Model1")
+        assert [event["id"] for event in events.since(0)] == list(range(91, 101))
+
+
+class TestLockStats:
+    """Test the contention statistics of the catalog lock"""
+
+    @pytest.fixture
+    def json_store(self, tmp_path):
+        for fp in MODELS_DIR.glob("*.json"):
+            (tmp_path / fp.name).write_bytes(fp.read_bytes())
+        return JsonModelStore(str(tmp_path), fsync="off")
+
+    def test_contended_catalog_lock(self, json_store, tmp_path, monkeypatch):
+        stats = LockStats(window=60, top=5, directory=str(tmp_path / "lockstats"))
+        monkeypatch.setattr(lockStats, "stats", stats)
+        catalog = json_store.catalog_index
+        held = threading.Event()
+
+        def hold():
+            serverMetrics.begin("/model/<id>", "PATCH")
+            with catalog.locked("FullModel1"):
+                held.set()
+                time.sleep(0.2)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+        serverMetrics.begin("/model/<id>", "PUT")
+        json_store.save("FullModel1", json_store.load("FullModel1"))
+        thread.join()
+        report = stats.report()
+        assert report["workers"] == [os.getpid()]
+        [entry] = report["locks"]
+        assert entry["file"] == catalog.lock_path and entry["model"] == "FullModel1"
+        assert entry["acquired"] == 2 and entry["contended"] == 1
+        assert entry["max_wait_seconds"] >= 0.1 and entry["max_hold_seconds"] >= 0.1
+        assert entry["waiting_routes"] == {"PUT /model/<id>": 1}
+        assert entry["last_holder"] == {"pid": os.getpid(), "route": "PATCH /model/<id>"}
+        # another worker's snapshot is merged in
+        other = {**stats.snapshot(), "pid": os.getppid()}
+        (tmp_path / "lockstats").mkdir()
+        (tmp_path / "lockstats" / f"{os.getppid()}.json").write_text(json.dumps(other))
+        assert stats.report()["locks"][0]["contended"] == 2
+
+
+class TestLockTimeout:
+    """Test lock acquisition gives up at its deadline"""
+
+    def test_catalog_lock(self, tmp_path, monkeypatch):
+        stats = LockStats(directory=str(tmp_path / "lockstats"))
+        monkeypatch.setattr(lockStats, "stats", stats)
+        store = JsonModelStore(str(tmp_path), fsync="off")
+        catalog = store.catalog_index
+        with open(catalog.lock_path, "a") as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            start = time.monotonic()
+            with pytest.raises(LockTimeout):
+                with catalog.locked("Model1", timeout=0.1):
+                    pass
+            assert 0.1 <= time.monotonic() - start < 1
+            with pytest.raises(LockTimeout):
+                with modelStore.locked_open(catalog.lock_path, "r", fcntl.LOCK_SH, timeout=0):
+                    pass
+            fcntl.flock(lock_fp, fcntl.LOCK_UN)
+        with catalog.locked("Model1", timeout=0):
+            pass
+        [entry] = [entry for entry in stats.snapshot()["locks"] if entry["model"] == "Model1"]
+        assert (entry["timed_out"], entry["acquired"]) == (1, 1)
+
+    def test_sqlite_busy(self, tmp_path):
+        store = SqliteModelStore(str(tmp_path / "models.sqlite3"))
+        import_directory(str(MODELS_DIR), store)
+        other = modelStore.open_sqlite(store.database)
+        other.execute("BEGIN IMMEDIATE")
+        with pytest.raises(LockTimeout):
+            with store.transaction(timeout=0.1):
+                pass
+        other.execute("ROLLBACK")
+        store.migrate("FullModel1", timeout=0)
+        assert store.load("FullModel1")["modelVersion"] == CURRENT_VERSION
+
+
+class TestAtomicWrite:
+    """Test the temp file + fsync + rename write pipeline"""
+
+    @pytest.mark.parametrize("fsync", ["on", "group", "off"])
+    def test_replaces_contents(self, tmp_path, fsync):
+        target = tmp_path / "model.json"
+        target.write_bytes(b"old")
+        atomic_write(str(target), b"new", fsync)
+        assert target.read_bytes() == b"new"
+        assert [fp.name for fp in tmp_path.iterdir()] == ["model.json"]
+
+    def test_failed_write_keeps_target(self, tmp_path):
+        target = tmp_path / "model.json"
+        target.mkdir()
+        with pytest.raises(OSError):
+            atomic_write(str(target), b"new", "on")
+        assert target.is_dir()
+        assert [fp.name for fp in tmp_path.iterdir()] == ["model.json"]
+
+    def test_group_commit(self, tmp_path, monkeypatch):
+        group = GroupCommit()
+        monkeypatch.setattr(atomicWrite, "group_commit", group)
+
+        def write(i):
+            for j in range(20):
+                atomic_write(str(tmp_path / f"model{i}.json"), f"{i}/{j}".encode(), "group")
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(fp.name for fp in tmp_path.iterdir()) == sorted(f"model{i}.json" for i in range(8))
+        assert all((tmp_path / f"model{i}.json").read_text() == f"{i}/19" for i in range(8))
+        assert group.writes == 160
+        assert group.batches <= group.writes
+
+    def test_readers_never_see_partial_model(self, tmp_path):
+        for fp in MODELS_DIR.glob("*.json"):
+            (tmp_path / fp.name).write_bytes(fp.read_bytes())
+        store = JsonModelStore(str(tmp_path), fsync="off")
+        full_data = store.load("FullModel1")
+        done = threading.Event()
+
+        def write():
+            for i in range(200):
+                full_data["lastModified"] = i
+                store.save("FullModel1", full_data)
+            done.set()
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        while not done.is_set():
+            assert store.load("FullModel1")["model"]["name"] == "FullModel1"
+        thread.join()
+
+
+class TestPatch:
+    """Test JSON Patch saves and their patch log"""
+
+    def test_apply_patch(self):
+        doc = {"a": {"b": [1, 2]}, "c": {"d": 1}}
+        patched = apply_patch(doc, [
+            {"op": "add", "path": "/a/b/-", "value": 3},
+            {"op": "add", "path": "/a/b/0", "value": 0},
+            {"op": "replace", "path": "/c/d", "value": 2},
+            {"op": "copy", "from": "/c", "path": "/e"},
+            {"op": "move", "from": "/e/d", "path": "/f~1g"},
+            {"op": "remove", "path": "/a/b/1"},
+            {"op": "test", "path": "/f~1g", "value": 2},
+        ])
+        assert patched == {"a": {"b": [0, 2, 3]}, "c": {"d": 2}, "e": {}, "f/g": 2}
+        assert doc == {"a": {"b": [1, 2]}, "c": {"d": 1}}
+        for operations in ([{"op": "remove", "path": "/x"}], [{"op": "add", "path": "/a/b/5", "value": 0}],
+                           [{"op": "test", "path": "/c/d", "value": 2}], [{"op": "move", "from": "/a", "path": "/a/b"}],
+                           [{"op": "frobnicate", "path": "/a"}], {"op": "remove", "path": "/a"}):
+            with pytest.raises(JsonPatchError):
+                apply_patch(doc, operations)
+
+    def test_patch(self, store):
+        full_data = store.load("IdealOnly1")
+        patched = store.patch("IdealOnly1", 0, [{"op": "replace", "path": "/idealFunctionality/name", "value": "F2"}])
+        assert patched["revision"] == 1
+        assert store.load("IdealOnly1") == patched
+        assert store.load("IdealOnly1")["model"]["idealFunctionality"]["name"] == "F2"
+        assert store.entry("IdealOnly1")["idealFunctionality"]["idealFunctionality_name"] == "F2"
+        assert full_data["model"]["idealFunctionality"]["name"] != "F2"
+        with pytest.raises(RevisionConflict) as e:
+            store.patch("IdealOnly1", 0, [])
+        assert e.value.revision == 1
+        with pytest.raises(JsonPatchError):
+            store.patch("IdealOnly1", 1, [{"op": "replace", "path": "/name", "value": "Other"}])
+        assert store.load("IdealOnly1")["revision"] == 1
+
+    def test_save_drops_patches(self, store):
+        store.patch("IdealOnly1", 0, [{"op": "replace", "path": "/idealFunctionality/name", "value": "F2"}])
+        full_data = store.load("IdealOnly1")
+        full_data["model"]["idealFunctionality"]["name"] = "F3"
+        store.save("IdealOnly1", full_data)
+        assert store.load("IdealOnly1")["model"]["idealFunctionality"]["name"] == "F3"
+        store.patch("IdealOnly1", 1, [{"op": "replace", "path": "/idealFunctionality/name", "value": "F4"}])
+        assert store.load("IdealOnly1")["model"]["idealFunctionality"]["name"] == "F4"
+
+    def test_migrate_keeps_concurrent_patch(self, store, monkeypatch):
+        # a patch committed after migrate checked the version, before it takes the write lock
+        owner = store.catalog_index if isinstance(store, JsonModelStore) else store
+        name = "updating" if isinstance(store, JsonModelStore) else "transaction"
+        locked = getattr(owner, name)
+
+        def patch_first(*args, **kwargs):
+            monkeypatch.setattr(owner, name, locked)
+            thread = threading.Thread(target=store.patch, args=(
+                "FullModel1", 0, [{"op": "replace", "path": "/idealFunctionality/left", "value": 250}]))
+            thread.start()
+            thread.join()
+            return locked(*args, **kwargs)
+        monkeypatch.setattr(owner, name, patch_first)
+        store.migrate("FullModel1")
+        full_data = store.load("FullModel1")
+        assert full_data["modelVersion"] == CURRENT_VERSION
+        assert (full_data["revision"], full_data["model"]["idealFunctionality"]["left"]) == (2, 250)
+
+    def test_compaction(self, store, tmp_path, monkeypatch):
+        monkeypatch.setattr(modelStore, "PATCH_COMPACT_AFTER", 3)
+        for revision in range(5):
+            store.patch("IdealOnly1", revision, [{"op": "replace", "path": "/idealFunctionality/name", "value": f"F{revision}"}])
+        if isinstance(store, JsonModelStore):
+            assert [record["revision"] for record in store.read_log("IdealOnly1")] == [4, 5]
+            assert json.loads((tmp_path / "IdealOnly1.json").read_text())["revision"] == 3
+        full_data = store.load("IdealOnly1")
+        assert full_data["revision"] == 5
+        assert full_data["model"]["idealFunctionality"]["name"] == "F4"
+
+    def test_torn_log_record(self, tmp_path):
+        for fp in MODELS_DIR.glob("*.json"):
+            (tmp_path / fp.name).write_bytes(fp.read_bytes())
+        store = JsonModelStore(str(tmp_path))
+        store.patch("IdealOnly1", 0, [{"op": "replace", "path": "/idealFunctionality/name", "value": "F2"}])
+        with open(tmp_path / "IdealOnly1.patches", "a") as fp:
+            fp.write('{"revision": 2, "patch": [')
+        assert JsonModelStore(str(tmp_path)).load("IdealOnly1")["revision"] == 1
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import jwt
+import requests
+from requests.adapters import HTTPAdapter
+from jwt.exceptions import InvalidTokenError
+
+# (connect, read) timeouts of the requests to Keycloak
+KEY_TIMEOUT = (3.05, 10)
+# A token signed with an unknown kid refreshes the keys at most this often.
+KEY_MISS_REFRESH_SECONDS = 30
+
+def realm_public_key(public_key: str) -> str:
+    return f"-----BEGIN PUBLIC KEY-----\n{public_key}\n-----END PUBLIC KEY-----"
+
+class KeyStore:
+    """KeyStore(realm_uri, refresh_seconds) -> the realm's token signing keys by kid
+
+       The keys come from the realm's JWKS endpoint, plus the realm's own
+       `public_key` for tokens without a `kid`. `start` fetches them and
+       keeps refreshing them from a daemon thread through one pooled
+       session; a token signed with a kid not seen yet refreshes them early,
+       so a Keycloak key rotation needs no restart. A refresh that fails
+       keeps the previous keys.
+    """
+
+    def __init__(self, realm_uri: str, refresh_seconds=300, jwks_uri: str | None = None):
+        self.realm_uri = realm_uri
+        self.jwks_uri = jwks_uri or f'{realm_uri.rstrip("/")}/protocol/openid-connect/certs'
+        self.refresh_seconds = refresh_seconds
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.keys = {}
+        self.refreshed = None
+        self.refresh_lock = threading.Lock()
+        # called with the new set of kids after every successful refresh
+        self.listeners = []
+        self.pid = None
+
+    def fetch(self) -> dict:
+        """fetch() -> kid -> key, with the realm public key under None"""
+        keys = {}
+        try:
+            r = self.session.get(self.jwks_uri, timeout=KEY_TIMEOUT)
+            r.raise_for_status()
+            for jwk in r.json().get('keys', []):
+                if jwk.get('use', 'sig') != 'sig' or 'kid' not in jwk:
+                    continue
+                try:
+                    keys[jwk['kid']] = jwt.PyJWK(jwk).key
+                except jwt.PyJWKError:
+                    continue # an algorithm this server does not verify
+        except (requests.RequestException, ValueError) as e:
+            logging.warning(f'Could not fetch signing keys from {self.jwks_uri}: {e}')
+        try:
+            r = self.session.get(self.realm_uri, timeout=KEY_TIMEOUT)
+            r.raise_for_status()
+            keys[None] = realm_public_key(r.json()['public_key'])
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logging.warning(f'Could not fetch the public key of {self.realm_uri}: {e}')
+        return keys
+
+    def refresh(self, min_age: float = 0) -> None:
+        """Fetches the keys again unless they were fetched less than `min_age` seconds ago."""
+        with self.refresh_lock:
+            if self.refreshed is not None and time.monotonic() - self.refreshed < min_age:
+                return
+            keys = self.fetch()
+            self.refreshed = time.monotonic()
+            if not keys:
+                return
+            self.keys = keys
+        for listener in self.listeners:
+            listener(set(keys))
+
+    def start(self) -> None:
+        """Fetches the keys and starts the refresh thread, once per process."""
+        with self.refresh_lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        self.refresh()
+        threading.Thread(target=self._refresh_loop, name='signing-keys', daemon=True).start()
+
+    def _refresh_loop(self) -> None:
+        while True:
+            time.sleep(self.refresh_seconds)
+            self.refresh()
+
+    def ready(self) -> bool:
+        """ready() -> whether any key is known, trying a (rate-limited) fetch if not"""
+        self.start()
+        if not self.keys:
+            self.refresh(KEY_MISS_REFRESH_SECONDS)
+        return bool(self.keys)
+
+    def key(self, kid: str | None):
+        """key(kid) -> the key a token with this kid is verified with, or None"""
+        self.start()
+        if kid not in self.keys:
+            self.refresh(KEY_MISS_REFRESH_SECONDS)
+        return self.keys.get(kid, self.keys.get(None))
+
+class TokenCache:
+    """TokenCache(max_entries) -> claims of verified tokens by token hash
+
+       An entry is dropped when its token expires, when the key that
+       verified it is no longer published, or as the least recently used
+       once `max_entries` are cached. Tokens without `exp` are not cached.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # token hash -> (exp, kid, claims)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, token: str) -> dict | None:
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None or entry[0] <= time.time():
+                self.entries.pop(digest, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(digest)
+            self.hits += 1
+            return entry[2]
+
+    def insert(self, token: str, kid: str | None, claims: dict) -> None:
+        if not isinstance(claims.get('exp'), (int, float)) or self.max_entries <= 0:
+            return
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        with self.lock:
+            self.entries[digest] = (claims['exp'], kid, claims)
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def retain(self, kids: set) -> None:
+        """Drops the tokens verified with a key that is not in `kids` any more."""
+        with self.lock:
+            for digest in [digest for digest, (_, kid, _) in self.entries.items() if kid not in kids]:
+                del self.entries[digest]
+
+def verify_token(token: str, keys: KeyStore, cache: TokenCache) -> dict:
+    """verify_token(token, keys, cache) -> the token's claims
+
+       Only a token not in `cache` has its RS256 signature checked.
+       Raises `InvalidTokenError` if the token is not valid.
+    """
+    claims = cache.lookup(token)
+    if claims is not None:
+        return claims
+    kid = jwt.get_unverified_header(token).get('kid')
+    key = keys.key(kid)
+    if key is None:
+        raise InvalidTokenError(f'No signing key for kid "{kid}"')
+    claims = jwt.decode(token, key=key, algorithms=["RS256"])
+    cache.insert(token, kid if kid in keys.keys else None, claims)
+    return claims
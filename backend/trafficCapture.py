@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""Capture of the requests the backend serves, to replay the real workload with `replayTraffic.py`.
+
+Off unless `TRAFFIC_CAPTURE_FILE` is set; both apps then append a JSON
+line per request to it once the response has been sent: when the request
+started, its method, route and path, the `HEADERS` it came with, the size
+and SHA-256 digest of its body, its status, response size and duration.
+Workers share the file, each line being a single append. Request bodies
+are only kept with `TRAFFIC_CAPTURE_BODIES=on`, as `<digest>` files in the
+directory `TRAFFIC_CAPTURE_FILE.bodies`, so the replay sends the very
+same models; without them it makes up bodies of its own.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import suppress
+from atomicWrite import atomic_write
+
+TRAFFIC_CAPTURE_FILE = os.environ.get('TRAFFIC_CAPTURE_FILE', '')
+TRAFFIC_CAPTURE_BODIES = os.environ.get('TRAFFIC_CAPTURE_BODIES', 'off') == 'on'
+# request headers kept in the capture: who sent the request, and what the replay needs to send it again
+HEADERS = ('SessionTabId', 'TestUsername', 'Content-Type', 'Model-Revision')
+
+def bodies_dir(path: str) -> str:
+    return path + '.bodies'
+
+class Capture:
+    """Capture(path, bodies) -> appends the requests of every worker to `path`"""
+
+    def __init__(self, path: str, bodies=False):
+        self.path = path
+        self.bodies = bodies
+        self.mutex = threading.Lock()
+        self.fd = None
+        self.pid = None
+
+    def _fd(self) -> int:
+        # opened once per worker; O_APPEND keeps the workers' lines whole
+        with self.mutex:
+            if self.pid != os.getpid():
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                self.pid = os.getpid()
+            return self.fd
+
+    def record(self, method: str, route: str, path: str, headers, body: bytes, status: int,
+               response_bytes: int, seconds: float) -> dict:
+        """record(method, route, path, request headers, request body, status, response bytes, duration) -> the line written"""
+        digest = hashlib.sha256(body).hexdigest() if body else ''
+        if self.bodies and body:
+            stored = os.path.join(bodies_dir(self.path), digest)
+            if not os.path.exists(stored):
+                os.makedirs(bodies_dir(self.path), exist_ok=True)
+                atomic_write(stored, body, 'off')
+        line = {'time': round(time.time() - seconds, 6), 'method': method, 'route': route, 'path': path,
+                'headers': {name: headers[name] for name in HEADERS if headers.get(name)},
+                'request_bytes': len(body), 'request_sha256': digest, 'status': status,
+                'response_bytes': response_bytes, 'duration_ms': round(seconds * 1000, 3), 'pid': os.getpid()}
+        with suppress(OSError):
+            os.write(self._fd(), (json.dumps(line) + '\n').encode('utf-8'))
+        return line
+
+# the capture both apps record into, if TRAFFIC_CAPTURE_FILE is set
+capture = Capture(TRAFFIC_CAPTURE_FILE, TRAFFIC_CAPTURE_BODIES) if TRAFFIC_CAPTURE_FILE else None